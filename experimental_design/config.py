@@ -116,3 +116,12 @@ def get_ofat_parameter_spaces():
             }
         )
     return parameter_spaces
+
+def demand_transform(point: dict, beta: float = 0.05, horizon: float = 300):
+    """
+    The demand of the experimental design notebooks: beta times the vehicles the grid can hold, released over horizon seconds.
+    Meant as the point_transform of Simulator.simulate_batch
+    """
+    gridSize, edgeLength = point['gridSize'], point['edgeLength']
+    max_number_of_vehicles = ((gridSize - 1) * gridSize * 2 + 4 * gridSize) * edgeLength / 5
+    return {**point, 'trips_generator_period': horizon / (max_number_of_vehicles * beta)}
@@ -0,0 +1,136 @@
+import functools
+import json
+import optparse
+import os
+import time
+
+import numpy as np
+from scipy import stats
+from emukit.core.initial_designs import RandomDesign
+
+import experimental_design.config as config
+from sumo_grid_simulation.grid_simulation import Simulator
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+
+"""
+    Calibration of the mesoscopic model against the microscopic one.
+
+    The same random points of the parameter space are simulated with simulate(..., model='micro') and
+    simulate(..., model='meso'), and the outputs of parse_statistics_output (plus timeLoss / duration, the output of
+    the experimental design notebooks) are compared: mean relative error, linear and rank correlation, and the linear
+    map from the meso outputs to the micro ones. A high rank correlation means meso orders the configurations like
+    micro and can be used for screening; the linear map corrects its bias.
+
+        python -m experimental_design.meso_calibration --points 50 --end-time 300
+"""
+
+# the outputs compared, statistics outputs and derived ones
+compared_outputs = ('departDelay', 'departDelayWaiting', 'duration', 'routeLength', 'speed', 'timeLoss',
+                    'waitingTime', 'timeLoss_per_duration')
+
+
+def calibration_report(simulator: Simulator, X, parameter_space, fixed_kwargs: dict = None, point_transform=None,
+                       processes: int = None):
+    """
+    Simulates the points of X with both models and compares their outputs.
+
+    :param simulator: the simulator, its settings are used for both models
+    :param X: NxM ndarray of points of parameter_space
+    :param fixed_kwargs: see Simulator.simulate_batch, must not contain model
+    :param point_transform: see Simulator.simulate_batch
+    :param processes: see Simulator.simulate_batch
+    :return: dictionary with the number of points, the wall time of each model and the comparison of every output
+    """
+    results = {}
+    times = {}
+    for model in ('micro', 'meso'):
+        start = time.time()
+        results[model] = simulator.simulate_batch(
+            X, parameter_space, fixed_kwargs={**(fixed_kwargs or {}), 'model': model},
+            point_transform=point_transform, processes=processes
+        )
+        times[model] = time.time() - start
+
+    # only the points simulated by both models are compared
+    valid = [i for i in range(len(X)) if results['micro'][i] is not None and results['meso'][i] is not None]
+
+    report = {
+        'points': len(X),
+        'failed': len(X) - len(valid),
+        'micro_time': times['micro'],
+        'meso_time': times['meso'],
+        'speedup': times['micro'] / times['meso'] if times['meso'] > 0 else float('nan'),
+        'outputs': {}
+    }
+    for output in compared_outputs:
+        micro = np.array([__output(results['micro'][i], output) for i in valid])
+        meso = np.array([__output(results['meso'][i], output) for i in valid])
+        report['outputs'][output] = __compare(micro, meso)
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['points']} points ({report['failed']} failed), "
+          f"micro {report['micro_time']:.1f} s, meso {report['meso_time']:.1f} s, speedup {report['speedup']:.1f}x")
+    print(f"{'output':<24}{'micro':>12}{'meso':>12}{'rel. error':>12}{'pearson':>10}{'spearman':>10}"
+          f"{'slope':>10}{'intercept':>12}")
+    for output, comparison in report['outputs'].items():
+        print(f"{output:<24}{comparison['micro_mean']:>12.4g}{comparison['meso_mean']:>12.4g}"
+              f"{comparison['mean_relative_error']:>12.3f}{comparison['pearson']:>10.3f}{comparison['spearman']:>10.3f}"
+              f"{comparison['slope']:>10.3f}{comparison['intercept']:>12.4g}")
+
+
+def __output(result: dict, output: str):
+    if output == 'timeLoss_per_duration':
+        return result['timeLoss'] / result['duration']
+    return result[output]
+
+
+def __compare(micro: np.ndarray, meso: np.ndarray):
+    """ Comparison of the values of an output, slope and intercept map meso to micro: micro ~ slope * meso + intercept """
+    if len(micro) < 2 or np.ptp(micro) == 0 or np.ptp(meso) == 0:
+        nan = float('nan')
+        return {'micro_mean': float(np.mean(micro)) if len(micro) else nan,
+                'meso_mean': float(np.mean(meso)) if len(meso) else nan,
+                'mean_relative_error': nan, 'pearson': nan, 'spearman': nan, 'slope': nan, 'intercept': nan}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_errors = np.abs(meso - micro) / np.abs(micro)
+    slope, intercept = np.polyfit(meso, micro, 1)
+    return {
+        'micro_mean': float(np.mean(micro)),
+        'meso_mean': float(np.mean(meso)),
+        'mean_relative_error': float(np.mean(relative_errors[np.isfinite(relative_errors)])),
+        'pearson': float(stats.pearsonr(meso, micro)[0]),
+        'spearman': float(stats.spearmanr(meso, micro)[0]),
+        'slope': float(slope),
+        'intercept': float(intercept)
+    }
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--points', type='int', default=50, help='number of random points of the parameter space')
+    opt_parser.add_option('--end-time', type='float', default=300, help='end_time of the simulations')
+    opt_parser.add_option('--beta', type='float', default=0.05, help='demand, as a fraction of the vehicles the grid can hold')
+    opt_parser.add_option('--junction-type', type='int', default=1, help='junctionType of the simulations')
+    opt_parser.add_option('--processes', type='int', default=None, help='number of worker processes')
+    opt_parser.add_option('--output', default=str(PathUtils.simulation_output_files_folder / 'meso_calibration.json'),
+                          help='json file the report is written to')
+    options, args = opt_parser.parse_args()
+
+    parameter_space = config.get_parameter_space()
+    X = RandomDesign(parameter_space).get_samples(options.points)
+
+    report = calibration_report(
+        Simulator(end_time=options.end_time), X, parameter_space,
+        fixed_kwargs={'junctionType': options.junction_type},
+        point_transform=functools.partial(config.demand_transform, beta=options.beta, horizon=options.end_time),
+        processes=options.processes
+    )
+    print_report(report)
+
+    os.makedirs(os.path.dirname(options.output) or '.', exist_ok=True)
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Report written to {options.output}')
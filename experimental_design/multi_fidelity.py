@@ -0,0 +1,181 @@
+import numpy as np
+import GPy
+
+from emukit.core import ParameterSpace, InformationSourceParameter
+from emukit.core.acquisition import Acquisition
+from emukit.core.initial_designs import RandomDesign
+from emukit.core.loop import UserFunctionWrapper
+from emukit.core.optimization import GradientAcquisitionOptimizer
+from emukit.core.optimization.multi_source_acquisition_optimizer import MultiSourceAcquisitionOptimizer
+from emukit.experimental_design.experimental_design_loop import ExperimentalDesignLoop
+from emukit.experimental_design.acquisitions import IntegratedVarianceReduction
+from emukit.model_wrappers.gpy_model_wrappers import GPyMultiOutputWrapper
+from emukit.multi_fidelity.kernels import LinearMultiFidelityKernel
+from emukit.multi_fidelity.models import GPyLinearMultiFidelityModel
+
+from sumo_grid_simulation.grid_simulation import Simulator, SimulatorUserFunction
+from sumo_grid_simulation.simulation_scripts.enums import FidelityLevel
+
+"""
+    Multi-fidelity experimental design on the simulator.
+
+    The points are simulated at the fidelity levels of Simulator.with_fidelity, and a linear multi-fidelity GP
+    (AR1: each level is a scaled version of the previous one plus a correction) learns the full fidelity outputs from
+    many cheap simulations and a few full ones. The next point and its level are the ones reducing the most the
+    integrated variance of the full fidelity predictions per unit of cost, so most of the evaluations are spent
+    on the cheap levels.
+
+    Example, with the parameter space of config.py:
+        design = MultiFidelityExperimentalDesign(
+            Simulator(end_time=300), config.get_parameter_space(), lambda s: s['timeLoss'] / s['duration'],
+            point_transform=transform
+        )
+        loop = design.run(n_init=(30, 10, 4), n_iterations=60)
+        mean, variance = design.predict(test_X)
+"""
+
+
+class FidelityCost(Acquisition):
+    """ Fixed cost of evaluating a point at its fidelity level, the last column of the inputs """
+
+    def __init__(self, costs: list):
+        """
+        :param costs: cost of each information source, in the order of the levels of the design
+        """
+        self.costs = np.asarray(costs, dtype=float)
+
+    def evaluate(self, x: np.ndarray) -> np.ndarray:
+        return self.costs[x[:, -1].astype(int)][:, None]
+
+    @property
+    def has_gradients(self) -> bool:
+        return False
+
+
+class MultiFidelityExperimentalDesign:
+
+    def __init__(self, simulator: Simulator, parameter_space: ParameterSpace, output, fixed_kwargs: dict = None,
+                 point_transform=None, processes: int = None, retries: int = 1,
+                 levels: tuple = (FidelityLevel.LOW.number, FidelityLevel.MEDIUM.number, FidelityLevel.HIGH.number),
+                 costs: list = None, n_optimization_restarts: int = 5, num_monte_carlo_points: int = 1000):
+        """
+        :param simulator: the simulator of the full fidelity
+        :param parameter_space: the emukit ParameterSpace of the simulate arguments
+        :param output: function taking the dictionary returned by simulate and returning the scalar to model
+        :param fixed_kwargs: see Simulator.simulate_batch
+        :param point_transform: see Simulator.simulate_batch
+        :param processes: see Simulator.simulate_batch
+        :param retries: see Simulator.simulate_batch
+        :param levels: the fidelity levels used, from the cheapest to the full one, see FidelityLevel in enums.py
+        :param costs: cost of a simulation at each level, defaults to Simulator.fidelity_cost
+        :param n_optimization_restarts: restarts of the optimization of the GP hyper-parameters
+        :param num_monte_carlo_points: number of full fidelity points the variance reduction is integrated over
+        """
+        assert len(levels) >= 2, 'A multi-fidelity design needs at least 2 levels'
+        assert costs is None or len(costs) == len(levels), 'costs must have one value per level'
+
+        self.parameter_space = parameter_space
+        self.output = output
+        self.levels = list(levels)
+        self.costs = list(costs) if costs is not None else [Simulator.fidelity_cost(level) for level in self.levels]
+        self.n_optimization_restarts = n_optimization_restarts
+        self.num_monte_carlo_points = num_monte_carlo_points
+
+        # the fidelity index is the last column of the inputs, as expected by the emukit multi-fidelity models
+        self.space = ParameterSpace(parameter_space.parameters + [InformationSourceParameter(len(self.levels))])
+
+        self.user_functions = [
+            SimulatorUserFunction(
+                simulator.with_fidelity(level), parameter_space, output, fixed_kwargs=fixed_kwargs,
+                point_transform=point_transform, processes=processes, retries=retries
+            )
+            for level in self.levels
+        ]
+
+        self.model = None
+        self.loop = None
+
+    def user_function(self, X: np.ndarray):
+        """ Simulates the rows of X, whose last column is the index of the fidelity level, grouped by level """
+        Y = np.empty((len(X), 1))
+        fidelities = X[:, -1].astype(int)
+        for i, user_function in enumerate(self.user_functions):
+            rows = np.flatnonzero(fidelities == i)
+            if len(rows):
+                Y[rows] = user_function(X[rows, :-1])
+        return Y
+
+    def initial_design(self, n_init: tuple):
+        """
+        Nested random design: the points of a level are the first points of the cheaper level before it,
+        which helps the model to learn the correlation between the levels.
+
+        :param n_init: number of points of each level, not increasing
+        :return: the inputs with the index of the level as last column
+        """
+        assert len(n_init) == len(self.levels), 'n_init must have one value per level'
+        assert all(a >= b for a, b in zip(n_init, n_init[1:])), 'Expensive levels cannot have more points than cheap ones'
+
+        X = RandomDesign(self.parameter_space).get_samples(n_init[0])
+        return np.vstack([
+            np.hstack([X[:n], np.full((n, 1), i)]) for i, n in enumerate(n_init)
+        ])
+
+    def build_model(self, X: np.ndarray, Y: np.ndarray):
+        """ The linear multi-fidelity GP fitted on the simulated points """
+        dimensions = len(self.parameter_space.parameters)
+        kernel = LinearMultiFidelityKernel([GPy.kern.RBF(dimensions, ARD=True) for _ in self.levels])
+        gpy_model = GPyLinearMultiFidelityModel(X, Y, kernel, n_fidelities=len(self.levels))
+
+        model = GPyMultiOutputWrapper(gpy_model, len(self.levels), n_optimization_restarts=self.n_optimization_restarts)
+        model.optimize()
+        return model
+
+    def build_loop(self, model):
+        """ Experimental design loop choosing the next point and its level by variance reduction per unit of cost """
+        # the variance reduction is measured on the full fidelity predictions
+        x_monte_carlo = RandomDesign(self.parameter_space).get_samples(self.num_monte_carlo_points)
+        x_monte_carlo = np.hstack([x_monte_carlo, np.full((len(x_monte_carlo), 1), len(self.levels) - 1)])
+
+        acquisition = IntegratedVarianceReduction(model, self.space, x_monte_carlo=x_monte_carlo) \
+            / FidelityCost(self.costs)
+        optimizer = MultiSourceAcquisitionOptimizer(GradientAcquisitionOptimizer(self.space), self.space)
+
+        return ExperimentalDesignLoop(
+            space=self.space,
+            model=model,
+            acquisition=acquisition,
+            acquisition_optimizer=optimizer,
+            batch_size=1
+        )
+
+    def run(self, n_init: tuple = (30, 10, 4), n_iterations: int = 50, init_X: np.ndarray = None,
+            init_Y: np.ndarray = None):
+        """
+        Simulates the initial design, fits the model and runs the experimental design loop.
+
+        :param n_init: points of the initial design at each level, ignored if init_X is given
+        :param n_iterations: number of points chosen by the loop
+        :param init_X: optional initial inputs, with the index of the level as last column
+        :param init_Y: outputs of init_X, simulated if missing
+        :return: the emukit loop, its loop_state holds all the simulated points
+        """
+        if init_X is None:
+            init_X = self.initial_design(n_init)
+        if init_Y is None:
+            init_Y = self.user_function(init_X)
+
+        self.model = self.build_model(init_X, init_Y)
+        self.loop = self.build_loop(self.model)
+        self.loop.run_loop(UserFunctionWrapper(self.user_function), n_iterations)
+        return self.loop
+
+    def predict(self, X: np.ndarray):
+        """ Mean and variance of the full fidelity outputs at the points X of the parameter space """
+        X = np.hstack([X, np.full((len(X), 1), len(self.levels) - 1)])
+        return self.model.predict(X)
+
+    def evaluations_per_level(self):
+        """ The number of simulations run at each level so far """
+        X = self.loop.loop_state.X
+        return {level: int(np.sum(X[:, -1] == i)) for i, level in enumerate(self.levels)}
@@ -0,0 +1,256 @@
+import datetime
+import functools
+import json
+import optparse
+import os
+import socket
+import time
+from pathlib import Path
+
+import numpy as np
+
+from sumo_grid_simulation.grid_simulation import Simulator
+
+"""
+    Headless sweeps of the simulator, split in shards that run on different machines sharing a filesystem.
+
+    A sweep is a folder holding the design (design.json: the simulate keyword arguments of every point and the
+    settings of the Simulator) and one results file per shard. The points of a shard are the ones whose index modulo
+    the number of shards is the shard number, so the shards only depend on the design and never overlap. Each node
+    runs its shard with its local process pool, appending the results to its own file as they are ready, so no two
+    nodes ever write to the same file and an interrupted shard resumes where it stopped. The shard files are then
+    merged into a single results file, in the order of the design.
+
+    Create the design, a latin hypercube over config.get_parameter_space() or a file of points:
+        python -m experimental_design.sweep design --sweep sweeps/co2 --points 1000 --method lhs --beta 0.05 \
+            --simulator '{"end_time": 300}'
+        python -m experimental_design.sweep design --sweep sweeps/co2 --points-file points.json
+
+    On each of the 10 nodes (shard 0 to 9):
+        python -m experimental_design.sweep run --sweep sweeps/co2 --shard 3 --shards 10 --processes 16
+
+    Once they are done:
+        python -m experimental_design.sweep merge --sweep sweeps/co2
+"""
+
+design_file_name = 'design.json'
+results_folder_name = 'results'
+merged_file_name = 'results.json'
+
+# design methods of sample_design
+design_methods = ('lhs', 'random')
+
+
+def sample_design(parameter_space, n: int, method: str = 'lhs', seed: int = 0):
+    """
+    Samples n points of an emukit parameter space, the same ones for the same seed.
+
+    :param method: 'lhs' for a latin hypercube (every parameter has exactly one point in each of n equal strata of
+            its range), 'random' for independent uniform samples
+    :return: NxM ndarray, one column per parameter of the parameter space
+    """
+    assert method in design_methods, 'Specified design method is not supported'
+    rng = np.random.default_rng(seed)
+
+    columns = []
+    for parameter in parameter_space.parameters:
+        if method == 'lhs':
+            u = (rng.permutation(n) + rng.random(n)) / n
+        else:
+            u = rng.random(n)
+        if hasattr(parameter, 'domain'):
+            domain = np.asarray(parameter.domain)
+            columns.append(domain[np.minimum((u * len(domain)).astype(int), len(domain) - 1)])
+        else:
+            columns.append(parameter.min + u * (parameter.max - parameter.min))
+    return np.column_stack(columns).astype(float)
+
+
+def create_sweep(folder: Path, points: list, simulator_settings: dict = None, description: dict = None):
+    """
+    Writes the design of a sweep. Creating the same sweep again is a no-op, a different one in the same folder is an error.
+
+    :param points: list of dictionaries of simulate keyword arguments
+    :param simulator_settings: keyword arguments of the Simulator running the points, it must be json serializable
+    :param description: optional information about how the points were made, kept in the design file
+    """
+    folder = Path(folder)
+    design = {'simulator': simulator_settings or {}, 'points': points}
+
+    design_file = folder / design_file_name
+    if design_file.exists():
+        existing = load_sweep(folder)
+        assert {'simulator': existing['simulator'], 'points': existing['points']} == json.loads(json.dumps(design)), \
+            'A different sweep already exists in ' + str(folder)
+        return
+
+    os.makedirs(folder / results_folder_name, exist_ok=True)
+    temporary = design_file.with_suffix('.tmp')
+    with open(temporary, 'w') as f:
+        json.dump({**design, 'description': description or {},
+                   'created': datetime.datetime.now().isoformat(timespec='seconds')}, f, indent=1)
+    # the design appears at once for the nodes polling the shared folder
+    os.replace(temporary, design_file)
+
+
+def load_sweep(folder: Path):
+    with open(Path(folder) / design_file_name) as f:
+        return json.load(f)
+
+
+def shard_indices(n: int, shard: int, shards: int):
+    """ The indices of the points of a shard, interleaved so that every shard gets a similar mix of the design """
+    assert 0 <= shard < shards, 'shard must be in [0, shards)'
+    return list(range(shard, n, shards))
+
+
+def shard_file(folder: Path, shard: int, shards: int):
+    return Path(folder) / results_folder_name / f'shard-{shard:04d}-of-{shards:04d}.jsonl'
+
+
+def read_records(file: Path):
+    """ The last record of each point in a shard file, records with a result take precedence over failed ones """
+    records = {}
+    if not Path(file).exists():
+        return records
+    with open(file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash, its point is simulated again
+                continue
+            if record['result'] is not None or record['index'] not in records:
+                records[record['index']] = record
+    return records
+
+
+def run_shard(folder: Path, shard: int, shards: int, processes: int = None, retries: int = 1, chunk: int = None):
+    """
+    Simulates the points of a shard that have no result yet, the failed ones included.
+
+    :param processes: number of worker processes, defaults to the number of cpus
+    :param retries: see Simulator.simulate_batch
+    :param chunk: points simulated between two writes of the shard file, defaults to 4 per process
+    :return: the number of points of the shard done and failed
+    """
+    sweep = load_sweep(folder)
+    simulator = Simulator(**sweep['simulator'])
+    points = sweep['points']
+    file = shard_file(folder, shard, shards)
+
+    done = {index for index, record in read_records(file).items() if record['result'] is not None}
+    todo = [index for index in shard_indices(len(points), shard, shards) if index not in done]
+    chunk = chunk or 4 * (processes or os.cpu_count())
+
+    failed = 0
+    for start in range(0, len(todo), chunk):
+        indices = todo[start:start + chunk]
+        started = time.time()
+        results = simulator.simulate_points([points[index] for index in indices], processes, retries)
+        lines = [
+            json.dumps({'index': index, 'point': points[index], 'result': result, 'node': socket.gethostname(),
+                        'finished': time.time()}, default=float)
+            for index, result in zip(indices, results)
+        ]
+        with open(file, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        failed += sum(result is None for result in results)
+        print(f'shard {shard}/{shards}: {start + len(indices)}/{len(todo)} points '
+              f'({time.time() - started:.1f} s for the last {len(indices)})')
+
+    return {'done': len(done) + len(todo) - failed, 'failed': failed}
+
+
+def merge(folder: Path):
+    """
+    Gathers the results of all the shard files of a sweep, whatever the number of shards they were run with.
+
+    :return: dictionary with the design, one {'index', 'point', 'result'} record per point in the order of the design
+            (result None if the point failed or was not run yet), and the indices of the missing and failed points
+    """
+    sweep = load_sweep(folder)
+    records = {}
+    for file in sorted((Path(folder) / results_folder_name).glob('shard-*.jsonl')):
+        for index, record in read_records(file).items():
+            if record['result'] is not None or index not in records:
+                records[index] = record
+
+    return {
+        'simulator': sweep['simulator'],
+        'description': sweep.get('description', {}),
+        'records': [{'index': index, 'point': point, 'result': records[index]['result'] if index in records else None}
+                    for index, point in enumerate(sweep['points'])],
+        'missing': [index for index in range(len(sweep['points'])) if index not in records],
+        'failed': sorted(index for index, record in records.items() if record['result'] is None)
+    }
+
+
+def design_points(n: int, method: str, seed: int, fixed_kwargs: dict = None, beta: float = None, horizon: float = 300):
+    """ The simulate keyword arguments of a design over config.get_parameter_space(), see the design command """
+    import experimental_design.config as config
+
+    parameter_space = config.get_parameter_space()
+    X = sample_design(parameter_space, n, method, seed)
+    point_transform = None if beta is None else functools.partial(config.demand_transform, beta=beta, horizon=horizon)
+    return Simulator.build_points(X, parameter_space, fixed_kwargs, point_transform)
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser(usage='%prog design|run|merge|status --sweep FOLDER [options]')
+    opt_parser.add_option('--sweep', help='folder of the sweep, on the filesystem shared by the nodes')
+    # design
+    opt_parser.add_option('--points', type='int', default=1000, help='design: number of points')
+    opt_parser.add_option('--method', default='lhs', help='design: ' + ' or '.join(design_methods))
+    opt_parser.add_option('--seed', type='int', default=0, help='design: seed of the design')
+    opt_parser.add_option('--points-file', default=None, help='design: json list of simulate keyword arguments, used instead of sampling')
+    opt_parser.add_option('--fixed', default='{}', help='design: json of the simulate arguments shared by all the points')
+    opt_parser.add_option('--beta', type='float', default=None, help='design: demand, as a fraction of the vehicles the grid can hold')
+    opt_parser.add_option('--horizon', type='float', default=300, help='design: seconds over which the demand of --beta is released')
+    opt_parser.add_option('--simulator', default='{}', help='design: json of the Simulator keyword arguments')
+    # run
+    opt_parser.add_option('--shard', type='int', default=0, help='run: shard of this node, in [0, shards)')
+    opt_parser.add_option('--shards', type='int', default=1, help='run: total number of shards')
+    opt_parser.add_option('--processes', type='int', default=None, help='run: number of worker processes')
+    opt_parser.add_option('--retries', type='int', default=1, help='run: how many times a failing point is simulated again')
+    opt_parser.add_option('--chunk', type='int', default=None, help='run: points simulated between two writes of the results')
+    # merge
+    opt_parser.add_option('--output', default=None, help='merge: merged results file, defaults to results.json in the sweep folder')
+    options, args = opt_parser.parse_args()
+
+    if len(args) != 1 or args[0] not in ('design', 'run', 'merge', 'status'):
+        opt_parser.error('a command among design, run, merge and status is required')
+    if options.sweep is None:
+        opt_parser.error('--sweep is required')
+    command = args[0]
+
+    if command == 'design':
+        fixed_kwargs = json.loads(options.fixed)
+        if options.points_file is not None:
+            with open(options.points_file) as f:
+                points = [{**fixed_kwargs, **point} for point in json.load(f)]
+            description = {'points_file': options.points_file}
+        else:
+            points = design_points(options.points, options.method, options.seed, fixed_kwargs,
+                                   options.beta, options.horizon)
+            description = {'method': options.method, 'seed': options.seed, 'fixed': fixed_kwargs,
+                           'beta': options.beta, 'horizon': options.horizon}
+        create_sweep(options.sweep, points, json.loads(options.simulator), description)
+        print(f'{len(points)} points in {Path(options.sweep) / design_file_name}')
+
+    elif command == 'run':
+        counts = run_shard(options.sweep, options.shard, options.shards, options.processes, options.retries, options.chunk)
+        print(f"shard {options.shard}/{options.shards}: {counts['done']} done, {counts['failed']} failed")
+
+    else:
+        merged = merge(options.sweep)
+        print(f"{len(merged['records'])} points: {len(merged['records']) - len(merged['missing']) - len(merged['failed'])} "
+              f"done, {len(merged['failed'])} failed, {len(merged['missing'])} not run")
+        if command == 'merge':
+            output = options.output or Path(options.sweep) / merged_file_name
+            with open(output, 'w') as f:
+                json.dump(merged, f)
+            print(f'Results written to {output}')
@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from sumo_grid_simulation.grid_simulation import Simulator
+from sumo_grid_simulation.simulation_scripts.utils import Workspace, import_sumo_module
+from sumo_grid_simulation.simulation_scripts.enums import SimulationBackend
+from sumo_grid_simulation.simulation_scripts.stage_metrics import StageMetrics
+
+
+class AsyncSimulationRunner:
+    """
+    Runs many sumo simulations from a single python process.
+
+    Every simulation is a coroutine owning a sumo instance started under its own traci label. The blocking traci
+    calls are sent to a thread pool, and since they spend their time waiting on the sumo sockets the simulations
+    progress concurrently while one event loop interleaves their stepping and the collection of their results.
+
+    Example:
+        runner = AsyncSimulationRunner(Simulator(end_time=300), max_concurrent=32)
+        results = runner.run([{'gridSize': 5}, {'gridSize': 6, 'accel': 1.5}])
+    """
+
+    def __init__(self, simulator: Simulator, max_concurrent: int = 16, steps_per_yield: int = 10):
+        """
+        :param simulator: the simulator holding the simulation settings (seed, begin and end time, ...)
+        :param max_concurrent: maximum number of sumo instances alive at the same time
+        :param steps_per_yield: number of calls of the control loop (see Simulator.advance) a simulation performs
+                before giving control back to the event loop
+        """
+        assert simulator.backend is SimulationBackend.TRACI, 'libsumo runs a single simulation per process, use the traci backend'
+        assert max_concurrent > 0, 'At least one simulation must be allowed to run'
+        assert steps_per_yield > 0, 'steps_per_yield must be at least 1'
+
+        self.simulator = simulator
+        self.max_concurrent = max_concurrent
+        self.steps_per_yield = steps_per_yield
+
+    def run(self, points: list):
+        """
+        Simulates all the points and waits for the results.
+
+        :param points: list of dictionaries of simulate keyword arguments
+        :return: list with the result of each point in the same order, the exception raised by a point replaces its result
+        """
+        return asyncio.run(self.simulate_many(points))
+
+    async def simulate_many(self, points: list):
+        """ Coroutine version of run, for callers that already have an event loop """
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        # traci.start registers the connection in module level state, so connections are opened one at a time
+        start_lock = asyncio.Lock()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            tasks = [self.simulate(point, executor, semaphore, start_lock) for point in points]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def simulate(self, point: dict, executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore,
+                       start_lock: asyncio.Lock):
+        """
+        Runs a single simulation, see Simulator.simulate. The simulations share the python process, so the cpu time
+        of their stages also counts the other simulations running at the same time
+        """
+        assert point.get('replications', 1) == 1, 'Replications are only run by Simulator.simulate and Simulator.simulate_batch'
+        loop = asyncio.get_running_loop()
+
+        stored = await loop.run_in_executor(executor, lambda: self.simulator.lookup([point])[0])
+        if stored is not None:
+            return stored
+
+        arguments = dict(point)
+        model = arguments.pop('model', 1)
+
+        traci = import_sumo_module('traci')
+        async with semaphore:
+            workspace = Workspace()
+            metrics = StageMetrics()
+            try:
+                await loop.run_in_executor(
+                    executor, lambda: self.simulator.prepare_workspace(workspace, metrics=metrics, **arguments)
+                )
+
+                with metrics.measure('sumo'):
+                    async with start_lock:
+                        await loop.run_in_executor(
+                            executor,
+                            lambda: traci.start(self.simulator.sumo_command(workspace, model), label=workspace.name)
+                        )
+                    connection = traci.getConnection(workspace.name)
+                    monitor = self.simulator.convergence_monitor()
+                    recorder = self.simulator.trajectory_recorder()
+
+                    try:
+                        running = True
+                        while running:
+                            running = await loop.run_in_executor(executor, self.__step, connection, monitor, recorder)
+                        run_outputs = self.simulator.run_outputs(connection, monitor, recorder)
+                    finally:
+                        await loop.run_in_executor(executor, connection.close)
+
+                with metrics.measure('outputs'):
+                    outputs = await loop.run_in_executor(executor, self.simulator.collect_outputs, workspace, run_outputs)
+                performance = await loop.run_in_executor(
+                    executor, self.simulator.parse_performance_output, workspace, self.simulator.step_length or 1.0
+                )
+                outputs['metrics'] = {**metrics.as_dict(), 'sumo': performance}
+                await loop.run_in_executor(executor, self.simulator.log_metrics, point, outputs['metrics'])
+
+                await loop.run_in_executor(executor, self.simulator.record, point, outputs)
+                return outputs
+            finally:
+                if not self.simulator.keep_workspaces:
+                    workspace.cleanup()
+
+    def __step(self, connection, monitor=None, recorder=None):
+        """
+        Advances the simulation by steps_per_yield control loop calls, returns whether it must go on: vehicles are
+        still expected and the ConvergenceMonitor, if any, has not converged
+        """
+        variables = self.simulator.subscription_variables(monitor, recorder)
+        for _ in range(self.steps_per_yield):
+            if connection.simulation.getMinExpectedNumber() <= 0:
+                return False
+            self.simulator.advance(connection)
+            if recorder is not None:
+                recorder.observe(connection, variables)
+            if monitor is not None:
+                monitor.observe(connection, variables)
+                if monitor.converged():
+                    return False
+        return True
@@ -0,0 +1,71 @@
+import optparse
+import time
+
+from sumo_grid_simulation.grid_simulation import Simulator
+from sumo_grid_simulation.simulation_scripts.enums import SimulationBackend
+from sumo_grid_simulation.simulation_scripts.utils import Workspace
+
+"""
+    Measures the per step overhead of the traci and libsumo backends.
+
+    The scenario is the 15x15 grid of the grid_simulation.py main. It is generated once and then simulated with each
+    backend, timing every simulationStep call. Run from the repository root with:
+
+        python -m sumo_grid_simulation.benchmarks.backend_overhead --repetitions 3
+"""
+
+
+def time_backend(backend: SimulationBackend, workspace: Workspace, repetitions: int):
+    """ Simulates the scenario in the workspace, returns the number of steps and the seconds spent in each step call """
+    simulator = Simulator(end_time=300, backend=backend.number)
+    steps = 0
+    step_time = 0.
+
+    for _ in range(repetitions):
+        connection = simulator.start_sumo(workspace)
+        try:
+            while connection.simulation.getMinExpectedNumber() > 0:
+                start = time.perf_counter()
+                connection.simulationStep()
+                step_time += time.perf_counter() - start
+                steps += 1
+        finally:
+            connection.close()
+
+    return steps, step_time
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--repetitions', type='int', default=3, help='number of simulations per backend')
+    options, args = opt_parser.parse_args()
+
+    edgeLength = 70
+    gridSize = 15
+    alpha = 0.20
+
+    max_number_of_vehicles = ((gridSize - 1) * gridSize * 2 + 4 * gridSize) * edgeLength / 5
+    period = 300/(max_number_of_vehicles * alpha)
+
+    with Workspace(prefix='benchmark_') as workspace:
+        Simulator(end_time=300).prepare_workspace(
+            workspace, gridSize=gridSize, edgeLength=edgeLength, edgeMaxSpeed=8, numberOfLanes=1, accel=1.5,
+            trips_generator_period=period
+        )
+
+        results = {}
+        for backend in SimulationBackend:
+            try:
+                results[backend] = time_backend(backend, workspace, options.repetitions)
+            except ImportError as e:
+                print(f'Skipping {backend.tag}: {e}')
+
+    for backend, (steps, step_time) in results.items():
+        print(f'{backend.tag:>8}: {steps} steps, {step_time:.3f} s in simulationStep, '
+              f'{1e3 * step_time / steps:.3f} ms per step')
+
+    if len(results) == 2:
+        traci_steps, traci_time = results[SimulationBackend.TRACI]
+        libsumo_steps, libsumo_time = results[SimulationBackend.LIBSUMO]
+        overhead = traci_time / traci_steps - libsumo_time / libsumo_steps
+        print(f'traci overhead: {1e3 * overhead:.3f} ms per step')
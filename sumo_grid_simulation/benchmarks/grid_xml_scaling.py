@@ -0,0 +1,55 @@
+import optparse
+import time
+
+from sumo_grid_simulation.simulation_scripts.grid_generator.grid_generator import GridGenerator
+from sumo_grid_simulation.simulation_scripts.utils import Workspace
+
+"""
+    Checks that writing the plain xml of a grid scales linearly with the number of nodes and edges.
+
+    Grids up to 100x100 are generated (without netconvert) and the time per element is compared between the
+    smallest and the largest grid. Run from the repository root with:
+
+        python -m sumo_grid_simulation.benchmarks.grid_xml_scaling --max-size 100
+"""
+
+
+def time_grid_xml(generator: GridGenerator, size: int, repetitions: int):
+    """ Best time over the repetitions to write the nodes and edges files of a size x size grid """
+    best = float('inf')
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        generator.generate_grid_xml(size)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def number_of_elements(size: int):
+    """ Nodes and edges of a size x size grid with its outer nodes """
+    nodes = size ** 2 + 4 * size
+    edges = 2 * (2 * size * (size - 1) + 4 * size)
+    return nodes + edges
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--max-size', type='int', default=100, help='largest gridSize generated')
+    opt_parser.add_option('--repetitions', type='int', default=3, help='generations per size, the best is kept')
+    opt_parser.add_option('--tolerance', type='float', default=3,
+                          help='maximum ratio between the time per element of the largest and the smallest grid')
+    options, args = opt_parser.parse_args()
+
+    sizes = [size for size in (10, 20, 50, 100, 200) if size < options.max_size] + [options.max_size]
+
+    per_element = {}
+    with Workspace(prefix='benchmark_') as workspace:
+        generator = GridGenerator(workspace)
+        for size in sizes:
+            elapsed = time_grid_xml(generator, size, options.repetitions)
+            per_element[size] = elapsed / number_of_elements(size)
+            print(f'gridSize {size:>4}: {elapsed * 1e3:8.2f} ms, {per_element[size] * 1e6:.3f} us per node or edge')
+
+    ratio = per_element[sizes[-1]] / per_element[sizes[0]]
+    print(f'Time per element ratio between gridSize {sizes[-1]} and {sizes[0]}: {ratio:.2f}')
+    if ratio > options.tolerance:
+        raise SystemExit(f'Grid xml generation does not scale linearly (ratio {ratio:.2f} > {options.tolerance})')
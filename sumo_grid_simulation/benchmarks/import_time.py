@@ -0,0 +1,97 @@
+import json
+import optparse
+import os
+import subprocess
+import sys
+
+from sumo_grid_simulation.simulation_scripts.utils import get_project_root
+
+"""
+    Import time budget of the simulation modules.
+
+    Every worker process of simulate_batch, and every notebook that only builds a parameter space or reads the result
+    store, imports sumo_grid_simulation.grid_simulation and builds a Simulator. Both must stay cheap and free of side
+    effects, so each module is imported in a fresh interpreter without SUMO_HOME, where it is checked that:
+        - the import and Simulator() succeed (no environment check at import time)
+        - traci, sumolib and libsumo are not loaded (they are imported on first use)
+        - no file or folder is created in the project
+        - the best import time over the repetitions is within the budget
+    The exit code is 1 if any check fails:
+
+        python -m sumo_grid_simulation.benchmarks.import_time --budget 0.5
+"""
+
+default_modules = ('sumo_grid_simulation.grid_simulation', 'sumo_grid_simulation.persistent_simulation',
+                   'sumo_grid_simulation.async_simulation')
+
+# modules that must only be loaded once a simulation runs
+sumo_modules = ('traci', 'sumolib', 'libsumo')
+
+# run in the fresh interpreter, prints the import time, the sumo modules loaded and the files created
+probe = '''
+import json, os, sys, time
+root = sys.argv[2]
+before = {os.path.join(folder, name) for folder, folders, files in os.walk(root) for name in folders + files}
+start = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=['*'])
+seconds = time.perf_counter() - start
+from sumo_grid_simulation.grid_simulation import Simulator
+Simulator()
+after = {os.path.join(folder, name) for folder, folders, files in os.walk(root) for name in folders + files}
+loaded = sorted(name for name in sys.modules if name.split('.')[0] in %r)
+print(json.dumps({'seconds': seconds, 'loaded': loaded, 'created': sorted(after - before)}))
+''' % (sumo_modules,)
+
+
+def measure_import(module: str):
+    """ Import time in seconds, sumo modules loaded and files created by importing module in a fresh interpreter """
+    environment = {name: value for name, value in os.environ.items() if name != 'SUMO_HOME'}
+    environment['PYTHONDONTWRITEBYTECODE'] = '1'
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [str(get_project_root()), environment.get('PYTHONPATH')]))
+    process = subprocess.run(
+        [sys.executable, '-c', probe, module, str(get_project_root() / 'sumo_grid_simulation')],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment
+    )
+    if process.returncode != 0:
+        raise RuntimeError('Importing ' + module + ' failed:\n' + process.stderr.decode())
+    return json.loads(process.stdout.decode().strip().splitlines()[-1])
+
+
+def check_module(module: str, budget: float, repetitions: int):
+    """ The failed checks of module, an empty list if it passes """
+    try:
+        measures = [measure_import(module) for _ in range(repetitions)]
+    except RuntimeError as e:
+        return [str(e)]
+
+    best = min(measure['seconds'] for measure in measures)
+    print(f'{module}: {best:.3f} s (budget {budget:.3f} s)')
+
+    failures = []
+    if best > budget:
+        failures.append(f'{module} takes {best:.3f} s to import, over the budget of {budget:.3f} s')
+    loaded = sorted({name for measure in measures for name in measure['loaded']})
+    if loaded:
+        failures.append(f'{module} loads {", ".join(loaded)} at import time')
+    created = sorted({name for measure in measures for name in measure['created']})
+    if created:
+        failures.append(f'{module} creates {", ".join(created)} at import time')
+    return failures
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--budget', type='float', default=0.5, help='maximum import time in seconds')
+    opt_parser.add_option('--repetitions', type='int', default=3, help='imports per module, the best time is kept')
+    opt_parser.add_option('--modules', default=','.join(default_modules), help='comma separated modules to check')
+    options, args = opt_parser.parse_args()
+
+    failures = []
+    for module in options.modules.split(','):
+        failures += check_module(module, options.budget, options.repetitions)
+
+    for failure in failures:
+        print('FAILED ' + failure)
+    if failures:
+        raise SystemExit(1)
+    print('All the imports are within the budget')
@@ -0,0 +1,222 @@
+import datetime
+import importlib.util
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from sumo_grid_simulation.simulation_scripts.grid_generator.grid_generator import GridGenerator
+from sumo_grid_simulation.simulation_scripts.random_trip_generator.native_trip_generator import NativeTripGenerator
+from sumo_grid_simulation.simulation_scripts.random_trip_generator.random_trip_generator import RandomTripGenerator
+from sumo_grid_simulation.simulation_scripts.random_trip_generator.vehicle_generator import VehicleGenerator, Vehicle
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace
+
+"""
+    Benchmark of every stage of the simulation pipeline over gridSize, numberOfLanes and demand density.
+
+    The stages are timed separately, each one keeping the best time over the repetitions:
+        grid_xml            plain xml generation (GridGenerator.generate_grid_xml)
+        netconvert          net generation from the plain xml
+        trips_native        trips and routes with NativeTripGenerator
+        trips_randomTrips   trips and routes with randomTrips.py and duarouter
+        sumo_stub           the run with benchmarks/stub_sumo.py in place of sumo
+        outputs_stub        parsing of the outputs of the stub
+        sumo                the run with the real sumo
+        outputs             parsing of the outputs of sumo
+    The stages needing sumo (netconvert, randomTrips.py, sumo) are skipped when it is not installed, so the benchmark
+    also runs on machines without it, against the stub. The parsing stages need sumolib.
+
+    The results are written to a json file. Given a baseline (a previous results file) the stages slower than the
+    baseline by more than the tolerance are reported as regressions, and the exit code is 1 if there are any:
+
+        python -m sumo_grid_simulation.benchmarks.pipeline_benchmark --save-baseline
+        python -m sumo_grid_simulation.benchmarks.pipeline_benchmark --baseline
+"""
+
+benchmarks_folder = PathUtils.simulation_output_files_folder / 'benchmarks'
+default_baseline_file = benchmarks_folder / 'baseline.json'
+stub_sumo_file = Path(__file__).resolve().parent / 'stub_sumo.py'
+
+edge_length = 50
+end_time = 300
+
+
+def sumo_available():
+    return 'SUMO_HOME' in os.environ and shutil.which('sumo') is not None and shutil.which('netconvert') is not None
+
+
+def sumolib_available():
+    """ The outputs are parsed with sumolib """
+    return importlib.util.find_spec('sumolib') is not None
+
+
+def demand_period(gridSize: int, beta: float):
+    """ trips_generator_period of the experimental design notebooks, for a demand of beta times the grid capacity """
+    max_number_of_vehicles = ((gridSize - 1) * gridSize * 2 + 4 * gridSize) * edge_length / 5
+    return end_time / (max_number_of_vehicles * beta)
+
+
+def best_time(function, repetitions: int):
+    best = float('inf')
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_command(command: list):
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(' '.join(command[:2]) + ' exited with code ' + str(process.returncode) + ':\n'
+                           + process.stderr.decode())
+
+
+def parse_outputs(workspace: Workspace):
+    from sumo_grid_simulation.grid_simulation import Simulator
+    Simulator.parse_emissions_output(workspace)
+    Simulator.parse_statistics_output(workspace)
+
+
+def benchmark_point(gridSize: int, numberOfLanes: int, beta: float, repetitions: int, with_sumo: bool):
+    """ The best time of each stage for one point of the sweep """
+    times = {}
+    with Workspace(prefix='benchmark_') as workspace:
+        generator = GridGenerator(workspace)
+        times['grid_xml'] = best_time(
+            lambda: generator.generate_grid_xml(gridSize, edgeLength=edge_length, numberOfLanes=numberOfLanes),
+            repetitions
+        )
+        if with_sumo:
+            times['netconvert'] = best_time(generator.generate_net_from_xml, repetitions)
+
+        VehicleGenerator(workspace).generate_additional_file([Vehicle('veh_passenger', vehicle_class=1, emission_class=3)])
+        period = demand_period(gridSize, beta)
+        trips_arguments = dict(vehicle_id='veh_passenger', vehicle_class=1, end_time=end_time, period=period, seed=42,
+                               use_binomial=False)
+
+        if with_sumo:
+            times['trips_randomTrips'] = best_time(
+                lambda: RandomTripGenerator(workspace).generate_random_trips(**trips_arguments), repetitions
+            )
+        vehicles = 0
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            vehicles = NativeTripGenerator(workspace).generate_random_trips(grid_size=gridSize, **trips_arguments)
+            times['trips_native'] = min(times.get('trips_native', float('inf')), time.perf_counter() - start)
+
+        stub_command = [
+            sys.executable, str(stub_sumo_file),
+            '--route-files', str(workspace.routes_file),
+            '--tripinfo-output', str(workspace.trip_info_file),
+            '--statistics-output', str(workspace.statistics_file),
+            '--emission-output', str(workspace.emissions_file)
+        ]
+        times['sumo_stub'] = best_time(lambda: run_command(stub_command), repetitions)
+        if sumolib_available():
+            times['outputs_stub'] = best_time(lambda: parse_outputs(workspace), repetitions)
+
+        if with_sumo:
+            from sumo_grid_simulation.grid_simulation import Simulator
+            # the routes in the workspace are the native ones, generated last
+            simulator = Simulator(end_time=end_time, no_control=True, native_trips=True)
+            times['sumo'] = best_time(lambda: simulator.run_without_client(workspace), repetitions)
+            times['outputs'] = best_time(lambda: parse_outputs(workspace), repetitions)
+
+    return times, vehicles
+
+
+def run_benchmark(grid_sizes: list, lanes: list, betas: list, repetitions: int, with_sumo: bool):
+    records = []
+    for gridSize in grid_sizes:
+        for numberOfLanes in lanes:
+            for beta in betas:
+                times, vehicles = benchmark_point(gridSize, numberOfLanes, beta, repetitions, with_sumo)
+                print(f'gridSize {gridSize:>3}, lanes {numberOfLanes}, beta {beta:<5} ({vehicles:>6} vehicles): '
+                      + ', '.join(f'{stage} {seconds:.3f} s' for stage, seconds in times.items()))
+                for stage, seconds in times.items():
+                    records.append({'gridSize': gridSize, 'numberOfLanes': numberOfLanes, 'beta': beta,
+                                    'vehicles': vehicles, 'stage': stage, 'seconds': seconds})
+    return records
+
+
+def find_regressions(records: list, baseline: list, tolerance: float, min_difference: float):
+    """
+    The records slower than the same stage of the same point in the baseline by more than tolerance (relative)
+    and min_difference (seconds, so that the noise of the very short stages is ignored)
+    """
+    reference = {(r['gridSize'], r['numberOfLanes'], r['beta'], r['stage']): r['seconds'] for r in baseline}
+    regressions = []
+    for record in records:
+        key = (record['gridSize'], record['numberOfLanes'], record['beta'], record['stage'])
+        if key not in reference:
+            continue
+        before = reference[key]
+        if record['seconds'] > before * (1 + tolerance) and record['seconds'] - before > min_difference:
+            regressions.append({**record, 'baseline_seconds': before, 'ratio': record['seconds'] / before})
+    return regressions
+
+
+def environment():
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sumo': sumo_available()
+    }
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--grid-sizes', default='3,5,10,15,20,30', help='comma separated gridSize values')
+    opt_parser.add_option('--lanes', default='1,2,3', help='comma separated numberOfLanes values')
+    opt_parser.add_option('--betas', default='0.05,0.2', help='comma separated demand densities (fraction of the grid capacity)')
+    opt_parser.add_option('--repetitions', type='int', default=3, help='runs per stage, the best is kept')
+    opt_parser.add_option('--stub-only', action='store_true', default=False, help='do not use sumo even if it is installed')
+    opt_parser.add_option('--output', default=None, help='results file, defaults to a timestamped file in ' + str(benchmarks_folder))
+    opt_parser.add_option('--baseline', action='store_true', default=False, help='compare the results with the baseline')
+    opt_parser.add_option('--save-baseline', action='store_true', default=False, help='store the results as the baseline')
+    opt_parser.add_option('--baseline-file', default=str(default_baseline_file), help='the baseline results file')
+    opt_parser.add_option('--tolerance', type='float', default=0.25, help='relative slowdown reported as a regression')
+    opt_parser.add_option('--min-difference', type='float', default=0.01, help='slowdowns under this many seconds are ignored')
+    options, args = opt_parser.parse_args()
+
+    with_sumo = sumo_available() and not options.stub_only
+    if not with_sumo:
+        print('sumo is not used, the stages needing it are skipped')
+
+    records = run_benchmark(
+        [int(v) for v in options.grid_sizes.split(',')],
+        [int(v) for v in options.lanes.split(',')],
+        [float(v) for v in options.betas.split(',')],
+        options.repetitions, with_sumo
+    )
+    results = {'environment': environment(), 'records': records}
+
+    os.makedirs(benchmarks_folder, exist_ok=True)
+    output = options.output or benchmarks_folder / ('pipeline_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'Results written to {output}')
+
+    if options.save_baseline:
+        with open(options.baseline_file, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f'Baseline written to {options.baseline_file}')
+
+    if options.baseline:
+        with open(options.baseline_file) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(records, baseline['records'], options.tolerance, options.min_difference)
+        for r in regressions:
+            print(f"REGRESSION gridSize {r['gridSize']}, lanes {r['numberOfLanes']}, beta {r['beta']}, {r['stage']}: "
+                  f"{r['seconds']:.3f} s vs {r['baseline_seconds']:.3f} s ({r['ratio']:.2f}x)")
+        if regressions:
+            raise SystemExit(1)
+        print('No regression against the baseline')
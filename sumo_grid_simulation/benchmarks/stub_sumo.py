@@ -0,0 +1,124 @@
+import heapq
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+"""
+    Stand-in for the sumo binary, to benchmark the pipeline where sumo is not installed.
+
+    It accepts the command line of Simulator.sumo_command and writes the emission, statistics and tripinfo outputs
+    in sumo's formats, with a workload proportional to sumo's: every vehicle of the routes file drives its route at
+    a fixed number of steps per edge and gets one emission sample per step. The values are synthetic, only the
+    sizes of the outputs are realistic.
+
+        python sumo_grid_simulation/benchmarks/stub_sumo.py --route-files routes.rou.xml --emission-output out.xml ...
+"""
+
+# simulation steps a vehicle spends on each edge of its route
+steps_per_edge = 5
+
+
+def parse_arguments(argv: list):
+    """ The values of the options of a sumo command line, the flags without value are ignored """
+    options = {}
+    i = 0
+    while i < len(argv):
+        if argv[i].startswith('--') and i + 1 < len(argv) and not argv[i + 1].startswith('--'):
+            options[argv[i][2:]] = argv[i + 1]
+            i += 2
+        else:
+            i += 1
+    return options
+
+
+def read_routes(routes_file: str):
+    """ (id, depart, edges) of every vehicle, by departure time """
+    vehicles = []
+    for _, element in ET.iterparse(routes_file):
+        if element.tag == 'vehicle':
+            route = element.find('route')
+            vehicles.append((element.get('id'), float(element.get('depart')), route.get('edges').split()))
+            element.clear()
+    return sorted(vehicles, key=lambda vehicle: vehicle[1])
+
+
+def simulate(vehicles: list, step_length: float, emission_output: str = None):
+    """
+    Moves the vehicles along their routes and writes the emission samples
+
+    :return: the (depart time, arrival time, edges) of each vehicle id, and the end time of the simulation
+    """
+    arrivals = {}
+    running = []  # heap of (arrival step, id, depart time, edges)
+    departures = iter(vehicles)
+    pending = next(departures, None)
+    step = 0
+
+    f = open(emission_output, 'w') if emission_output else None
+    try:
+        if f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<emission-export>\n')
+        while pending is not None or running:
+            time_step = step * step_length
+            while pending is not None and pending[1] <= time_step:
+                vehicle_id, depart, edges = pending
+                heapq.heappush(running, (step + steps_per_edge * len(edges), vehicle_id, depart, edges))
+                pending = next(departures, None)
+            while running and running[0][0] <= step:
+                arrival, vehicle_id, depart, edges = heapq.heappop(running)
+                arrivals[vehicle_id] = (depart, time_step, edges)
+
+            if f:
+                f.write(f'    <timestep time="{time_step:.2f}">\n')
+                for arrival, vehicle_id, depart, edges in running:
+                    edge = edges[min(len(edges) - 1, (step - (arrival - steps_per_edge * len(edges))) // steps_per_edge)]
+                    f.write(f'        <vehicle id="{vehicle_id}" eclass="HBEFA3/PC_G_EU4" CO2="2624.72" CO="164.78" '
+                            f'HC="0.81" NOx="1.20" PMx="0.07" fuel="1128.25" electricity="0.00" noise="65.23" '
+                            f'route="!{vehicle_id}" type="veh_passenger" waiting="0.00" lane="{edge}_0" '
+                            f'pos="10.00" speed="10.00" angle="90.00" x="0.00" y="0.00"/>\n')
+                f.write('    </timestep>\n')
+            step += 1
+        if f:
+            f.write('</emission-export>\n')
+    finally:
+        if f:
+            f.close()
+    return arrivals, step * step_length
+
+
+def write_tripinfo(tripinfo_output: str, arrivals: dict):
+    with open(tripinfo_output, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tripinfos>\n')
+        for vehicle_id, (depart, arrival, edges) in arrivals.items():
+            f.write(f'    <tripinfo id="{vehicle_id}" depart="{depart:.2f}" arrival="{arrival:.2f}" '
+                    f'duration="{arrival - depart:.2f}" routeLength="{50. * len(edges):.2f}" waitingTime="0.00" '
+                    f'timeLoss="{0.1 * (arrival - depart):.2f}" departDelay="0.00" vType="veh_passenger"/>\n')
+        f.write('</tripinfos>\n')
+
+
+def write_statistics(statistics_output: str, arrivals: dict, end: float, clock: float):
+    n = max(len(arrivals), 1)
+    duration = sum(arrival - depart for depart, arrival, _ in arrivals.values()) / n
+    route_length = sum(50. * len(edges) for _, _, edges in arrivals.values()) / n
+    with open(statistics_output, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<statistics>\n')
+        f.write(f'    <performance clockBegin="0" clockEnd="0" clockDuration="{clock * 1000:.0f}" traciDuration="0" '
+                f'realTimeFactor="{end / max(clock, 1e-6):.2f}" vehicleUpdatesPerSecond="0" personUpdatesPerSecond="0" '
+                f'begin="0.00" end="{end:.2f}" duration="{clock * 1000:.0f}"/>\n')
+        f.write(f'    <vehicles loaded="{len(arrivals)}" inserted="{len(arrivals)}" running="0" waiting="0"/>\n')
+        f.write(f'    <vehicleTripStatistics routeLength="{route_length:.2f}" speed="10.00" duration="{duration:.2f}" '
+                f'waitingTime="0.00" timeLoss="{0.1 * duration:.2f}" departDelay="0.00" departDelayWaiting="0.00" '
+                f'totalTravelTime="{duration * n:.2f}" totalDepartDelay="0.00"/>\n')
+        f.write('</statistics>\n')
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    options = parse_arguments(sys.argv[1:])
+
+    vehicles = read_routes(options['route-files'])
+    arrivals, end = simulate(vehicles, float(options.get('step-length', 1)), options.get('emission-output'))
+    if 'tripinfo-output' in options:
+        write_tripinfo(options['tripinfo-output'], arrivals)
+    if 'statistics-output' in options:
+        write_statistics(options['statistics-output'], arrivals, end, time.perf_counter() - start)
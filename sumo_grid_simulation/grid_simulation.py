@@ -1,26 +1,116 @@
+import copy
 import optparse
-from sumolib import checkBinary
-from sumolib.output import parse as parse_sumo_output
-import traci
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import importlib.util
+import inspect
+import json
+import re
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
 
 from sumo_grid_simulation.simulation_scripts.utils import *
+from sumo_grid_simulation.simulation_scripts.enums import SimulationBackend, FidelityLevel, SimulationModel, OutputMode, \
+    EmmissionClasses
+from sumo_grid_simulation.simulation_scripts.artifact_cache import ArtifactCache
+from sumo_grid_simulation.simulation_scripts.result_store import ResultStore
+from sumo_grid_simulation.simulation_scripts.column_store import ColumnStore
+from sumo_grid_simulation.simulation_scripts.convergence_monitor import ConvergenceMonitor
+from sumo_grid_simulation.simulation_scripts.stage_metrics import StageMetrics
+from sumo_grid_simulation.simulation_scripts.emission_model import EmissionModel
+from sumo_grid_simulation.simulation_scripts.trajectory_recorder import TrajectoryRecorder
 
 from sumo_grid_simulation.simulation_scripts.grid_generator.grid_generator import GridGenerator
 from sumo_grid_simulation.simulation_scripts.random_trip_generator.vehicle_generator import VehicleGenerator, Vehicle
 from sumo_grid_simulation.simulation_scripts.random_trip_generator.random_trip_generator import RandomTripGenerator
-
-checkSumoHome()
+from sumo_grid_simulation.simulation_scripts.random_trip_generator.native_trip_generator import NativeTripGenerator
 
 
 class Simulator:
     vehicle_id = 'veh_passenger'
 
+    # discrete simulate arguments, snapped to int in the scenario descriptors
+    discrete_arguments = ('gridSize', 'junctionType', 'tlType', 'tlLayout', 'edgeType', 'numberOfLanes',
+                          'edgePriority', 'vehicleClass', 'emissionClass')
+
+    # what each fidelity level changes with respect to the settings of the simulator (see with_fidelity):
+    # the fraction of the simulated time kept, the step length in seconds (None keeps the one of the simulator)
+    # and the fraction of the demand kept
+    fidelity_levels = {
+        FidelityLevel.LOW: {'time_fraction': 0.25, 'step_length': 2.0, 'demand_fraction': 0.5},
+        FidelityLevel.MEDIUM: {'time_fraction': 0.5, 'step_length': 1.0, 'demand_fraction': 0.75},
+        FidelityLevel.HIGH: {'time_fraction': 1.0, 'step_length': None, 'demand_fraction': 1.0}
+    }
+
     def __init__(self, show_gui=False, seed=42, step_delay: int = 0, verbosity_level: int = 0,
                  begin_time: float = 0, end_time: float = 3600, trips_generator_fringe_factor: float = 10,
-                 trips_generator_binomial: int = 1, trips_generator_use_binomial: bool = False):
+                 trips_generator_binomial: int = 1, trips_generator_use_binomial: bool = False,
+                 keep_workspaces: bool = False, backend: int = 1, no_control: bool = False,
+                 control_interval: float = 0, step_callback=None, artifact_cache: ArtifactCache = None,
+                 rescale_nets: bool = False, native_trips: bool = False, result_store: ResultStore = None,
+                 convergence_tolerance: float = None, convergence_window: float = 300,
+                 convergence_min_windows: int = 3, convergence_warm_up: float = 0,
+                 step_length: float = None, demand_fraction: float = 1.0, replication_confidence: float = 0.95,
+                 metrics_log: Path = None, column_store: ColumnStore = None, output_mode: int = 1,
+                 aggregation_period: float = None, all_emission_classes: bool = False):
         """
         :param show_gui: show gui with simulation? requires `sumo-gui` installed
         :param step_delay: ms between each simulation step (for debugging)
+        :param backend: how sumo is run, see SimulationBackend in the enums.py file. LIBSUMO runs headless simulations
+                inside the python process, saving the socket round trip of every step. TRACI is always used when
+                show_gui is True
+        :param keep_workspaces: keep the per-run folder (net, routes and sumo outputs) of each simulation
+                in PathUtils.workspaces_folder instead of deleting it once the outputs are parsed
+        :param no_control: the simulation is never observed, sumo runs to completion on its own without a traci client
+                (with libsumo the simulation is advanced in chunks of end_time - begin_time seconds)
+        :param control_interval: simulated seconds advanced by each call of the control loop,
+                0 advances one simulation step per call
+        :param step_callback: optional function called with the traci connection after each call of the control loop,
+                to observe the state of the simulation every control_interval seconds. Must be picklable (a module
+                level function) to be used with simulate_batch
+        :param artifact_cache: optional cache of the generated net, vehicle type and trips, each of them is only
+                generated again when its inputs change
+        :param rescale_nets: run netconvert only once per topology and derive the nets of other edge lengths and
+                speeds from it (nets with traffic lights need one template per edgeMaxSpeed). The templates are kept
+                in the artifact cache, or in a default ArtifactCache if there is none
+        :param native_trips: generate the trips and routes in process with NativeTripGenerator instead of
+                randomTrips.py and duarouter
+        :param result_store: optional persistent store of the simulation results, a scenario already in the store
+                (same arguments, settings of this simulator and sumo version) is not simulated again.
+                Only used when seed is set, and not compatible with a step_callback which would not be called
+        :param convergence_tolerance: stop the simulations once their outputs are in a steady state, see
+                ConvergenceMonitor. None runs them until all the vehicles have arrived. The outputs of simulate then
+                also contain the stopping time, the steady state estimates of timeLoss / duration and of the CO2 rate
+                and their standard errors. Requires the control loop (no_control False)
+        :param convergence_window: simulated seconds of the windows of the ConvergenceMonitor
+        :param convergence_min_windows: minimum number of windows before a simulation can be stopped
+        :param convergence_warm_up: simulated seconds ignored by the ConvergenceMonitor at the beginning
+        :param step_length: length in seconds of a sumo simulation step, None uses the sumo default (1 second)
+        :param demand_fraction: fraction of the demand generated, the trips_generator_period of simulate is divided by it
+        :param replication_confidence: confidence level of the intervals returned for simulations with replications
+        :param metrics_log: optional file to which the arguments and the metrics of every simulation are appended,
+                one json object per line
+        :param column_store: optional ColumnStore to which the scenario, the outputs and the metrics of every
+                simulation are appended, to query the runs from the notebooks
+        :param output_mode: how sumo writes the emissions, see OutputMode in the enums.py file. VEHICLE writes a record
+                per vehicle and step, EDGE and LANE write the emissions, traffic measures and noise of each edge (lane)
+                aggregated over intervals, which is far smaller. Their outputs also contain the 'edges' ('lanes')
+                entry with the ids, the intervals and an interval x edge array of each measure, see parse_mean_data_output.
+                Their network totals are the sums of the emission rates of every vehicle step, as with VEHICLE, except
+                noise which only exists per edge. MODEL computes the emissions from the speeds and accelerations
+                captured at every step with the EmissionModel, it requires the control loop with
+                control_interval 0
+        :param all_emission_classes: with the MODEL output mode, also compute the emissions of every class of
+                EmmissionClasses on the trajectories of the run, in the 'emissions_by_class' output (class name ->
+                totals). The emission class does not change the motion of the vehicles in sumo, so the scenarios that
+                only differ by emissionClass share a single run: they have the same entry in the result store, and
+                the totals of the requested class are taken from emissions_by_class
+        :param aggregation_period: seconds of the intervals of the EDGE and LANE output modes, None for a single
+                interval from begin_time to end_time
         """
         self.verbosity_level = verbosity_level
         self.seed = seed
@@ -33,13 +123,69 @@ class Simulator:
         self.trips_generator_binomial = trips_generator_binomial
         self.trips_generator_use_binomial = trips_generator_use_binomial
 
-        if show_gui:
-            self.sumoBinary = checkBinary('sumo-gui')
-        else:
-            self.sumoBinary = checkBinary('sumo')
+        # the binary is looked up on first use, see sumoBinary
+        self.show_gui = show_gui
+        self.__sumo_binary = None
+
+        self.keep_workspaces = keep_workspaces
+
+        assert SimulationBackend.get_by_number(backend) is not None, 'Specified backend is not supported'
+        self.backend = SimulationBackend.get_by_number(backend)
+        if self.backend is SimulationBackend.LIBSUMO:
+            if show_gui:
+                # libsumo cannot drive sumo-gui
+                self.backend = SimulationBackend.TRACI
+            elif importlib.util.find_spec('libsumo') is None:
+                raise ImportError('The libsumo backend requires libsumo, install it with `pip install libsumo`')
+
+        assert control_interval >= 0, 'control_interval cannot be negative'
+        assert not (no_control and step_callback is not None), 'A step_callback requires the control loop, no_control must be False'
+        self.no_control = no_control
+        self.control_interval = control_interval
+        self.step_callback = step_callback
+
+        self.artifact_cache = artifact_cache
+        self.rescale_nets = rescale_nets
+        self.native_trips = native_trips
+
+        assert not (result_store is not None and step_callback is not None), 'A step_callback is not called for the results read from the result_store'
+        self.result_store = result_store
+
+        assert not (no_control and convergence_tolerance is not None), 'Early termination requires the control loop, no_control must be False'
+        self.convergence_tolerance = convergence_tolerance
+        self.convergence_window = convergence_window
+        self.convergence_min_windows = convergence_min_windows
+        self.convergence_warm_up = convergence_warm_up
+
+        assert step_length is None or step_length > 0, 'step_length must be positive'
+        assert 0 < demand_fraction <= 1, 'demand_fraction must be in (0, 1]'
+        self.step_length = step_length
+        self.demand_fraction = demand_fraction
+
+        assert 0 < replication_confidence < 1, 'replication_confidence must be in (0, 1)'
+        self.replication_confidence = replication_confidence
+
+        self.metrics_log = metrics_log
+        self.column_store = column_store
 
-        if not os.path.isdir(PathUtils.simulation_output_files_folder):
-            os.mkdir(PathUtils.simulation_output_files_folder)
+        assert OutputMode.get_by_number(output_mode) is not None, 'Specified output mode is not supported'
+        assert aggregation_period is None or aggregation_period > 0, 'aggregation_period must be positive'
+        self.output_mode = OutputMode.get_by_number(output_mode)
+        self.aggregation_period = aggregation_period
+        assert not (self.output_mode is OutputMode.MODEL and (no_control or control_interval > 0)), \
+            'The MODEL output mode observes every step, no_control must be False and control_interval 0'
+        self.__emission_model = None
+        assert not (all_emission_classes and self.output_mode is not OutputMode.MODEL), \
+            'all_emission_classes requires the MODEL output mode'
+        self.all_emission_classes = all_emission_classes
+
+    @property
+    def sumoBinary(self):
+        """ Path of the sumo (or sumo-gui) binary, sumolib and SUMO_HOME are only needed from the first call """
+        if self.__sumo_binary is None:
+            sumolib = import_sumo_module('sumolib')
+            self.__sumo_binary = sumolib.checkBinary('sumo-gui' if self.show_gui else 'sumo')
+        return self.__sumo_binary
 
     def simulate(
             self,
@@ -62,7 +208,10 @@ class Simulator:
             maxSpeed: float = 55.55,
             speedFactor: float = 1.0,
             speedDev: float = 0.1,
-            trips_generator_period: float = 0.5
+            trips_generator_period: float = 0.5,
+            # sumo params
+            model=1,
+            replications: int = 1
     ):
         """
         The user function that feeds into emukit.
@@ -95,76 +244,743 @@ class Simulator:
                 Continuous variable, Domain [0, +inf]
         :param edgePriority: The priority of the edges in the network, currently useless as all the edges are set to the same priority
                 Discrete variable, Domain [0, +inf]
+        :param model: The traffic model of sumo, its number or its tag ('micro' or 'meso'). The mesoscopic model runs
+                the same network and demand much faster but less accurately, see experimental_design/meso_calibration.py
+                Discrete variable, Domain can be seen in the enums.py file
+        :param replications: number of simulations of the scenario, run in parallel with the seeds of replication_seeds.
+                The seeds are the same for every scenario (common random numbers), so the differences between scenarios
+                are not hidden by the noise of the simulations. With more than one replication every numeric output is
+                the mean of the replications, and the outputs also contain its sample variance (<output>_variance),
+                its confidence interval (<output>_ci) and the outputs of each replication (replication_outputs)
 
-        :return: dictionary containing relevant outputs such as trip time, and total carbon emissions
+        :return: dictionary containing relevant outputs such as trip time, and total carbon emissions.
+                Its 'metrics' entry holds the wall time, cpu time and memory high water mark of each stage (net, vType, trips,
+                sumo, outputs) and the performance reported by sumo, see StageMetrics
         """
+        arguments = {name: value for name, value in locals().items() if name != 'self'}
+        if replications > 1:
+            result = self.simulate_points([arguments])[0]
+            if result is None:
+                raise RuntimeError('Some replications of the scenario failed')
+            return result
 
-        # generate the sumo network
-        GridGenerator.generate_grid_net(
-            gridSize, junctionType,
-            tlType, tlLayout,
-            keepClearJunction,
-            edgeType, edgeLength,
-            numberOfLanes, edgeMaxSpeed,
-            edgePriority, self.verbosity_level
-        )
+        stored = self.lookup([arguments])[0]
+        if stored is not None:
+            return stored
 
-        vehicle_list = [
-            Vehicle(
-                id=Simulator.vehicle_id,
-                vehicle_class=vehicleClass,
-                emission_class=emissionClass,
+        # every simulation gets its own files and its own traci connection, so that simulations can run concurrently
+        workspace = Workspace()
+        metrics = StageMetrics()
+
+        try:
+            self.prepare_workspace(
+                workspace,
+                metrics=metrics,
+                gridSize=gridSize,
+                junctionType=junctionType,
+                tlType=tlType,
+                tlLayout=tlLayout,
+                edgeMaxSpeed=edgeMaxSpeed,
+                keepClearJunction=keepClearJunction,
+                edgeType=edgeType,
+                edgeLength=edgeLength,
+                numberOfLanes=numberOfLanes,
+                edgePriority=edgePriority,
+                vehicleClass=vehicleClass,
+                emissionClass=emissionClass,
                 accel=accel,
                 decel=decel,
-                max_speed=maxSpeed,
-                speed_factor=speedFactor,
-                speed_dev=speedDev
+                maxSpeed=maxSpeed,
+                speedFactor=speedFactor,
+                speedDev=speedDev,
+                trips_generator_period=trips_generator_period
             )
-        ]
-        VehicleGenerator.generate_additional_file(vehicle_list, verbosity_level=self.verbosity_level)
 
-        # generate trips in generated network
-        RandomTripGenerator.generate_random_trips(
-            vehicle_id=Simulator.vehicle_id,
+            command = self.sumo_command(workspace, model)
+            run_outputs = None
+            with metrics.measure('sumo'):
+                if self.no_control and self.backend is SimulationBackend.TRACI:
+                    self.run_without_client(workspace, command)
+                else:
+                    run_outputs = self.run(self.start_sumo(workspace, command))
+
+            with metrics.measure('outputs'):
+                outputs = self.collect_outputs(workspace, run_outputs)
+            outputs['metrics'] = {**metrics.as_dict(), 'sumo': self.parse_performance_output(workspace, self.step_length or 1.0)}
+            self.log_metrics(arguments, outputs['metrics'])
+
+            self.record(arguments, outputs)
+            return outputs
+        finally:
+            if not self.keep_workspaces:
+                workspace.cleanup()
+
+    def with_fidelity(self, level: int):
+        """
+        A copy of the simulator running cheaper approximations of its simulations, see fidelity_levels.
+        The HIGH level is the simulator itself. The levels are meant for multi-fidelity models, see
+        experimental_design/multi_fidelity.py
+
+        :param level: the fidelity level, see FidelityLevel in the enums.py file
+        """
+        assert FidelityLevel.get_by_number(level) is not None, 'Specified fidelity level is not supported'
+        settings = Simulator.fidelity_levels[FidelityLevel.get_by_number(level)]
+
+        simulator = copy.copy(self)
+        simulator.end_time = self.begin_time + (self.end_time - self.begin_time) * settings['time_fraction']
+        if settings['step_length'] is not None:
+            simulator.step_length = settings['step_length']
+        simulator.demand_fraction = self.demand_fraction * settings['demand_fraction']
+        return simulator
+
+    def with_seed(self, seed: int):
+        """ A copy of the simulator using another seed for the trips and for sumo """
+        if seed == self.seed:
+            return self
+        simulator = copy.copy(self)
+        simulator.seed = seed
+        return simulator
+
+    def replication_seeds(self, replications: int):
+        """
+        The seeds of the replications of a scenario. They only depend on the seed of the simulator, the first one being
+        that seed, so every scenario uses the same seeds and a single replication is an ordinary simulation
+        """
+        if replications <= 1:
+            return [self.seed]
+        children = np.random.SeedSequence(self.seed).spawn(replications - 1)
+        return [self.seed] + [int(child.generate_state(1)[0] % 2 ** 31) for child in children]
+
+    def summarize_replications(self, results: list):
+        """ Mean, sample variance and confidence interval of every numeric output of the replications of a scenario """
+        from scipy import stats
+
+        n = len(results)
+        quantile = stats.t.ppf((1 + self.replication_confidence) / 2, n - 1)
+        summary = {'replications': n}
+        for name, value in results[0].items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            values = np.array([result[name] for result in results], dtype=float)
+            mean = values.mean()
+            variance = values.var(ddof=1)
+            half_width = quantile * np.sqrt(variance / n)
+            summary[name] = float(mean)
+            summary[name + '_variance'] = float(variance)
+            summary[name + '_ci'] = [float(mean - half_width), float(mean + half_width)]
+        summary['replication_outputs'] = results
+        return summary
+
+    @staticmethod
+    def fidelity_cost(level: int):
+        """ Approximate cost of a simulation at a fidelity level, relative to the HIGH level """
+        settings = Simulator.fidelity_levels[FidelityLevel.get_by_number(level)]
+        # the cost grows with the simulated steps and with the number of vehicles
+        steps = settings['time_fraction'] / (settings['step_length'] or 1.0)
+        return steps * settings['demand_fraction']
+
+    def prepare_workspace(
+            self,
+            workspace: Workspace,
+            # grid generation params
+            gridSize: int,
+            junctionType: int = 1,
+            tlType: int = 2,
+            tlLayout: int = 1,
+            edgeMaxSpeed: float = 13.9,
+            keepClearJunction: bool = True,
+            edgeType: int = 1,
+            edgeLength: float = 50,
+            numberOfLanes: int = 1,
+            edgePriority: int = 0,
+            # trip generation params
+            vehicleClass: int = 1,  # 1 is passenger
+            emissionClass: int = 3,  # 3 is PC_G_EU4
+            accel: float = 2.6,
+            decel: float = 4.5,
+            maxSpeed: float = 55.55,
+            speedFactor: float = 1.0,
+            speedDev: float = 0.1,
+            trips_generator_period: float = 0.5,
+            metrics: StageMetrics = None
+    ):
+        """
+        Generates the network, the vehicle type and the trips of a scenario in the given workspace.
+        The scenario parameters are the ones of simulate.
+
+        :param metrics: optional StageMetrics recording the resources used by the net, vType and trips stages
+        """
+        if metrics is None:
+            metrics = StageMetrics()
+
+        with metrics.measure('net'):
+            self.prepare_net(
+                workspace, gridSize, junctionType, tlType, tlLayout, edgeMaxSpeed, keepClearJunction,
+                edgeType, edgeLength, numberOfLanes, edgePriority, metrics
+            )
+        with metrics.measure('vType'):
+            self.prepare_vehicle_types(
+                workspace, vehicleClass, emissionClass, accel, decel, maxSpeed, speedFactor, speedDev
+            )
+        with metrics.measure('trips'):
+            self.prepare_trips(workspace, gridSize, vehicleClass, trips_generator_period)
+        self.prepare_mean_data(workspace)
+
+    def prepare_net(self, workspace: Workspace, gridSize: int, junctionType: int = 1, tlType: int = 2,
+                    tlLayout: int = 1, edgeMaxSpeed: float = 13.9, keepClearJunction: bool = True, edgeType: int = 1,
+                    edgeLength: float = 50, numberOfLanes: int = 1, edgePriority: int = 0, metrics: StageMetrics = None):
+        """
+        Generates the sumo network in the workspace, see simulate for the parameters
+
+        :param metrics: optional StageMetrics recording the plain xml generation, netconvert and net rescaling
+        """
+        if metrics is None:
+            metrics = StageMetrics()
+
+        parameters = {
+            'gridSize': gridSize, 'junctionType': junctionType, 'tlType': tlType, 'tlLayout': tlLayout,
+            'edgeMaxSpeed': edgeMaxSpeed, 'keepClearJunction': keepClearJunction, 'edgeType': edgeType,
+            'edgeLength': edgeLength, 'numberOfLanes': numberOfLanes, 'edgePriority': edgePriority,
+            'edgeTypes': ArtifactCache.file_hash(workspace.edge_types_file)
+        }
+
+        def generate_grid_net(edgeLength: float, edgeMaxSpeed: float):
+            generator = GridGenerator(workspace)
+            with metrics.measure('net.grid_xml'):
+                generator.generate_grid_xml(
+                    gridSize, junctionType,
+                    tlType, tlLayout,
+                    keepClearJunction,
+                    edgeType, edgeLength,
+                    numberOfLanes, edgeMaxSpeed,
+                    edgePriority
+                )
+            with metrics.measure('net.netconvert'):
+                generator.generate_net_from_xml(self.verbosity_level)
+
+        def build():
+            if not self.rescale_nets:
+                generate_grid_net(edgeLength, edgeMaxSpeed)
+                return
+
+            # the template only depends on the topology, except for the traffic light programs that depend on the speed
+            template_edge_max_speed = edgeMaxSpeed if GridGenerator.has_traffic_lights(junctionType) \
+                else GridGenerator.template_edge_max_speed
+            template_parameters = {
+                **parameters,
+                'edgeLength': GridGenerator.template_edge_length,
+                'edgeMaxSpeed': template_edge_max_speed
+            }
+
+            def build_template():
+                generate_grid_net(GridGenerator.template_edge_length, template_edge_max_speed)
+
+            template_cache = self.artifact_cache if self.artifact_cache is not None else ArtifactCache()
+            template_cache.stage('net_template', template_parameters, workspace, ['grid_net_file'], build_template)
+            with metrics.measure('net.rescale'):
+                GridGenerator(workspace).generate_grid_net_from_template(workspace.grid_net_file, edgeLength, edgeMaxSpeed)
+
+        # a rescaled net differs slightly from a generated one, they are kept apart
+        self.__stage('net_rescaled' if self.rescale_nets else 'net',
+                     {**parameters, 'rescale_nets': bool(self.rescale_nets)}, workspace, ['grid_net_file'], build)
+
+    def prepare_vehicle_types(self, workspace: Workspace, vehicleClass: int = 1, emissionClass: int = 3,
+                              accel: float = 2.6, decel: float = 4.5, maxSpeed: float = 55.55,
+                              speedFactor: float = 1.0, speedDev: float = 0.1):
+        """ Generates the additional file with the vehicle type in the workspace, see simulate for the parameters """
+        vehicle = Vehicle(
+            id=Simulator.vehicle_id,
             vehicle_class=vehicleClass,
-            seed=self.seed,
-            begin_time=self.begin_time,
-            end_time=self.end_time,
-            period=trips_generator_period,
-            binomial=self.trips_generator_binomial,
-            fringe_factor=self.trips_generator_fringe_factor,
-            use_binomial=self.trips_generator_use_binomial,
-            verbosity_level=self.verbosity_level
+            emission_class=emissionClass,
+            accel=accel,
+            decel=decel,
+            max_speed=maxSpeed,
+            speed_factor=speedFactor,
+            speed_dev=speedDev
+        )
+        parameters = {'vehicle': str(vehicle)}
+
+        def build():
+            VehicleGenerator(workspace).generate_additional_file([vehicle], verbosity_level=self.verbosity_level)
+
+        self.__stage('vType', parameters, workspace, ['additional_file'], build)
+
+    def prepare_trips(self, workspace: Workspace, gridSize: int, vehicleClass: int = 1,
+                      trips_generator_period: float = 0.5):
+        """ Generates the trips and routes in the workspace, the net and the additional file must already be there """
+        # thinning the demand: fewer vehicles, departing less often
+        period = trips_generator_period / self.demand_fraction
+        parameters = {
+            'generator': 'native' if self.native_trips else 'randomTrips',
+            'net': ArtifactCache.file_hash(workspace.grid_net_file) if self.artifact_cache is not None else None,
+            # randomTrips writes the vType of the additional file into the routes, and sumo simulates that copy.
+            # The native routes have no vType, sumo loads it from the additional file
+            'vType': ArtifactCache.file_hash(workspace.additional_file)
+            if self.artifact_cache is not None and not self.native_trips else None,
+            'vehicle_id': Simulator.vehicle_id, 'vehicleClass': vehicleClass, 'seed': self.seed,
+            'begin_time': self.begin_time, 'end_time': self.end_time, 'period': period,
+            'binomial': self.trips_generator_binomial, 'fringe_factor': self.trips_generator_fringe_factor,
+            'use_binomial': self.trips_generator_use_binomial
+        }
+
+        def build():
+            if self.native_trips:
+                NativeTripGenerator(workspace).generate_random_trips(
+                    vehicle_id=Simulator.vehicle_id,
+                    vehicle_class=vehicleClass,
+                    grid_size=gridSize,
+                    seed=self.seed,
+                    begin_time=self.begin_time,
+                    end_time=self.end_time,
+                    period=period,
+                    binomial=self.trips_generator_binomial,
+                    fringe_factor=self.trips_generator_fringe_factor,
+                    use_binomial=self.trips_generator_use_binomial,
+                    verbosity_level=self.verbosity_level
+                )
+                return
+
+            # generate trips in generated network
+            RandomTripGenerator(workspace).generate_random_trips(
+                vehicle_id=Simulator.vehicle_id,
+                vehicle_class=vehicleClass,
+                seed=self.seed,
+                begin_time=self.begin_time,
+                end_time=self.end_time,
+                period=period,
+                binomial=self.trips_generator_binomial,
+                fringe_factor=self.trips_generator_fringe_factor,
+                use_binomial=self.trips_generator_use_binomial,
+                verbosity_level=self.verbosity_level
+            )
+
+        # without a seed the trips are different at every call and cannot be reused
+        cacheable = self.seed is not None
+        self.__stage('trips', parameters, workspace, ['trips_file', 'routes_file'], build, cacheable)
+
+    def prepare_mean_data(self, workspace: Workspace):
+        """ Writes the additional file defining the aggregated outputs of the EDGE and LANE output modes """
+        if self.output_mode not in (OutputMode.EDGE, OutputMode.LANE):
+            return
+        tag = 'laneData' if self.output_mode is OutputMode.LANE else 'edgeData'
+        period = self.aggregation_period or max(self.end_time - self.begin_time, 1)
+
+        root = ET.Element('additional')
+        for data_id, data_type, file in (('traffic', None, workspace.traffic_mean_data_file),
+                                         ('emissions', 'emissions', workspace.emissions_mean_data_file),
+                                         ('noise', 'harmonoise', workspace.noise_mean_data_file)):
+            element = ET.SubElement(root, tag, id=data_id, file=str(file), begin=str(self.begin_time),
+                                    period=str(period), excludeEmpty='true', withInternal='true')
+            if data_type is not None:
+                element.set('type', data_type)
+        ET.ElementTree(root).write(workspace.mean_data_file, encoding='UTF-8', xml_declaration=True)
+
+    def __stage(self, stage: str, parameters: dict, workspace: Workspace, files: list, build, cacheable: bool = True):
+        """ Runs a generation stage through the artifact cache when there is one """
+        if self.artifact_cache is None or not cacheable:
+            build()
+        else:
+            self.artifact_cache.stage(stage, parameters, workspace, files, build)
+
+    def scenario_descriptor(self, **kwargs):
+        """
+        Canonical description of everything that determines the outputs of simulate(**kwargs): all the simulate
+        arguments (defaults included, discrete ones snapped to int), the begin and end time, the seed, the trips
+        generation settings and the sumo version. Stored with every run of the column store, the key of the result
+        store is derived from it, see result_key.
+        """
+        bound = inspect.signature(Simulator.simulate).bind(self, **kwargs)
+        bound.apply_defaults()
+
+        arguments = {}
+        for name, value in bound.arguments.items():
+            # each replication is a scenario of its own, with its own seed
+            if name in ('self', 'replications'):
+                continue
+            if name == 'model':
+                value = Simulator.simulation_model(value).number
+            elif name in Simulator.discrete_arguments:
+                value = int(round(value))
+            elif isinstance(value, (bool, np.bool_)):
+                value = bool(value)
+            else:
+                value = float(value)
+            arguments[name] = value
+
+        return {
+            'arguments': arguments,
+            'begin_time': float(self.begin_time),
+            'end_time': float(self.end_time),
+            'seed': self.seed,
+            'trips_generator': {
+                'fringe_factor': float(self.trips_generator_fringe_factor),
+                'binomial': int(self.trips_generator_binomial),
+                'use_binomial': bool(self.trips_generator_use_binomial),
+                'native': bool(self.native_trips)
+            },
+            'rescale_nets': bool(self.rescale_nets),
+            'step_length': None if self.step_length is None else float(self.step_length),
+            'demand_fraction': float(self.demand_fraction),
+            'convergence': None if self.convergence_tolerance is None else {
+                'tolerance': float(self.convergence_tolerance),
+                'window': float(self.convergence_window),
+                'min_windows': int(self.convergence_min_windows),
+                'warm_up': float(self.convergence_warm_up)
+            },
+            'output_mode': self.output_mode.number,
+            'aggregation_period': None if self.aggregation_period is None else float(self.aggregation_period),
+            'emission_model': ResultStore.key(self.emission_model().parameters)
+            if self.output_mode is OutputMode.MODEL else None,
+            'all_emission_classes': bool(self.all_emission_classes),
+            'sumo_version': Simulator.sumo_version(self.sumoBinary)
+        }
+
+    def result_key(self, **kwargs):
+        """
+        The scenario descriptor of simulate(**kwargs) under which its outputs are kept in the result store. With
+        all_emission_classes the run and its outputs are the same for every emission class, so emissionClass is left
+        out and the scenarios that only differ by it share an entry, see select_emission_class
+        """
+        scenario = self.scenario_descriptor(**kwargs)
+        if self.all_emission_classes:
+            del scenario['arguments']['emissionClass']
+        return scenario
+
+    def lookup(self, points: list):
+        """
+        :param points: list of dictionaries of simulate keyword arguments
+        :return: the stored outputs of each point, None for the points that are not in the result store
+        """
+        # without a seed every simulation is different, nothing can be reused
+        if self.result_store is None or self.seed is None:
+            return [None] * len(points)
+        stored = self.result_store.get_many([self.result_key(**point) for point in points])
+        return [self.point_outputs(point, outputs) for point, outputs in zip(points, stored)]
+
+    def run_key(self, point: dict):
+        """
+        Identifies the run of simulate(**point) among the runs of a batch: with all_emission_classes the points that
+        only differ by emissionClass are the same run, see result_key, which is simulated once for all of them.
+        None if the point is a run of its own, always without a seed as every simulation is different
+        """
+        if not self.all_emission_classes or self.seed is None:
+            return None
+        return ResultStore.key(self.result_key(**point))
+
+    def point_outputs(self, point: dict, outputs: dict):
+        """ The outputs of simulate(**point) out of the ones of its run, which may be shared, see run_key """
+        if outputs is None or not self.all_emission_classes:
+            return outputs
+        default = inspect.signature(Simulator.simulate).parameters['emissionClass'].default
+        return Simulator.select_emission_class(outputs, point.get('emissionClass', default))
+
+    @staticmethod
+    def select_emission_class(outputs: dict, emissionClass: int):
+        """ The outputs of a run with all_emission_classes, with the emission totals of the given class """
+        emission_class = EmmissionClasses.get_by_number(int(round(emissionClass)))
+        assert emission_class is not None, 'Specified emission class is not supported'
+        return {**outputs, **outputs['emissions_by_class'][emission_class.tag]}
+
+    def lookup_batch(self, X, parameter_space, fixed_kwargs: dict = None, point_transform=None):
+        """ The stored outputs of each row of X, None for the rows not simulated yet, see simulate_batch for the arguments """
+        return self.lookup(Simulator.build_points(X, parameter_space, fixed_kwargs, point_transform))
+
+    def record(self, point: dict, outputs: dict):
+        """ Adds the outputs of simulate(**point) to the result store and to the column store, if there are """
+        if self.result_store is not None and self.seed is not None:
+            self.result_store.put(self.result_key(**point), outputs)
+        if self.column_store is not None:
+            self.column_store.append_run(self.scenario_descriptor(**point), outputs)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def sumo_version(sumo_binary: str):
+        """ The version of the sumo installation, e.g. '1.8.0' """
+        process = subprocess.run([sumo_binary, '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = process.stdout.decode()
+        # 'Eclipse SUMO sumo Version 1.8.0', the recent versions dropped the word Version: 'Eclipse SUMO sumo 1.28.0'
+        match = re.search(r'(?:Version|sumo) (\d\S*)', output)
+        if match is None:
+            raise RuntimeError('Cannot read the sumo version from `' + sumo_binary + ' --version`:\n' + output)
+        return match.group(1)
+
+    def collect_outputs(self, workspace: Workspace, run_outputs: dict = None):
+        """
+        Parses the sumo outputs written in the workspace at the end of a simulation
+
+        :param run_outputs: the outputs gathered during the run (see run), added to the outputs
+        """
+        if self.output_mode is OutputMode.MODEL:
+            # the emissions are in run_outputs
+            emissions = {}
+        elif self.output_mode is OutputMode.VEHICLE:
+            emissions = self.parse_emissions_output(workspace)
+        else:
+            emissions = self.parse_mean_data_output(
+                workspace, 'lane' if self.output_mode is OutputMode.LANE else 'edge', self.step_length or 1.0
+            )
+        statistics = self.parse_statistics_output(workspace)
+
+        return {**emissions, **statistics, **(run_outputs or {})}
+
+    @staticmethod
+    def parse_performance_output(workspace: Workspace = PathUtils, step_length: float = 1.0):
+        """
+        The performance and vehicle counts written by sumo in the statistics output: simulation steps and vehicle
+        updates per second, real time factor and the number of loaded, inserted, running and waiting vehicles
+        """
+        parse_sumo_output = import_sumo_module('sumolib.output').parse
+        out = {}
+        for performance in parse_sumo_output(workspace.statistics_file, ['performance']):
+            duration = float(performance.clockDuration) / 1000  # ms
+            simulated = float(performance.end) - float(performance.begin)
+            out['clock_duration'] = duration
+            out['simulated_time'] = simulated
+            out['real_time_factor'] = float(performance.realTimeFactor)
+            out['vehicle_updates_per_second'] = float(performance.vehicleUpdatesPerSecond)
+            if duration > 0:
+                out['steps_per_second'] = simulated / step_length / duration
+            if getattr(performance, 'traciDuration', None) is not None:
+                out['traci_duration'] = float(performance.traciDuration) / 1000
+        for vehicles in parse_sumo_output(workspace.statistics_file, ['vehicles']):
+            for count in ('loaded', 'inserted', 'running', 'waiting'):
+                out['vehicles_' + count] = int(getattr(vehicles, count))
+        return out
+
+    def log_metrics(self, arguments: dict, metrics: dict):
+        """ Appends the metrics of a simulation to the metrics_log, if there is one """
+        if self.metrics_log is None:
+            return
+        line = json.dumps({'time': time.time(), 'arguments': arguments, 'metrics': metrics}, default=str)
+        os.makedirs(Path(self.metrics_log).parent, exist_ok=True)
+        # a single write of a whole line, so that the lines of concurrent simulations are not interleaved
+        with open(self.metrics_log, 'a') as f:
+            f.write(line + '\n')
+
+    def trajectory_recorder(self):
+        """ A new TrajectoryRecorder for one simulation, None unless the output mode is MODEL """
+        if self.output_mode is not OutputMode.MODEL:
+            return None
+        return TrajectoryRecorder()
+
+    def emission_model(self):
+        """ The EmissionModel of the MODEL output mode, read on first use """
+        if self.__emission_model is None:
+            self.__emission_model = EmissionModel()
+        return self.__emission_model
+
+    def run_outputs(self, connection, monitor: ConvergenceMonitor = None, recorder: TrajectoryRecorder = None):
+        """ The outputs gathered during a run by its monitor and its recorder, None if it has neither """
+        if monitor is None and recorder is None:
+            return None
+        outputs = {}
+        if monitor is not None:
+            outputs.update(monitor.report(connection))
+        if recorder is not None:
+            emission_classes = [emission_class.tag for emission_class in EmmissionClasses] \
+                if self.all_emission_classes else None
+            outputs.update(recorder.report(self.emission_model(), emission_classes))
+        return outputs
+
+    def convergence_monitor(self):
+        """ A new ConvergenceMonitor for one simulation, None if early termination is disabled """
+        if self.convergence_tolerance is None:
+            return None
+        return ConvergenceMonitor(
+            tolerance=self.convergence_tolerance,
+            window=self.convergence_window,
+            min_windows=self.convergence_min_windows,
+            warm_up=self.convergence_warm_up
         )
 
+    @staticmethod
+    def subscription_variables(*observers):
+        """
+        The traci variables every observer of a run (ConvergenceMonitor, TrajectoryRecorder or None) subscribes the
+        vehicles to: a subscription replaces the previous one of the vehicle, so they all subscribe the union
+        """
+        return tuple(sorted({name for observer in observers if observer is not None for name in observer.variables}))
+
+    @staticmethod
+    def decode_inputs(X, parameter_space):
+        """
+        Turns the rows of an emukit input matrix into keyword arguments for simulate.
+
+        :param X: NxM ndarray, N is the number of points, M the number of parameters of the parameter space
+        :param parameter_space: the emukit ParameterSpace X was sampled from, its parameter names must be simulate arguments
+        :return: list of N dictionaries
+        """
+        parameters = parameter_space.parameters
+        assert np.shape(X)[1] == len(parameters), 'X must have one column per parameter of the parameter space'
+
+        points = []
+        for row in X:
+            point = {}
+            for parameter, value in zip(parameters, row):
+                # discrete parameters (gridSize, numberOfLanes, ...) come back from emukit as floats
+                if hasattr(parameter, 'domain'):
+                    value = int(round(value))
+                else:
+                    value = float(value)
+                point[parameter.name] = value
+            points.append(point)
+        return points
+
+    def simulate_batch(self, X, parameter_space, fixed_kwargs: dict = None, point_transform=None,
+                       processes: int = None, retries: int = 1):
+        """
+        Simulates all the rows of X in parallel, one sumo per worker process.
+
+        :param X: NxM ndarray of points to simulate, as produced by emukit
+        :param parameter_space: the emukit ParameterSpace X was sampled from
+        :param fixed_kwargs: simulate arguments shared by all the points, e.g. {'junctionType': 2}
+        :param point_transform: optional function taking the keyword arguments of one point and returning the ones
+                to pass to simulate, used for derived arguments such as trips_generator_period.
+                Must be picklable (a module level function)
+        :param processes: number of worker processes, defaults to the number of cpus
+        :param retries: how many times a failing point is simulated again before giving up on it
+        :return: list of N results in the order of X, the result of a point is None if all its attempts failed.
+                The errors are printed. The points already in the result store are not simulated again, and the points
+                of the same run (see run_key) are simulated once
+        """
+        points = Simulator.build_points(X, parameter_space, fixed_kwargs, point_transform)
+        return self.simulate_points(points, processes, retries)
+
+    def simulate_points(self, points: list, processes: int = None, retries: int = 1):
+        """
+        Simulates the points in parallel, one sumo per worker process. The replications of the points with a
+        replications argument are spread over the same workers.
+
+        :param points: list of dictionaries of simulate keyword arguments
+        :return: list of results in the order of points, see simulate_batch. The result of a point with replications
+                is None if any of its replications failed
+        """
+        # one task per replication: (index of the point, seed, simulate arguments)
+        tasks = []
+        for i, point in enumerate(points):
+            arguments = {name: value for name, value in point.items() if name != 'replications'}
+            for seed in self.replication_seeds(point.get('replications', 1)):
+                tasks.append((i, seed, arguments))
+        simulators = {seed: self.with_seed(seed) for _, seed, _ in tasks}
+
+        outputs = [None] * len(tasks)
+        for seed, simulator in simulators.items():
+            indices = [t for t, task in enumerate(tasks) if task[1] == seed]
+            for t, stored in zip(indices, simulator.lookup([tasks[t][2] for t in indices])):
+                outputs[t] = stored
+
+        missing = [t for t, output in enumerate(outputs) if output is None]
+        if missing:
+            # the task simulated for each missing one, the tasks of the same run share it, see run_key
+            runs = {}
+            simulated_task = {}
+            for t in missing:
+                key = simulators[tasks[t][1]].run_key(tasks[t][2])
+                simulated_task[t] = t if key is None else runs.setdefault(key, t)
+            simulated_tasks = sorted(set(simulated_task.values()))
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                simulated = evaluate_points(
+                    executor, functools.partial(_simulate_seeded, self),
+                    [{**tasks[t][2], 'seed': tasks[t][1]} for t in simulated_tasks], retries
+                )
+            simulated = dict(zip(simulated_tasks, simulated))
+            for t in missing:
+                outputs[t] = self.point_outputs(tasks[t][2], simulated[simulated_task[t]])
+
+        replications = [[] for _ in points]
+        for (i, _, _), output in zip(tasks, outputs):
+            replications[i].append(output)
+
+        results = []
+        for point, outputs in zip(points, replications):
+            if any(output is None for output in outputs):
+                results.append(None)
+            elif point.get('replications', 1) > 1:
+                results.append(self.summarize_replications(outputs))
+            else:
+                results.append(outputs[0])
+        return results
+
+    @staticmethod
+    def build_points(X, parameter_space, fixed_kwargs: dict = None, point_transform=None):
+        """ The simulate keyword arguments of each row of X, see simulate_batch """
+        points = []
+        for point in Simulator.decode_inputs(X, parameter_space):
+            point = {**(fixed_kwargs or {}), **point}
+            if point_transform is not None:
+                point = point_transform(point)
+            points.append(point)
+        return points
+
+    def start_sumo(self, workspace: Workspace, command: list = None):
+        """
+        Starts sumo on the files of the given workspace with the selected backend.
+
+        :param command: the sumo command line, defaults to sumo_command(workspace)
+        :return: the object driving the simulation, a traci connection or the libsumo module which has the same api
+        """
+        if command is None:
+            command = self.sumo_command(workspace)
+
+        if self.backend is SimulationBackend.LIBSUMO:
+            import libsumo
+            libsumo.start(command)
+            return libsumo
+
         # traci starts sumo as a subprocess and then this script connects and runs
-        traci.start([
+        traci = import_sumo_module('traci')
+        traci.start(command, label=workspace.name)
+        return traci.getConnection(workspace.name)
+
+    @staticmethod
+    def simulation_model(model):
+        """ The SimulationModel of the model argument of simulate, given by number or by tag """
+        simulation_model = SimulationModel.get_by_tag(model) if isinstance(model, str) \
+            else SimulationModel.get_by_number(int(round(model)))
+        assert simulation_model is not None, 'Specified model is not supported'
+        return simulation_model
+
+    def sumo_command(self, workspace: Workspace, model=1):
+        """
+        The command line used to start sumo on the files of the given workspace
+
+        :param model: the model argument of simulate
+        """
+        command = [
             self.sumoBinary,
             # '--configuration-file', Simulator.simulation_file,
-            '--net-file', str(PathUtils.grid_net_file),
-            '--route-files', str(PathUtils.routes_file),
+            '--net-file', str(workspace.grid_net_file),
+            '--route-files', str(workspace.routes_file),
             '--start',
             '--seed', str(self.seed),
             '--delay', str(self.step_delay),
-            '--gui-settings-file', str(PathUtils.gui_view_file),
+            '--gui-settings-file', str(workspace.gui_view_file),
             '--quit-on-end',
-            '--tripinfo-output', str(PathUtils.trip_info_file),
-            '--statistics-output', str(PathUtils.statistics_file),
-            '--emission-output', str(PathUtils.emissions_file)
-        ])
-
-        self.run()
-
-        emissions = self.parse_emissions_output()
-        statistics = self.parse_statistics_output()
-
-        return {**emissions, **statistics}
+            '--tripinfo-output', str(workspace.trip_info_file),
+            '--statistics-output', str(workspace.statistics_file)
+        ]
+        additional_files = []
+        if self.native_trips:
+            # the native routes do not hold the vehicle type
+            additional_files.append(workspace.additional_file)
+        if self.output_mode is OutputMode.VEHICLE:
+            command += ['--emission-output', str(workspace.emissions_file)]
+        elif self.output_mode in (OutputMode.EDGE, OutputMode.LANE):
+            additional_files.append(workspace.mean_data_file)
+        if additional_files:
+            command += ['--additional-files', ','.join(str(file) for file in additional_files)]
+        if self.step_length is not None:
+            command += ['--step-length', str(self.step_length)]
+        if Simulator.simulation_model(model) is SimulationModel.MESO:
+            # without junction control meso ignores the traffic lights and the priorities of the junctions
+            command += ['--mesosim', '--meso-junction-control', 'true']
+        return command
 
     @staticmethod
-    def parse_emissions_output():
+    def parse_emissions_output(workspace: Workspace = PathUtils):
         out = {'CO': 0, 'CO2': 0, 'HC': 0, 'NOx': 0, 'PMx': 0,
                'fuel': 0, 'noise': 0, 'num_emissions_samples': 0}
-        emissions_output = parse_sumo_output(PathUtils.emissions_file, ['vehicle'])
+        emissions_output = import_sumo_module('sumolib.output').parse(workspace.emissions_file, ['vehicle'])
         for sample in emissions_output:
             out['CO'] += float(sample.CO)
             out['CO2'] += float(sample.CO2)
@@ -177,10 +993,70 @@ class Simulator:
 
         return out
 
+    # measures of the aggregated outputs, see parse_mean_data_output
+    mean_data_emissions = ('CO', 'CO2', 'HC', 'NOx', 'PMx', 'fuel')
+    mean_data_traffic = ('sampledSeconds', 'entered', 'left', 'departed', 'arrived', 'waitingTime', 'timeLoss',
+                         'speed', 'density', 'occupancy', 'traveltime')
+    # measures that are averages, missing (NaN) where an edge had no vehicle, the others are totals (0)
+    mean_data_averages = ('speed', 'density', 'occupancy', 'traveltime', 'noise')
+
     @staticmethod
-    def parse_statistics_output():
-        statistics_output = parse_sumo_output(
-            PathUtils.statistics_file,
+    def parse_mean_data_output(workspace: Workspace = PathUtils, element: str = 'edge', step_length: float = 1.0):
+        """
+        Parses the aggregated outputs of the EDGE and LANE output modes.
+
+        :param element: 'edge' or 'lane'
+        :param step_length: the step length of the simulation, to give the totals the meaning of parse_emissions_output
+        :return: the network totals of the emissions and num_emissions_samples, with the keys and the meaning of
+                parse_emissions_output, plus the 'edges' (or 'lanes') entry: the 'ids', the [begin, end] 'intervals'
+                and, for each measure of mean_data_emissions, mean_data_traffic and noise, a list with the value of
+                each id in each interval. The emissions of the edges are the masses written by sumo (mg), the internal
+                edges of the junctions included. num_emissions_samples is estimated from the time spent by the vehicles
+                on the edges (sampledSeconds), it is only close to the number of vehicle steps
+        """
+        sources = ((workspace.emissions_mean_data_file, {name: name + '_abs' for name in Simulator.mean_data_emissions}),
+                   (workspace.traffic_mean_data_file, {name: name for name in Simulator.mean_data_traffic}),
+                   (workspace.noise_mean_data_file, {'noise': 'noise'}))
+
+        intervals = []
+        values = {}  # measure -> {(interval index, id): value}
+        ids = set()
+        for file, attributes in sources:
+            for i, interval in enumerate(ET.parse(file).getroot().iter('interval')):
+                if i == len(intervals):
+                    intervals.append([float(interval.get('begin')), float(interval.get('end'))])
+                for item in interval.iter(element):
+                    ids.add(item.get('id'))
+                    for measure, attribute in attributes.items():
+                        if item.get(attribute) is not None:
+                            values.setdefault(measure, {})[i, item.get('id')] = float(item.get(attribute))
+
+        ids = sorted(ids)
+        column = {item: j for j, item in enumerate(ids)}
+        arrays = {}
+        for measure in Simulator.mean_data_emissions + Simulator.mean_data_traffic + ('noise',):
+            array = np.full((len(intervals), len(ids)), np.nan if measure in Simulator.mean_data_averages else 0.)
+            for (i, item), value in values.get(measure, {}).items():
+                array[i, column[item]] = value
+            arrays[measure] = array
+
+        # the _abs values are the masses emitted, the rates of the vehicle steps times the step length, while
+        # parse_emissions_output sums the rates
+        out = {name: float(arrays[name].sum()) / step_length for name in Simulator.mean_data_emissions}
+        out['num_emissions_samples'] = int(round(arrays['sampledSeconds'].sum() / step_length))
+        # lists rather than arrays, so that the outputs can be stored as json
+        out[element + 's'] = {
+            'ids': ids,
+            'intervals': intervals,
+            **{measure: [[None if np.isnan(value) else value for value in row] for row in array.tolist()]
+               for measure, array in arrays.items()}
+        }
+        return out
+
+    @staticmethod
+    def parse_statistics_output(workspace: Workspace = PathUtils):
+        statistics_output = import_sumo_module('sumolib.output').parse(
+            workspace.statistics_file,
             ['vehicleTripStatistics']
         )
         stat = next(statistics_output)  # only one sample
@@ -194,26 +1070,173 @@ class Simulator:
 
         return out
 
-    def run(self):
-        """ traci control loop that runs the simulation """
+    def run(self, connection=None, close: bool = True):
+        """
+        traci control loop that runs the simulation
+
+        :param connection: the traci connection (or libsumo module) of the simulation to run,
+                defaults to the current traci connection
+        :param close: close the connection at the end, False keeps sumo alive so that it can load another scenario
+        :return: the outputs gathered during the run, see run_outputs: the report of the ConvergenceMonitor if early
+                termination is enabled and the emissions of the MODEL output mode
+        """
+        if connection is None:
+            connection = import_sumo_module('traci').getConnection()
         step = 0
+        monitor = self.convergence_monitor()
+        recorder = self.trajectory_recorder()
+        variables = self.subscription_variables(monitor, recorder)
 
         try:
-            while traci.simulation.getMinExpectedNumber() > 0:
-                traci.simulationStep()
+            while connection.simulation.getMinExpectedNumber() > 0:
+                self.advance(connection)
                 if self.verbosity_level > 0:
-                    print(f'Simulation step N°{step}')
+                    print(f'Simulation step N°{step}, time {connection.simulation.getTime()}')
                 step += 1
+
+                if recorder is not None:
+                    recorder.observe(connection, variables)
+                if monitor is not None:
+                    monitor.observe(connection, variables)
+                    if monitor.converged():
+                        break
+
+            return self.run_outputs(connection, monitor, recorder)
         finally:
 
-            traci.close()
+            if close:
+                connection.close()
             sys.stdout.flush()
 
+    def advance(self, connection):
+        """ Performs one call of the control loop: advances the simulation and calls the step_callback """
+        if self.no_control:
+            interval = max(self.end_time - self.begin_time, 1)
+        else:
+            interval = self.control_interval
+
+        if interval > 0:
+            # a single round trip advances sumo until the target time
+            connection.simulationStep(connection.simulation.getTime() + interval)
+        else:
+            connection.simulationStep()
+
+        if self.step_callback is not None:
+            self.step_callback(connection)
+
+    def run_without_client(self, workspace: Workspace, command: list = None):
+        """
+        Runs sumo on the files of the workspace until all the vehicles have arrived, without a traci connection
+
+        :param command: the sumo command line, defaults to sumo_command(workspace)
+        """
+        if command is None:
+            command = self.sumo_command(workspace)
+
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        if process.stdout and self.verbosity_level > 0:
+            print(process.stdout.decode())
+        if process.returncode != 0:
+            raise RuntimeError('sumo exited with code ' + str(process.returncode) + ':\n' + process.stderr.decode())
+
+
+def evaluate_points(executor, function, points: list, retries: int = 1):
+    """
+    Evaluates the points on the workers of an executor, retrying the ones that fail.
+
+    :param executor: a concurrent.futures executor
+    :param function: picklable function called with the simulate keyword arguments of one point,
+            returning a (result, error) pair where error is None on success
+    :param points: list of dictionaries of simulate keyword arguments
+    :param retries: how many times a failing point is evaluated again before giving up on it
+    :return: list of results in the order of points, the result of a point is None if all its attempts failed
+    """
+    results = [None] * len(points)
+    pending = list(range(len(points)))
+
+    for attempt in range(retries + 1):
+        futures = {i: executor.submit(function, points[i]) for i in pending}
+        pending = []
+        for i, future in futures.items():
+            try:
+                results[i], error = future.result()
+            except Exception:
+                # the worker process itself failed (e.g. it was killed)
+                error = traceback.format_exc()
+            if error is not None:
+                print(f'Simulation of point {i} {points[i]} failed (attempt {attempt + 1} of {retries + 1}):\n{error}')
+                pending.append(i)
+        if not pending:
+            break
+
+    return results
+
+
+def _simulate_point(simulator: Simulator, kwargs: dict):
+    """ Worker entry point of Simulator.simulate_batch, errors are returned instead of raised so that they can be reported per point """
+    try:
+        return simulator.simulate(**kwargs), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _simulate_seeded(simulator: Simulator, kwargs: dict):
+    """ Worker entry point of Simulator.simulate_points, kwargs holds the seed of the replication with the simulate arguments """
+    kwargs = dict(kwargs)
+    return _simulate_point(simulator.with_seed(kwargs.pop('seed')), kwargs)
+
+
+class SimulatorUserFunction:
+    """
+    Emukit user function evaluating all the points it is called with in parallel through Simulator.simulate_batch.
+
+    It can be passed directly to the run_loop method of emukit loops, or used to compute init_Y and test_Y:
+
+        user_function = SimulatorUserFunction(simulator, parameter_space, lambda s: s['timeLoss'] / s['duration'])
+        init_Y = user_function(init_X)
+    """
+
+    def __init__(self, simulator: Simulator, parameter_space, output, fixed_kwargs: dict = None,
+                 point_transform=None, processes: int = None, retries: int = 1):
+        """
+        :param simulator: the simulator used to evaluate the points
+        :param parameter_space: the emukit ParameterSpace of the loop
+        :param output: function taking the dictionary returned by simulate and returning the scalar to model
+        :param fixed_kwargs: see Simulator.simulate_batch
+        :param point_transform: see Simulator.simulate_batch
+        :param processes: see Simulator.simulate_batch
+        :param retries: see Simulator.simulate_batch
+        """
+        self.simulator = simulator
+        self.parameter_space = parameter_space
+        self.output = output
+        self.fixed_kwargs = fixed_kwargs
+        self.point_transform = point_transform
+        self.processes = processes
+        self.retries = retries
+
+    def __call__(self, X):
+        results = self.simulator.simulate_batch(
+            X, self.parameter_space,
+            fixed_kwargs=self.fixed_kwargs,
+            point_transform=self.point_transform,
+            processes=self.processes,
+            retries=self.retries
+        )
+        failed = [i for i, result in enumerate(results) if result is None]
+        if failed:
+            # emukit cannot handle missing outputs, so a batch with failed points cannot be returned
+            raise RuntimeError(f'Simulation failed for the points {failed} of X')
+
+        # expand dims is essential or the acquition function breaks
+        return np.expand_dims(np.array([self.output(result) for result in results], dtype=float), 1)
+
 
 if __name__ == '__main__':
     opt_parser = optparse.OptionParser()
     opt_parser.add_option('--showgui', action='store_true',
-                          default=True, help='run the commandline version of sumo')
+                          default=False, help='run the gui version of sumo')
     options, args = opt_parser.parse_args()
 
     edgeLength = 70
@@ -0,0 +1,180 @@
+import traceback
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+
+from sumo_grid_simulation.grid_simulation import Simulator, evaluate_points
+from sumo_grid_simulation.simulation_scripts.grid_generator.grid_generator import GridGenerator
+from sumo_grid_simulation.simulation_scripts.stage_metrics import StageMetrics
+from sumo_grid_simulation.simulation_scripts.utils import Workspace
+
+
+class PersistentSumoWorker:
+    """
+    Simulates scenarios one after the other on a single long-lived sumo instance.
+
+    Instead of starting a new sumo and a new connection for every scenario, each scenario is loaded in the running
+    sumo with load. sumo only writes the outputs of a scenario (statistics, tripinfo, ...) when the scenario is
+    closed, so after each run a tiny idle scenario (an empty 2x2 grid) is loaded to close it.
+
+    Example:
+        with PersistentSumoWorker(Simulator(end_time=300)) as worker:
+            results = [worker.simulate(gridSize=size) for size in range(3, 7)]
+    """
+
+    def __init__(self, simulator: Simulator):
+        """
+        :param simulator: the simulator holding the simulation settings (seed, begin and end time, backend, ...)
+        """
+        self.simulator = simulator
+
+        self.__idle_workspace = None
+        self.__connection = None
+
+    def start(self):
+        """ Starts sumo on the idle scenario, called by the first simulate if needed """
+        if self.__connection is not None:
+            return
+
+        self.__idle_workspace = Workspace(prefix='idle_')
+        GridGenerator(self.__idle_workspace).generate_grid_net(2, verbosity_level=self.simulator.verbosity_level)
+        self.__connection = self.simulator.start_sumo(
+            self.__idle_workspace,
+            [self.simulator.sumoBinary] + self.__idle_arguments()
+        )
+
+    def simulate(self, **kwargs):
+        """ Same as Simulator.simulate, reusing the running sumo """
+        assert kwargs.get('replications', 1) == 1, 'Replications are only run by Simulator.simulate and Simulator.simulate_batch'
+        stored = self.simulator.lookup([kwargs])[0]
+        if stored is not None:
+            return stored
+
+        self.start()
+
+        arguments = dict(kwargs)
+        model = arguments.pop('model', 1)
+
+        workspace = Workspace()
+        metrics = StageMetrics()
+        try:
+            self.simulator.prepare_workspace(workspace, metrics=metrics, **arguments)
+
+            with metrics.measure('sumo'):
+                # the first element of the command is the sumo binary, which is already running
+                self.__connection.load(self.simulator.sumo_command(workspace, model)[1:])
+                run_outputs = self.simulator.run(self.__connection, close=False)
+                self.__connection.load(self.__idle_arguments())
+
+            with metrics.measure('outputs'):
+                outputs = self.simulator.collect_outputs(workspace, run_outputs)
+            outputs['metrics'] = {
+                **metrics.as_dict(),
+                'sumo': self.simulator.parse_performance_output(workspace, self.simulator.step_length or 1.0)
+            }
+            self.simulator.log_metrics(kwargs, outputs['metrics'])
+
+            self.simulator.record(kwargs, outputs)
+            return outputs
+        finally:
+            if not self.simulator.keep_workspaces:
+                workspace.cleanup()
+
+    def close(self):
+        """ Stops sumo, the worker can be started again by simulate """
+        if self.__connection is not None:
+            try:
+                self.__connection.close()
+            finally:
+                self.__connection = None
+                self.__idle_workspace.cleanup()
+
+    def __idle_arguments(self):
+        return ['--net-file', str(self.__idle_workspace.grid_net_file), '--end', '0']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PersistentWorkerPool:
+    """
+    Process pool where every process keeps a PersistentSumoWorker for its whole life.
+
+    It offers the same simulate_batch as Simulator, and can be used in place of the simulator
+    of a SimulatorUserFunction. The pool must be closed (or used as a context manager) to stop the sumo instances.
+    """
+
+    def __init__(self, simulator: Simulator, processes: int = None):
+        """
+        :param simulator: the simulator holding the simulation settings
+        :param processes: number of worker processes (and sumo instances), defaults to the number of cpus
+        """
+        self.simulator = simulator
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(simulator,))
+
+    def simulate_points(self, points: list, retries: int = 1):
+        """
+        :param points: list of dictionaries of simulate keyword arguments
+        :param retries: how many times a failing point is simulated again before giving up on it
+        :return: list of results in the order of points, the result of a point is None if all its attempts failed.
+                The points already in the result store of the simulator are not simulated again, and the points of the
+                same run (see Simulator.run_key) are simulated once
+        """
+        assert all(point.get('replications', 1) == 1 for point in points), 'Replications are only run by Simulator.simulate_points'
+        results = self.simulator.lookup(points)
+        missing = [i for i, result in enumerate(results) if result is None]
+        # the point simulated for each missing one, the points of the same run share it, see Simulator.run_key
+        runs = {}
+        simulated_point = {}
+        for i in missing:
+            key = self.simulator.run_key(points[i])
+            simulated_point[i] = i if key is None else runs.setdefault(key, i)
+        simulated_points = sorted(set(simulated_point.values()))
+        simulated = evaluate_points(self.executor, _simulate_point, [points[i] for i in simulated_points], retries)
+        simulated = dict(zip(simulated_points, simulated))
+        for i in missing:
+            results[i] = self.simulator.point_outputs(points[i], simulated[simulated_point[i]])
+        return results
+
+    def simulate_batch(self, X, parameter_space, fixed_kwargs: dict = None, point_transform=None,
+                       processes: int = None, retries: int = 1):
+        """
+        See Simulator.simulate_batch, processes is ignored as the size of the pool is set when it is created
+        """
+        points = Simulator.build_points(X, parameter_space, fixed_kwargs, point_transform)
+        return self.simulate_points(points, retries)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# The worker of the current pool process
+_worker = None
+
+
+def _init_worker(simulator: Simulator):
+    global _worker
+    _worker = PersistentSumoWorker(simulator)
+    # pool processes exit without running atexit handlers, multiprocessing finalizers are still called
+    Finalize(_worker, _worker.close, exitpriority=10)
+
+
+def _simulate_point(kwargs: dict):
+    """ Pool entry point, errors are returned instead of raised so that they can be reported per point """
+    try:
+        return _worker.simulate(**kwargs), None
+    except Exception:
+        # the state of sumo is unknown after a failure, the next point starts a fresh instance
+        try:
+            _worker.close()
+        except Exception:
+            pass
+        return None, traceback.format_exc()
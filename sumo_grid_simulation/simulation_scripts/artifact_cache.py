@@ -0,0 +1,176 @@
+import hashlib
+import json
+import optparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace
+
+"""
+    Content-addressed cache of the files generated by the stages of a simulation.
+
+    Every stage (net or net_rescaled, vType, trips) is identified by a hash of its inputs. When a stage is needed again with the
+    same inputs its files are linked into the workspace instead of being generated again, e.g. the net is reused
+    when only accel or speedDev change, and the trips and routes are reused when the net, the vehicle type, the
+    demand and the seed are unchanged.
+
+    The cache lives in PathUtils.artifact_cache_folder, can be shared by concurrent simulations and is bounded in
+    size, the least recently used entries are removed first.
+
+    The template nets (see Simulator rescale_nets) of every gridSize x numberOfLanes combination of
+    experimental_design/config.py can be prebuilt with:
+        python -m sumo_grid_simulation.simulation_scripts.artifact_cache --warm-up
+"""
+
+
+class ArtifactCache:
+
+    # name of the file recording the input parameters of an entry, for inspection
+    parameters_file_name = 'parameters.json'
+
+    def __init__(self, folder: Path = PathUtils.artifact_cache_folder, max_size: int = 2 * 1024 ** 3):
+        """
+        :param folder: the root folder of the cache
+        :param max_size: maximum size in bytes of the cached files, the least recently used entries are evicted past it
+        """
+        self.folder = Path(folder)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(parameters: dict):
+        """ The hash of the input parameters of a stage """
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(path: Path):
+        """ The hash of the content of a file, used to chain the stages (e.g. trips depend on the net) """
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def stage(self, stage: str, parameters: dict, workspace: Workspace, files: list, build):
+        """
+        Puts the files of a stage in the workspace, from the cache if possible, else by running build.
+
+        :param stage: name of the stage, e.g. 'net'
+        :param parameters: json serializable inputs of the stage, the files are reused only if these are identical
+        :param workspace: the workspace receiving the files
+        :param files: names of the workspace attributes of the files produced by the stage, e.g. ['grid_net_file']
+        :param build: function without arguments generating the files in the workspace
+        :return: True if the files came from the cache
+        """
+        entry = self.folder / stage / ArtifactCache.key(parameters)
+
+        if entry.is_dir():
+            try:
+                for attribute in files:
+                    self.__link(entry / getattr(workspace, attribute).name, getattr(workspace, attribute))
+                # the modification time of an entry is its last use
+                os.utime(entry)
+                return True
+            except OSError:
+                # the entry was evicted by another process while being read
+                pass
+
+        build()
+        self.__store(entry, parameters, [getattr(workspace, attribute) for attribute in files])
+        self.evict()
+        return False
+
+    def size(self):
+        return sum(size for _, _, size in self.__entries())
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in max_size """
+        entries = sorted(self.__entries())
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def __store(self, entry: Path, parameters: dict, paths: list):
+        os.makedirs(entry.parent, exist_ok=True)
+        # the entry is filled in a temporary folder and renamed, so other processes never see a partial entry
+        tmp = Path(tempfile.mkdtemp(prefix='.tmp_', dir=entry.parent))
+        try:
+            for path in paths:
+                self.__link(path, tmp / path.name)
+            with open(tmp / ArtifactCache.parameters_file_name, 'w') as f:
+                json.dump(parameters, f, sort_keys=True, indent=1, default=str)
+            os.rename(tmp, entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @staticmethod
+    def __link(source: Path, destination: Path):
+        """ Hard links the file when possible, the cached files are never modified in place """
+        if destination.exists():
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def __entries(self):
+        """ (last use, folder, size) of every entry """
+        entries = []
+        if not self.folder.is_dir():
+            return entries
+        for stage in self.folder.iterdir():
+            if not stage.is_dir():
+                continue
+            for entry in stage.iterdir():
+                if entry.name.startswith('.tmp_'):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in entry.iterdir())
+                    entries.append((entry.stat().st_mtime, entry, size))
+                except OSError:
+                    continue
+        return entries
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--warm-up', action='store_true', default=False,
+                          help='build the template nets of every gridSize x numberOfLanes combination of experimental_design/config.py')
+    opt_parser.add_option('--junction-type', type='int', default=2, help='junctionType of the prebuilt nets')
+    opt_parser.add_option('--edge-length', type='float', default=50, help='edgeLength of the prebuilt nets')
+    opt_parser.add_option('--edge-max-speed', type='float', default=13.9,
+                          help='edgeMaxSpeed of the prebuilt nets, only relevant for junctions with traffic lights')
+    opt_parser.add_option('--clear', action='store_true', default=False, help='empty the cache')
+    options, args = opt_parser.parse_args()
+
+    cache = ArtifactCache()
+
+    if options.clear:
+        cache.clear()
+
+    if options.warm_up:
+        from experimental_design.config import cfg
+        from sumo_grid_simulation.grid_simulation import Simulator
+
+        simulator = Simulator(artifact_cache=cache, rescale_nets=True)
+        for gridSize in cfg.PARAMETERS_OPTS.GRID_SIZE:
+            for numberOfLanes in cfg.PARAMETERS_OPTS.NUM_LANES:
+                start = time.time()
+                with Workspace(prefix='warm_up_') as workspace:
+                    simulator.prepare_net(
+                        workspace, gridSize=gridSize, junctionType=options.junction_type,
+                        edgeLength=options.edge_length, edgeMaxSpeed=options.edge_max_speed,
+                        numberOfLanes=numberOfLanes
+                    )
+                print(f'gridSize {gridSize}, numberOfLanes {numberOfLanes}: {time.time() - start:.2f} s')
+
+    print(f'Cache size: {cache.size() / 1024 ** 2:.1f} MB')
@@ -0,0 +1,306 @@
+import json
+import optparse
+import os
+import pickle
+import socket
+import time
+from pathlib import Path
+
+import numpy as np
+
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, a single process must write to the store there
+    fcntl = None
+
+"""
+    Append-only columnar store of simulation runs and designs, read through memory maps.
+
+    Every row is a run (or a point of a design) and every column one of its values, named after its group:
+        param.<name>        simulate arguments, or the inputs of a design
+        setting.<name>      settings of the Simulator influencing the outputs (end_time, seed, step_length, ...)
+        output.<name>       outputs of the simulation, or the outputs of a design
+        metrics.<name>      stage timings and sumo performance (see StageMetrics)
+        provenance.<name>   sumo version, host, creation time, source of the row
+    Nested dictionaries are flattened with dots (metrics.stages.sumo.wall) and lists of numbers with their index
+    (output.timeLoss_ci.0), other values (the outputs of each replication) are not stored.
+
+    Each column is a file of float64 values (NaN where a row has no value) or, for text, of int32 codes into a
+    dictionary of the strings of the column. A manifest holds the number of complete rows: rows are only ever
+    appended, and the manifest is replaced once their values are written, so readers never see a partial row.
+    Reading a column maps its file instead of loading the whole store, and filters only read the columns they test:
+
+        store = ColumnStore()
+        co2 = store.column('output.CO2')
+        fast = store.select(['param.gridSize', 'output.timeLoss'], where={'param.numberOfLanes': 2,
+                                                                         'param.edgeMaxSpeed': (13, 19)})
+        df = store.to_dataframe(where={'provenance.sumo_version': '1.8.0'})
+"""
+
+
+class ColumnStore:
+
+    # prefixes of the column names
+    groups = ('param', 'setting', 'output', 'metrics', 'provenance')
+
+    # on disk formats of the number and text columns
+    dtypes = {'number': np.dtype('<f8'), 'text': np.dtype('<i4')}
+
+    def __init__(self, folder: Path = PathUtils.column_store_folder):
+        """
+        :param folder: folder of the store, created at the first append
+        """
+        self.folder = Path(folder)
+
+    def append(self, rows: list):
+        """
+        Appends rows to the store, the columns not seen before are added (empty for the existing rows).
+
+        :param rows: list of dictionaries of column name -> number, bool, string or None (no value)
+        """
+        if not rows:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.folder / 'lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.__manifest()
+            n = manifest['rows']
+
+            for row in rows:
+                for name, value in row.items():
+                    if name not in manifest['columns'] and value is not None:
+                        manifest['columns'][name] = {
+                            'kind': 'text' if isinstance(value, str) else 'number',
+                            'file': f"c{len(manifest['columns']):05d}",
+                            'dictionary': 0
+                        }
+
+            for name, column in manifest['columns'].items():
+                values = [row.get(name) for row in rows]
+                if column['kind'] == 'text':
+                    data = self.__encode(name, column, values)
+                else:
+                    assert not any(isinstance(value, str) for value in values), 'Column ' + name + ' holds numbers'
+                    data = np.array([np.nan if value is None else value for value in values], dtype=float)
+                self.__write(column, n, data)
+
+            manifest['rows'] = n + len(rows)
+            # the rows are visible to the readers only once the manifest is replaced
+            temporary = self.folder / 'manifest.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(temporary, self.folder / 'manifest.json')
+
+    def append_run(self, scenario: dict, outputs: dict, provenance: dict = None):
+        """
+        Appends a simulation run.
+
+        :param scenario: the scenario descriptor of the run, see Simulator.scenario_descriptor
+        :param outputs: the outputs of simulate
+        :param provenance: optional extra provenance values, e.g. {'source': 'sweep co2'}
+        """
+        self.append([ColumnStore.run_row(scenario, outputs, provenance)])
+
+    def append_design(self, X, Y=None, parameter_names: list = None, output_names: list = None,
+                      provenance: dict = None):
+        """
+        Appends the points of a design, e.g. the (X, Y) pairs kept as pickles by the notebooks.
+
+        :param X: NxM ndarray of inputs
+        :param Y: optional NxK ndarray of outputs
+        :param parameter_names: names of the M inputs, defaults to x0 ... xM-1
+        :param output_names: names of the K outputs, defaults to y0 ... yK-1
+        :param provenance: provenance values shared by all the points, e.g. {'source': 'timeloss_200_init_points.pkl'}
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        parameter_names = parameter_names or [f'x{i}' for i in range(X.shape[1])]
+        assert len(parameter_names) == X.shape[1], 'One parameter name per column of X is required'
+        if Y is not None:
+            Y = np.asarray(Y, dtype=float).reshape(len(X), -1)
+            output_names = output_names or [f'y{i}' for i in range(Y.shape[1])]
+            assert len(output_names) == Y.shape[1], 'One output name per column of Y is required'
+
+        common = {**ColumnStore.__provenance(), **ColumnStore.__prefixed('provenance', provenance or {})}
+        rows = []
+        for i, x in enumerate(X):
+            row = {'param.' + name: float(value) for name, value in zip(parameter_names, x)}
+            if Y is not None:
+                row.update({'output.' + name: float(value) for name, value in zip(output_names, Y[i])})
+            rows.append({**row, **common})
+        self.append(rows)
+
+    @staticmethod
+    def run_row(scenario: dict, outputs: dict, provenance: dict = None):
+        """ The columns of a simulation run, see append_run """
+        scenario = dict(scenario)
+        row = ColumnStore.__prefixed('param', scenario.pop('arguments', {}))
+        sumo_version = scenario.pop('sumo_version', None)
+        row.update(ColumnStore.__prefixed('setting', scenario))
+
+        outputs = dict(outputs)
+        row.update(ColumnStore.__prefixed('metrics', outputs.pop('metrics', {})))
+        row.update(ColumnStore.__prefixed('output', outputs))
+
+        row.update(ColumnStore.__provenance())
+        row['provenance.sumo_version'] = sumo_version
+        row.update(ColumnStore.__prefixed('provenance', provenance or {}))
+        return row
+
+    def columns(self, group: str = None):
+        """ The names of the columns, only the ones of a group (e.g. 'output') if given """
+        names = list(self.__manifest()['columns'])
+        if group is None:
+            return names
+        return [name for name in names if name.startswith(group + '.')]
+
+    def column(self, name: str):
+        """
+        The values of a column, a read-only memory map for the number columns (NaN where a row has no value),
+        an object array of strings for the text columns (None where a row has no value)
+        """
+        return self.__read(self.__manifest(), name)
+
+    def select(self, columns: list = None, where: dict = None):
+        """
+        The values of the rows matching the conditions.
+
+        :param columns: the columns to return, defaults to all of them
+        :param where: dictionary of column name -> condition, a row is kept if it satisfies all of them. A condition is
+                a value (equality), a (low, high) tuple (inclusive range, None for no bound) or a function taking
+                the array of the column and returning a boolean mask
+        :return: dictionary of column name -> array of the values of the matching rows
+        """
+        manifest = self.__manifest()
+        mask = np.ones(manifest['rows'], dtype=bool)
+        for name, condition in (where or {}).items():
+            values = self.__read(manifest, name)
+            if callable(condition):
+                mask &= np.asarray(condition(values), dtype=bool)
+            elif isinstance(condition, tuple):
+                low, high = condition
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+            else:
+                mask &= values == condition
+
+        return {name: np.asarray(self.__read(manifest, name)[mask])
+                for name in (columns if columns is not None else manifest['columns'])}
+
+    def to_dataframe(self, columns: list = None, where: dict = None):
+        """ The result of select as a pandas DataFrame """
+        import pandas as pd
+        return pd.DataFrame(self.select(columns, where))
+
+    def __len__(self):
+        return self.__manifest()['rows']
+
+    def __manifest(self):
+        manifest_file = self.folder / 'manifest.json'
+        if not manifest_file.exists():
+            return {'rows': 0, 'columns': {}}
+        with open(manifest_file) as f:
+            return json.load(f)
+
+    def __read(self, manifest: dict, name: str):
+        assert name in manifest['columns'], 'Unknown column ' + name
+        column = manifest['columns'][name]
+        dtype = ColumnStore.dtypes[column['kind']]
+        if manifest['rows'] == 0:
+            data = np.empty(0, dtype=dtype)
+        else:
+            # only the complete rows are mapped, values being appended after them are ignored
+            data = np.memmap(self.folder / (column['file'] + '.bin'), dtype=dtype, mode='r', shape=(manifest['rows'],))
+        if column['kind'] == 'number':
+            return data
+
+        with open(self.folder / (column['file'] + '.txt')) as f:
+            strings = [json.loads(line) for _, line in zip(range(column['dictionary']), f)]
+        # code -1 is the last element, None
+        return np.array(strings + [None], dtype=object)[data]
+
+    def __write(self, column: dict, n: int, data: np.ndarray):
+        """ Writes the values of the rows from n onwards, after the n rows of the manifest """
+        dtype = ColumnStore.dtypes[column['kind']]
+        file = self.folder / (column['file'] + '.bin')
+        with open(file, 'r+b' if file.exists() else 'w+b') as f:
+            # the values left by an append that did not complete are dropped, a new column is empty until row n
+            size = f.seek(0, os.SEEK_END) // dtype.itemsize
+            if size > n:
+                f.truncate(n * dtype.itemsize)
+            elif size < n:
+                fill = np.full(n - size, np.nan if column['kind'] == 'number' else -1, dtype=dtype)
+                f.write(fill.tobytes())
+            f.seek(n * dtype.itemsize)
+            f.write(data.astype(dtype).tobytes())
+
+    def __encode(self, name: str, column: dict, values: list):
+        """ The codes of the strings of a text column, the new strings are added to its dictionary """
+        assert all(value is None or isinstance(value, str) for value in values), 'Column ' + name + ' holds text'
+        file = self.folder / (column['file'] + '.txt')
+        codes_of = {}
+        if file.exists():
+            with open(file, 'r+b') as f:
+                for code in range(column['dictionary']):
+                    codes_of[json.loads(f.readline())] = code
+                # the strings written by an append that did not complete are dropped
+                f.truncate()
+
+        new = []
+        for value in values:
+            if value is not None and value not in codes_of:
+                codes_of[value] = len(codes_of)
+                new.append(value)
+        with open(file, 'a') as f:
+            f.write(''.join(json.dumps(value) + '\n' for value in new))
+        column['dictionary'] = len(codes_of)
+        return np.array([-1 if value is None else codes_of[value] for value in values], dtype=np.int32)
+
+    @staticmethod
+    def __provenance():
+        return {'provenance.host': socket.gethostname(), 'provenance.created': time.time()}
+
+    @staticmethod
+    def __prefixed(prefix: str, values: dict):
+        """ The flattened values under prefix, see the module documentation """
+        flat = {}
+        for name, value in values.items():
+            key = prefix + '.' + str(name)
+            if isinstance(value, dict):
+                flat.update(ColumnStore.__prefixed(key, value))
+            elif isinstance(value, (list, tuple)):
+                if all(isinstance(item, (int, float)) for item in value):
+                    flat.update({key + '.' + str(i): item for i, item in enumerate(value)})
+            elif value is None or isinstance(value, (str, bool, int, float, np.number, np.bool_)):
+                flat[key] = value.item() if isinstance(value, (np.number, np.bool_)) else value
+        return flat
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--store', default=str(PathUtils.column_store_folder), help='folder of the store')
+    opt_parser.add_option('--import-pickle', default=None, help='pickle of a design, an (X, Y) tuple, to append to the store')
+    opt_parser.add_option('--parameters', default=None, help='comma separated names of the columns of X')
+    opt_parser.add_option('--outputs', default=None, help='comma separated names of the columns of Y')
+    options, args = opt_parser.parse_args()
+
+    store = ColumnStore(options.store)
+    if options.import_pickle is not None:
+        with open(options.import_pickle, 'rb') as f:
+            X, Y = pickle.load(f)
+        store.append_design(
+            X, Y,
+            options.parameters.split(',') if options.parameters else None,
+            options.outputs.split(',') if options.outputs else None,
+            {'source': os.path.basename(options.import_pickle)}
+        )
+        print(f'{len(X)} points of {options.import_pickle} appended')
+
+    print(f'{len(store)} rows in {options.store}')
+    for group in ColumnStore.groups:
+        print(f'{group}: ' + ', '.join(name[len(group) + 1:] for name in store.columns(group)))
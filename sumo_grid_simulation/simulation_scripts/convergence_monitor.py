@@ -0,0 +1,184 @@
+import math
+import optparse
+
+import numpy as np
+
+from sumo_grid_simulation.simulation_scripts.utils import import_sumo_module
+
+
+class ConvergenceMonitor:
+    """
+    Detects when the outputs of a running simulation have reached a steady state, so that it can be stopped early.
+
+    The simulated time after warm_up is split into windows of window seconds. For every window the monitor computes,
+    from the vehicles it observes through traci:
+        - timeLoss / duration: total time loss over total duration of the trips arrived in the window
+        - CO2 rate: average CO2 emitted per second by the whole network in the window, in mg/s
+    The estimate of an output is the mean of its window values, and its error the standard error of that mean
+    (batch means). The simulation has converged once every estimate has a relative error within tolerance.
+
+    The vehicles are observed at each call of the control loop (see Simulator.advance), so with a control_interval
+    the arrival times and the emission rates are sampled every control_interval seconds.
+    """
+
+    # the outputs monitored, as named in the report
+    outputs = ('timeLoss_duration_ratio', 'CO2_rate')
+    # the traci variables the vehicles are subscribed to, names of traci.constants
+    variables = ('VAR_TIMELOSS', 'VAR_CO2EMISSION')
+
+    def __init__(self, tolerance: float = 0.05, window: float = 300, min_windows: int = 3, warm_up: float = 0):
+        """
+        :param tolerance: maximum relative error (standard error / estimate) of every output to stop the simulation
+        :param window: length in simulated seconds of a window
+        :param min_windows: minimum number of complete windows before the simulation can be stopped
+        :param warm_up: simulated seconds ignored at the beginning, while the network fills up
+        """
+        assert tolerance > 0, 'tolerance must be positive'
+        assert window > 0, 'window must be positive'
+        assert min_windows >= 2, 'At least 2 windows are needed to estimate the error'
+
+        self.tolerance = tolerance
+        self.window = window
+        self.min_windows = min_windows
+        self.warm_up = warm_up
+
+        # vehicle id -> [depart time, last time loss]
+        self.__vehicles = {}
+        # time loss, duration, CO2 x time and observed time of the current window
+        self.__current = [0., 0., 0., 0.]
+        self.__window_end = None
+        self.__last_time = None
+        self.__values = {output: [] for output in ConvergenceMonitor.outputs}
+        self.__stop_time = None
+
+    def observe(self, connection, variables: tuple = None):
+        """
+        Records the state of the simulation, to be called after each call of the control loop
+
+        :param variables: the variables to subscribe the new vehicles to, the variables of every observer of the
+                connection (a subscription replaces the previous one of the vehicle). Defaults to
+                ConvergenceMonitor.variables
+        """
+        tc = import_sumo_module('traci.constants')
+        time = connection.simulation.getTime()
+        if self.__window_end is None:
+            self.__window_end = self.warm_up + self.window
+
+        current = set(connection.vehicle.getIDList())
+        results = connection.vehicle.getAllSubscriptionResults()
+
+        for vehicle in current.difference(self.__vehicles):
+            connection.vehicle.subscribe(vehicle, [getattr(tc, name) for name in variables or self.variables])
+            self.__vehicles[vehicle] = [time, 0.]
+
+        # the CO2 emission of the last step is taken as the rate of the whole interval since the previous call.
+        # A teleporting vehicle is off the road, its values are invalid: it emits nothing and keeps its time loss
+        elapsed = time - self.__last_time if self.__last_time is not None else 0.
+        self.__last_time = time
+        co2 = 0.
+        for vehicle, values in results.items():
+            if values[tc.VAR_CO2EMISSION] == tc.INVALID_DOUBLE_VALUE:
+                continue
+            if vehicle in self.__vehicles:
+                self.__vehicles[vehicle][1] = values[tc.VAR_TIMELOSS]
+            co2 += values[tc.VAR_CO2EMISSION]
+
+        arrived = [vehicle for vehicle in self.__vehicles if vehicle not in current]
+        if time <= self.warm_up:
+            for vehicle in arrived:
+                del self.__vehicles[vehicle]
+            return
+
+        for vehicle in arrived:
+            depart, time_loss = self.__vehicles.pop(vehicle)
+            self.__current[0] += time_loss
+            self.__current[1] += time - depart
+        self.__current[2] += co2 * elapsed
+        self.__current[3] += elapsed
+
+        if time >= self.__window_end:
+            self.__close_window()
+            self.__window_end += self.window * math.ceil((time - self.__window_end + 1e-9) / self.window)
+
+        if self.__stop_time is None and self.converged():
+            self.__stop_time = time
+
+    def converged(self):
+        """ Whether all the outputs are estimated within the tolerance """
+        for output in ConvergenceMonitor.outputs:
+            estimate, error, windows = self.estimate(output)
+            if windows < self.min_windows or estimate == 0 or error / abs(estimate) > self.tolerance:
+                return False
+        return True
+
+    def estimate(self, output: str):
+        """ (estimate, standard error, number of windows) of an output, the window values that are not defined are ignored """
+        values = np.array(self.__values[output], dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) < 2:
+            return math.nan, math.nan, len(values)
+        return float(values.mean()), float(values.std(ddof=1) / math.sqrt(len(values))), len(values)
+
+    def report(self, connection=None):
+        """
+        The estimates to add to the simulation outputs.
+
+        :param connection: the connection of the simulation, gives the stopping time when the simulation did not converge
+        """
+        stop_time = self.__stop_time
+        if stop_time is None and connection is not None:
+            stop_time = connection.simulation.getTime()
+
+        report = {'converged': self.__stop_time is not None, 'stop_time': stop_time}
+        for output in ConvergenceMonitor.outputs:
+            estimate, error, windows = self.estimate(output)
+            report[output] = estimate
+            report[output + '_error'] = error
+        report['convergence_windows'] = len(self.__values[ConvergenceMonitor.outputs[0]])
+        return report
+
+    def __close_window(self):
+        time_loss, duration, co2, observed = self.__current
+        self.__values['timeLoss_duration_ratio'].append(time_loss / duration if duration > 0 else math.nan)
+        self.__values['CO2_rate'].append(co2 / observed if observed > 0 else math.nan)
+        self.__current = [0., 0., 0., 0.]
+
+
+if __name__ == '__main__':
+    from sumo_grid_simulation.grid_simulation import Simulator
+    from sumo_grid_simulation.simulation_scripts.emission_model import EmissionModel
+    from sumo_grid_simulation.simulation_scripts.enums import OutputMode
+
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--check', action='store_true', default=False,
+                          help='check early termination with the MODEL output mode, which both observe the vehicles: '
+                               'the exit code is 1 if their outputs differ from the ones of separate runs')
+    opt_parser.add_option('--tolerance', type='float', default=1e-9, help='maximum relative difference of the outputs')
+    options, args = opt_parser.parse_args()
+
+    if options.check:
+        scenario = {'gridSize': 3, 'edgeLength': 50, 'trips_generator_period': 1}
+        end_time = 900
+        windows = {'end_time': end_time, 'convergence_window': 60, 'convergence_min_windows': 2}
+        model = OutputMode.MODEL.number
+
+        # a tolerance that is never reached: the monitor observes the whole run, as the recorder does
+        both = Simulator(output_mode=model, convergence_tolerance=1e-12, **windows).simulate(**scenario)
+        recorder_only = Simulator(output_mode=model, end_time=end_time).simulate(**scenario)
+        monitor_only = Simulator(convergence_tolerance=1e-12, **windows).simulate(**scenario)
+        # and one reached early, the recorder stops with the monitor
+        early = Simulator(output_mode=model, convergence_tolerance=0.5, **windows).simulate(**scenario)
+
+        comparisons = [(name, both[name], recorder_only[name]) for name in EmissionModel.outputs] + \
+                      [(name, both[name], monitor_only[name])
+                       for output in ConvergenceMonitor.outputs for name in (output, output + '_error')]
+        failed = False
+        for name, value, expected in comparisons:
+            ok = abs(value - expected) <= options.tolerance * abs(expected)
+            failed |= not ok
+            print(f"{name:<30}together {value:>14.6f}  alone {expected:>14.6f}{'' if ok else '  FAILED'}")
+        ok = early['converged'] and early['stop_time'] < end_time and early['CO2'] < both['CO2']
+        failed |= not ok
+        print(f"{'early termination':<30}stop time {early['stop_time']}  CO2 {early['CO2']:.2f}{'' if ok else '  FAILED'}")
+        if failed:
+            raise SystemExit(1)
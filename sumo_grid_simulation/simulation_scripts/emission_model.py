@@ -0,0 +1,285 @@
+import gzip
+import json
+import optparse
+import shutil
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+
+from sumo_grid_simulation.simulation_scripts.enums import EmmissionClasses, VehicleClasses
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace
+
+"""
+    Vectorized emission model, evaluating the emission functions of sumo with NumPy on the speeds and accelerations
+    of a whole run.
+
+    sumo computes the HBEFA3 emissions of a vehicle at each step as
+        rate = max(0, f0 + f1 * a * v + f2 * a^2 * v + f3 * v + f4 * v^2 + f5 * v^3) / 3.6
+    in mg/s (fuel included), with v the speed (m/s) and a the acceleration (m/s^2) of the step. The rate is zero while
+    the vehicle coasts: faster than min_speed and decelerating more than the coasting deceleration of its vehicle
+    class, a line of the speed scaled down linearly to zero below reference_speed. The noise is the Harmonoise model of
+    sumo: the rolling and traction noise of 27 frequency bands, A-weighted and summed, for a light or heavy vehicle.
+    "Zero" emits nothing and makes no noise, "Energy" emits no pollutant and makes the noise of a light vehicle.
+
+    PathUtils.emission_model_file holds the coefficients of the HBEFA3 classes of EmmissionClasses and the noise
+    tables, as published in the sources of sumo, and the coasting lines of sumo for each vehicle class. The model is
+    checked against emission outputs of sumo kept in PathUtils.emission_reference_folder, the exit code is 1 if
+    any total is off by more than the tolerance:
+
+        python -m sumo_grid_simulation.simulation_scripts.emission_model --check
+
+    With --sumo the reference runs are simulated again with the installed sumo instead, and --write-reference
+    replaces the committed outputs by the ones of the installed sumo.
+"""
+
+# the scenario of the reference runs, simulated for each (vehicle class, emission class) of reference_runs
+reference_scenario = {'gridSize': 3, 'junctionType': 2, 'edgeLength': 50, 'trips_generator_period': 1}
+reference_end_time = 60
+reference_runs = [(VehicleClasses.PASSENGER, emission_class) for emission_class in EmmissionClasses] + [
+    (VehicleClasses.BUS, EmmissionClasses.BUS_AVERAGE),
+    (VehicleClasses.TRUCK, EmmissionClasses.LDV_AVERAGE)
+]
+
+
+class EmissionModel:
+
+    # the pollutants of the HBEFA3 functions, noise is handled apart
+    pollutants = ('CO2', 'CO', 'HC', 'NOx', 'PMx', 'fuel')
+    outputs = pollutants + ('noise',)
+
+    def __init__(self, parameters: dict = None, path: Path = PathUtils.emission_model_file):
+        """
+        :param parameters: the content of an emission model file. Read from path if None
+        :param path: the file the parameters are read from
+        """
+        if parameters is None:
+            if not Path(path).exists():
+                raise FileNotFoundError('The emission model file ' + str(path) + ' is missing')
+            with open(path) as f:
+                parameters = json.load(f)
+        self.parameters = parameters
+        self.sumo_version = parameters.get('sumo_version')
+        self.classes = parameters['classes']
+        # the names of the classes in the outputs of sumo, e.g. 'Zero/default'
+        self.aliases = parameters.get('aliases', {})
+        self.coasting = parameters['coasting']
+        self.noise = parameters['noise']
+
+    def emission_rates(self, emission_class: str, vehicle_class: str, speed: np.ndarray, accel: np.ndarray):
+        """
+        The emission rates of every sample, as written by sumo in the emission output
+
+        :param emission_class: the sumo name of the class, e.g. 'HBEFA3/PC_G_EU4'
+        :param vehicle_class: the sumo vehicle class, e.g. 'passenger', which sets the coasting deceleration
+        :param speed: speeds in m/s
+        :param accel: accelerations in m/s^2, of the same shape
+        :return: dictionary of pollutant -> array of the rates in mg/s, noise -> array of the noise levels in dB
+        """
+        parameters = self.class_parameters(emission_class)
+        speed = np.asarray(speed, dtype=float)
+        accel = np.asarray(accel, dtype=float)
+
+        rates = {}
+        if parameters['coefficients'] is None:
+            for pollutant in EmissionModel.pollutants:
+                rates[pollutant] = np.zeros(speed.shape)
+        else:
+            features = EmissionModel.features(speed, accel)
+            coasting = self.coasting_samples(vehicle_class, speed, accel)
+            for pollutant in EmissionModel.pollutants:
+                rate = np.maximum(features @ np.asarray(parameters['coefficients'][pollutant]) / 3.6, 0.)
+                rate[coasting] = 0.
+                rates[pollutant] = rate
+        rates['noise'] = np.zeros(speed.shape) if parameters['noise'] is None \
+            else self.noise_levels(parameters['noise'], speed, accel)
+        return rates
+
+    def totals(self, emission_class: str, vehicle_class: str, speed: np.ndarray, accel: np.ndarray):
+        """ The sums of the rates of the samples, with the keys and the meaning of Simulator.parse_emissions_output """
+        rates = self.emission_rates(emission_class, vehicle_class, speed, accel)
+        out = {name: float(rates[name].sum()) for name in EmissionModel.outputs}
+        out['num_emissions_samples'] = int(np.size(speed))
+        return out
+
+    def trajectory_totals(self, trajectories: dict, emission_class: str = None):
+        """
+        The totals of the samples of trajectories (see read_trajectories), each sample with its own emission class, or
+        with emission_class if it is given
+        """
+        classes = trajectories['class'] if emission_class is None \
+            else np.full(len(trajectories['speed']), emission_class, dtype=object)
+        out = {name: 0. for name in EmissionModel.outputs}
+        for sample_class, vehicle_class in sorted(set(zip(classes, trajectories['vehicle_class']))):
+            rows = (classes == sample_class) & (trajectories['vehicle_class'] == vehicle_class)
+            totals = self.totals(sample_class, vehicle_class, trajectories['speed'][rows], trajectories['accel'][rows])
+            for name in EmissionModel.outputs:
+                out[name] += totals[name]
+        out['num_emissions_samples'] = int(len(trajectories['speed']))
+        return out
+
+    def class_parameters(self, emission_class: str):
+        name = self.aliases.get(emission_class, emission_class)
+        if name not in self.classes:
+            raise ValueError('Emission class ' + emission_class + ' is not in the emission model')
+        return self.classes[name]
+
+    def coasting_samples(self, vehicle_class: str, speed: np.ndarray, accel: np.ndarray):
+        """
+        Whether each sample is coasting, and emits nothing. A vehicle class without a coasting line of its own (e.g.
+        bicycle) takes the one of the default vehicle class of sumo
+        """
+        lines = self.coasting['vehicle_classes']
+        intercept, slope = lines.get(vehicle_class, lines[self.coasting['default_vehicle_class']])
+        reference_speed = self.coasting['reference_speed']
+        decel = np.where(speed < reference_speed, speed / reference_speed * (intercept + slope * reference_speed),
+                         intercept + slope * speed)
+        return (speed > self.coasting['min_speed']) & (accel < decel)
+
+    def noise_levels(self, category: str, speed: np.ndarray, accel: np.ndarray):
+        """ The Harmonoise level in dB(A) of every sample, for a 'light' or 'heavy' vehicle """
+        tables = {name: np.asarray(values) for name, values in self.noise[category].items()}
+        kmh = speed[..., None] * 3.6
+        with np.errstate(divide='ignore'):
+            # no rolling noise at standstill, 10^-inf
+            rolling = 10 ** ((tables['rolling_a'] + tables['rolling_b'] * np.log10(kmh / 70.)) / 10)
+        traction = 10 ** ((tables['traction_a'] + tables['traction_b'] * (kmh - 70.) / 70.
+                           + tables['accel'] * accel[..., None]) / 10)
+        weighting = 10 ** (np.asarray(self.noise['a_weighting']) / 10)
+        return 10 * np.log10(((rolling + traction) * weighting).sum(axis=-1)) + self.noise['offset']
+
+    @staticmethod
+    def features(speed: np.ndarray, accel: np.ndarray):
+        """ The terms of the HBEFA3 function of every sample, Nx6 """
+        return np.stack([np.ones_like(speed), accel * speed, accel * accel * speed, speed, speed ** 2, speed ** 3],
+                        axis=-1)
+
+    @staticmethod
+    def read_trajectories(emissions_file: Path, vehicle_class: str = 'passenger'):
+        """
+        The samples of a sumo emission output, gzipped or not, with their acceleration. The emission output has no
+        acceleration, it is the one of sumo (as read by TrajectoryRecorder): the speed change since the previous step,
+        0 on the step a vehicle is inserted. A vehicle teleported and inserted again on the next step looks like a
+        continuing one, its acceleration on that step is wrong, so the outputs read must have been written with
+        precise speeds (sumo --precision) and without teleports.
+
+        :param vehicle_class: the vehicle class of every vehicle of the output
+        :return: dictionary of arrays: 'class' (sumo emission class), 'vehicle_class', 'speed', 'accel' and each of
+                outputs
+        """
+        previous = {}  # vehicle -> (time, speed) of its last sample
+        previous_time = None
+        columns = {name: [] for name in ('class', 'speed', 'accel') + EmissionModel.outputs}
+        with (gzip.open if str(emissions_file).endswith('.gz') else open)(emissions_file, 'rb') as f:
+            for _, element in ET.iterparse(f):
+                if element.tag != 'timestep':
+                    continue
+                time = float(element.get('time'))
+                for vehicle in element.iter('vehicle'):
+                    speed = float(vehicle.get('speed'))
+                    last = previous.get(vehicle.get('id'))
+                    previous[vehicle.get('id')] = (time, speed)
+                    columns['class'].append(vehicle.get('eclass'))
+                    columns['speed'].append(speed)
+                    columns['accel'].append((speed - last[1]) / (time - last[0])
+                                            if last is not None and last[0] == previous_time else 0.)
+                    for name in EmissionModel.outputs:
+                        columns[name].append(float(vehicle.get(name)))
+                previous_time = time
+                element.clear()
+
+        trajectories = {name: np.array(values, dtype=object if name == 'class' else float)
+                        for name, values in columns.items()}
+        trajectories['vehicle_class'] = np.full(len(columns['speed']), vehicle_class, dtype=object)
+        return trajectories
+
+    def validate(self, trajectories: dict):
+        """
+        Compares the model with the emission output of sumo on the same samples
+
+        :return: dictionary of emission class -> output -> {'sumo': total, 'model': total, 'relative_error': ...}
+        """
+        report = {}
+        for emission_class in sorted(set(trajectories['class'])):
+            rows = trajectories['class'] == emission_class
+            model = self.trajectory_totals({name: values[rows] for name, values in trajectories.items()})
+            report[emission_class] = {}
+            for name in EmissionModel.outputs:
+                sumo = float(trajectories[name][rows].sum())
+                report[emission_class][name] = {
+                    'sumo': sumo,
+                    'model': model[name],
+                    'relative_error': abs(model[name] - sumo) / abs(sumo) if sumo != 0 else abs(model[name])
+                }
+        return report
+
+
+def reference_file_name(vehicle_class: VehicleClasses, emission_class: EmmissionClasses):
+    return vehicle_class.tag + '_' + emission_class.tag.replace('/', '_') + '.xml.gz'
+
+
+def simulate_reference(folder: Path):
+    """ Simulates the reference runs with the installed sumo and writes their gzipped emission outputs in folder """
+    from sumo_grid_simulation.grid_simulation import Simulator
+
+    simulator = Simulator(end_time=reference_end_time, no_control=True, native_trips=True)
+    for vehicle_class, emission_class in reference_runs:
+        with Workspace(prefix='emission_reference_') as workspace:
+            simulator.prepare_workspace(workspace, **reference_scenario, vehicleClass=vehicle_class.number,
+                                        emissionClass=emission_class.number)
+            # the full precision of the values and of the speeds, which give the accelerations, only the attributes
+            # read by read_trajectories, and no teleport (see read_trajectories). Without teleports a gridlock never
+            # clears, so the run is cut at a fixed time
+            simulator.run_without_client(workspace, simulator.sumo_command(workspace) + [
+                '--precision', '6', '--emission-output.precision', '6', '--time-to-teleport', '-1',
+                '--end', str(2 * reference_end_time),
+                '--emission-output.attributes', ','.join(('id', 'eclass', 'speed') + EmissionModel.outputs)
+            ])
+            with open(workspace.emissions_file, 'rb') as source, \
+                    gzip.open(Path(folder) / reference_file_name(vehicle_class, emission_class), 'wb') as target:
+                shutil.copyfileobj(source, target)
+    return Simulator.sumo_version(simulator.sumoBinary)
+
+
+def read_reference(folder: Path):
+    """ The trajectories of all the reference runs written in folder, see read_trajectories """
+    parts = [EmissionModel.read_trajectories(Path(folder) / reference_file_name(vehicle_class, emission_class),
+                                             vehicle_class.tag)
+             for vehicle_class, emission_class in reference_runs]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--check', action='store_true', default=False,
+                          help='compare the model with the emission outputs of the reference runs')
+    opt_parser.add_option('--sumo', action='store_true', default=False,
+                          help='check against the reference runs simulated with the installed sumo instead of the '
+                               'committed outputs')
+    opt_parser.add_option('--write-reference', action='store_true', default=False,
+                          help='replace the committed outputs by the reference runs of the installed sumo')
+    opt_parser.add_option('--tolerance', type='float', default=0.0001, help='maximum relative error of the totals')
+    options, args = opt_parser.parse_args()
+
+    if options.write_reference:
+        PathUtils.emission_reference_folder.mkdir(parents=True, exist_ok=True)
+        version = simulate_reference(PathUtils.emission_reference_folder)
+        print(f'Emission outputs of sumo {version} written to {PathUtils.emission_reference_folder}')
+
+    if options.check:
+        if options.sumo:
+            with Workspace(prefix='emission_check_') as workspace:
+                simulate_reference(workspace.folder)
+                trajectories = read_reference(workspace.folder)
+        else:
+            trajectories = read_reference(PathUtils.emission_reference_folder)
+        report = EmissionModel().validate(trajectories)
+        failed = False
+        for emission_class, outputs in report.items():
+            for name, comparison in outputs.items():
+                ok = comparison['relative_error'] <= options.tolerance
+                failed |= not ok
+                print(f"{emission_class:<18}{name:<7}sumo {comparison['sumo']:>14.2f}  model {comparison['model']:>14.2f}"
+                      f"  error {comparison['relative_error']:>8.5f}{'' if ok else '  FAILED'}")
+        if failed:
+            raise SystemExit(1)
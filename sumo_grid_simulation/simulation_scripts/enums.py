@@ -107,3 +107,76 @@ class EmmissionClasses(AbstractEnum):
     PC_AVERAGE = 4, "HBEFA3/PC" # average passenger car (all fuel types)
     BUS_AVERAGE = 5, "HBEFA3/Bus" # average urban bus (all fuel types)
     LDV_AVERAGE = 6, "HBEFA3/LDV" # average light duty vehicles (all fuel types) !! KNOWN TO BE FAULTY WITH NOx
+
+@unique
+class SimulationBackend(AbstractEnum):
+
+    @staticmethod
+    def get_by_number(number: int):
+        for i in SimulationBackend:
+            if i.number == number:
+                return i
+        return None
+
+    # https://sumo.dlr.de/docs/Libsumo.html
+    TRACI = 1, 'traci' # sumo runs as a subprocess, controlled through a socket
+    LIBSUMO = 2, 'libsumo' # sumo runs inside the python process, only one simulation per process and no gui
+
+@unique
+class FidelityLevel(AbstractEnum):
+
+    @staticmethod
+    def get_by_number(number: int):
+        for i in FidelityLevel:
+            if i.number == number:
+                return i
+        return None
+
+    # see Simulator.fidelity_levels for what each level changes
+    LOW = 1, 'low'
+    MEDIUM = 2, 'medium'
+    HIGH = 3, 'high' # the settings of the simulator itself
+
+@unique
+class SimulationModel(AbstractEnum):
+
+    @staticmethod
+    def get_by_number(number: int):
+        for i in SimulationModel:
+            if i.number == number:
+                return i
+        return None
+
+    @staticmethod
+    def get_by_tag(tag: str):
+        for i in SimulationModel:
+            if i.tag == tag:
+                return i
+        return None
+
+    # https://sumo.dlr.de/docs/Simulation/Meso.html
+    MICRO = 1, 'micro' # every vehicle is moved by its car following model at each step
+    MESO = 2, 'meso' # edges are queues, vehicles only change state when they enter or leave a segment
+
+@unique
+class OutputMode(AbstractEnum):
+
+    @staticmethod
+    def get_by_number(number: int):
+        for i in OutputMode:
+            if i.number == number:
+                return i
+        return None
+
+    @staticmethod
+    def get_by_tag(tag: str):
+        for i in OutputMode:
+            if i.tag == tag:
+                return i
+        return None
+
+    # https://sumo.dlr.de/docs/Simulation/Output/Lane-_or_Edge-based_Traffic_Measures.html
+    VEHICLE = 1, 'vehicle' # one emission record per vehicle and step (--emission-output)
+    EDGE = 2, 'edge' # emissions and traffic measures of each edge, aggregated over intervals
+    LANE = 3, 'lane' # as EDGE, for each lane
+    MODEL = 4, 'model' # no emission output, the emissions are computed from the speeds and accelerations (see EmissionModel)
@@ -1,15 +1,15 @@
-from xml.dom import minidom
-import math
-from xml.dom.minidom import Document
 import subprocess
 from sumo_grid_simulation.simulation_scripts.enums import *
-from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace
+from sumo_grid_simulation.simulation_scripts.grid_generator.net_rescaler import NetRescaler
 
 """
     This class generates grid networks for sumo
     
     The main method to use is:
-        generate_grid_net
+        GridGenerator(workspace).generate_grid_net
+
+    The settings of the grid are kept in the instance, so separate instances can be used concurrently.
         
     There are several input parameters that are specifiable:
         - gridSize: The size of the grid (the number of junctions on one side)
@@ -34,33 +34,74 @@ from sumo_grid_simulation.simulation_scripts.utils import PathUtils
                     Discrete variable, Domain [0, +inf]
         
     This method takes as input a series of parameters relating to the grid and creates 3 files:
-        - nodes.nod.xml the xml description of the nodes (located in the grid_plain_xml folder)
-        - edges.edg.xml the xml description of the edges (located in the grid_plain_xml folder)
+        - nodes.nod.xml the xml description of the nodes (located in the workspace folder)
+        - edges.edg.xml the xml description of the edges (located in the workspace folder)
         - grid.net.xml the network file that can be opened in sumo-gui and netedit
 
 """
 class GridGenerator:
 
-    __junctionType = JunctionType.PRIORITY.tag
-    __tlType = TrafficLightType.ACTUATED.tag
-    __tlLayout = TrafficLightLayout.OPPOSITES.tag
-    __keepClear = True
-    __edgeType = EdgeType.NORMAL_ROAD.tag
-    __edgeLength = 50
-    __numberOfLanes = 1
-    __edgeMaxSpeed = 13.9
-    __edgePriority = 0
-
-    netconvert_command = ['netconvert',
-                          '--node-files=' + str(PathUtils.nodes_file),
-                          '--edge-files=' + str(PathUtils.edges_file),
-                          '--type-files=' + str(PathUtils.edge_types_file),
-                          '--output-file=' + str(PathUtils.grid_net_file)]
-
-    @staticmethod
-    def generate_grid_net(gridSize: int, junctionType: int = 1, tlType: int = 2, tlLayout: int = 1, keepClearJunctions: bool = True,
+    # edge length and speed of the template nets (see generate_grid_net_from_template), the speed must be higher
+    # than the curvature speed limit of every turn so that the limits are recorded in the template
+    template_edge_length = 100
+    template_edge_max_speed = 50
+
+    def __init__(self, workspace: Workspace = None):
+        """
+        :param workspace: the workspace the plain xml and net files are written to.
+                If None the shared files in PathUtils are used
+        """
+        self.workspace = workspace if workspace is not None else PathUtils
+
+        self.__junctionType = JunctionType.PRIORITY.tag
+        self.__tlType = TrafficLightType.ACTUATED.tag
+        self.__tlLayout = TrafficLightLayout.OPPOSITES.tag
+        self.__keepClear = True
+        self.__edgeType = EdgeType.NORMAL_ROAD.tag
+        self.__edgeLength = 50
+        self.__numberOfLanes = 1
+        self.__edgeMaxSpeed = 13.9
+        self.__edgePriority = 0
+
+    def netconvert_command(self):
+        return ['netconvert',
+                '--node-files=' + str(self.workspace.nodes_file),
+                '--edge-files=' + str(self.workspace.edges_file),
+                '--type-files=' + str(self.workspace.edge_types_file),
+                '--output-file=' + str(self.workspace.grid_net_file)]
+
+    def generate_grid_net(self, gridSize: int, junctionType: int = 1, tlType: int = 2, tlLayout: int = 1, keepClearJunctions: bool = True,
                           edgeType: int = 1, edgeLength: float = 50, numberOfLanes: int = 1, edgeMaxSpeed: float = 13.9, edgePriority: int = 0, verbosity_level: int = 0):
 
+        f_nodes, f_edges = self.generate_grid_xml(gridSize, junctionType, tlType, tlLayout, keepClearJunctions,
+                                                  edgeType, edgeLength, numberOfLanes, edgeMaxSpeed, edgePriority)
+        self.generate_net_from_xml(verbosity_level)
+
+        return f_nodes, f_edges
+
+    def generate_grid_net_from_template(self, template_net_file, edgeLength: float = 50, edgeMaxSpeed: float = 13.9,
+                                        template_edge_length: float = template_edge_length):
+        """
+        Derives the net of the workspace from a template net with the same topology, without running netconvert.
+
+        :param template_net_file: net generated by generate_grid_net with edgeLength template_edge_length and
+                either edgeMaxSpeed template_edge_max_speed or, if it has traffic lights, the same edgeMaxSpeed
+        """
+        assert edgeLength > 0, 'Edge length should be greater then 0'
+        assert edgeMaxSpeed > 0, 'The maximum speed on the roads should be greater than 0'
+
+        NetRescaler.rescale(template_net_file, self.workspace.grid_net_file, edgeLength / template_edge_length, edgeMaxSpeed)
+
+    @staticmethod
+    def has_traffic_lights(junctionType: int):
+        """ Whether the junctions of the given type are controlled by traffic light programs """
+        return JunctionType.get_by_number(junctionType) in (
+            JunctionType.TRAFFIC_LIGHT, JunctionType.TRAFFIC_LIGHT_UNREGULATED, JunctionType.TRAFFIC_LIGHT_ON_RED
+        )
+
+    def generate_grid_xml(self, gridSize: int, junctionType: int = 1, tlType: int = 2, tlLayout: int = 1, keepClearJunctions: bool = True,
+                          edgeType: int = 1, edgeLength: float = 50, numberOfLanes: int = 1, edgeMaxSpeed: float = 13.9, edgePriority: int = 0):
+        """ Writes the nodes and edges plain xml files without running netconvert """
         assert gridSize > 1, 'gridSize should be greater than 1'
         assert JunctionType.get_by_number(junctionType) is not None, 'Specified junctionType is not supported'
         assert TrafficLightType.get_by_number(tlType) is not None, 'Specified tlType is not supported'
@@ -71,25 +112,21 @@ class GridGenerator:
         assert edgeMaxSpeed > 0, 'The maximum speed on the roads should be greater than 0'
         assert edgePriority >= 0, 'Priority cannot be negative'
 
-        GridGenerator.__junctionType = JunctionType.get_by_number(junctionType).tag
-        GridGenerator.__tlType = TrafficLightType.get_by_number(tlType).tag
-        GridGenerator.__tlLayout = TrafficLightLayout.get_by_number(tlLayout).tag
-        GridGenerator.__keepClear = keepClearJunctions
-        GridGenerator.__edgeType = EdgeType.get_by_number(edgeType).tag
-        GridGenerator.__edgeLength = edgeLength
-        GridGenerator.__numberOfLanes = numberOfLanes
-        GridGenerator.__edgeMaxSpeed = edgeMaxSpeed
-        GridGenerator.__edgePriority = edgePriority
-
-        f_nodes, f_edges = GridGenerator.__generate_grid_xml(gridSize)
-        GridGenerator.generate_net_from_xml(verbosity_level)
+        self.__junctionType = JunctionType.get_by_number(junctionType).tag
+        self.__tlType = TrafficLightType.get_by_number(tlType).tag
+        self.__tlLayout = TrafficLightLayout.get_by_number(tlLayout).tag
+        self.__keepClear = keepClearJunctions
+        self.__edgeType = EdgeType.get_by_number(edgeType).tag
+        self.__edgeLength = edgeLength
+        self.__numberOfLanes = numberOfLanes
+        self.__edgeMaxSpeed = edgeMaxSpeed
+        self.__edgePriority = edgePriority
 
-        return f_nodes, f_edges
+        return self.__generate_grid_xml(gridSize)
 
-    @staticmethod
-    def generate_net_from_xml(verbosity_level: int = 0):
+    def generate_net_from_xml(self, verbosity_level: int = 0):
 
-        command = GridGenerator.netconvert_command
+        command = self.netconvert_command()
 
         if verbosity_level > 0:
             command.append('--verbose')
@@ -106,239 +143,127 @@ class GridGenerator:
         if error:
             print(error.decode())
 
-    @staticmethod
-    def __generate_grid_xml(size: int, withOuterNodes: bool = True):
+    def __generate_grid_xml(self, size: int, withOuterNodes: bool = True):
         if size <= 0:
             return None
 
-        nodes_file = GridGenerator.__generate_nodes_file(size, withOuterNodes)
-        edges_file = GridGenerator.__generate_edges_file(size, withOuterNodes)
-
-        f_nodes = open(PathUtils.nodes_file, "w")
-        f_nodes.write(nodes_file)
-        f_nodes.close()
+        with open(self.workspace.nodes_file, "w") as f_nodes:
+            self.__write_nodes_file(f_nodes, size, withOuterNodes)
 
-        f_edges = open(PathUtils.edges_file, "w")
-        f_edges.write(edges_file)
-        f_edges.close()
+        with open(self.workspace.edges_file, "w") as f_edges:
+            self.__write_edges_file(f_edges, size, withOuterNodes)
 
         return f_nodes, f_edges
 
     @staticmethod
-    def __generate_nodes_file(size: int, withOuterNodes: bool = True):
-        doc = minidom.Document()
-
-        root = doc.createElement('nodes')
-        root.setAttribute('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
-        root.setAttribute('xsi:noNamespaceSchemaLocation', 'http://sumo.dlr.de/xsd/nodes_file.xsd')
-        doc.appendChild(root)
-
-        node = doc.createElement('node')
-        node.setAttribute('id', 'n1')
-        node.setAttribute('x', '0')
-        node.setAttribute('y', '0')
-        node.setAttribute('type', GridGenerator.__junctionType)
-        node.setAttribute('tlType', GridGenerator.__tlType)
-        node.setAttribute('tlLayout', GridGenerator.__tlLayout)
-        node.setAttribute('keepClear', str(GridGenerator.__keepClear).lower())
-
-        root.appendChild(node)
-
-        for i in range(size-1):
-            doc = GridGenerator.__increase_grid_size(doc)
+    def node_number(column: int, row: int):
+        """
+        The number of the inner node at the given column and row, its id is 'n' + number.
+
+        Nodes are numbered ring by ring: the grid of size k is grown to size k + 1 by adding the column x = k
+        (bottom to top) and then the row y = k (right to left).
+        """
+        ring = max(column, row)
+        if column == ring:
+            return ring ** 2 + row + 1
+        return ring ** 2 + 2 * ring - column + 1
+
+    def __write_nodes_file(self, f, size: int, withOuterNodes: bool = True):
+        """ Streams the nodes in the order of their numbers, in linear time in the number of nodes """
+        f.write('<?xml version="1.0" ?>\n')
+        f.write('<nodes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/nodes_file.xsd">\n')
+
+        length = self.__edgeLength
+        junction_attributes = (' type="' + self.__junctionType + '" tlType="' + self.__tlType +
+                               '" tlLayout="' + self.__tlLayout + '" keepClear="' + str(self.__keepClear).lower() + '"/>\n')
+
+        f.write('\t<node id="n1" x="0" y="0"' + junction_attributes)
+        for ring in range(1, size):
+            # column x = ring, bottom to top
+            for row in range(ring + 1):
+                f.write(self.__node_line('n' + str(ring ** 2 + row + 1), length * ring, length * row) + junction_attributes)
+            # row y = ring, right to left
+            for column in range(ring - 1, -1, -1):
+                f.write(self.__node_line('n' + str(ring ** 2 + 2 * ring - column + 1), length * column, length * ring) + junction_attributes)
 
         if withOuterNodes:
-            doc = GridGenerator.__add_outer_nodes(doc)
-
-        xml_str = doc.toprettyxml(indent="\t")
-        return xml_str
+            outer_attributes = ' type="' + JunctionType.PRIORITY.tag + '"/>\n'
+            for i in range(4 * size):
+                if i < size:
+                    x = length * i
+                    y = -length
+                elif i < 2 * size:
+                    x = length * size
+                    y = length * (i - size)
+                elif i < 3 * size:
+                    x = length * (size - 1 - (i - 2 * size))
+                    y = length * size
+                else:
+                    x = -length
+                    y = length * (size - 1 - (i - 3 * size))
+                f.write(self.__node_line('o' + str(i + 1), x, y) + outer_attributes)
+
+        f.write('</nodes>\n')
 
     @staticmethod
-    def __increase_grid_size(doc: Document):
-
-        root = doc.documentElement
-        nodes_in_file = [childNode for childNode in root.childNodes if childNode.nodeType == 1]
-
-        # number of nodes in the grid
-        num_of_nodes = len(nodes_in_file)
-        grid_size = int(math.sqrt(num_of_nodes))
-        num_of_nodes_to_insert = 2 * grid_size + 1
-
-        for i in range(num_of_nodes_to_insert):
-            node = doc.createElement('node')
-            node.setAttribute('id', 'n' + str(num_of_nodes + i + 1))
-            if i <= num_of_nodes_to_insert // 2:
-                x = GridGenerator.__edgeLength * grid_size
-                y = GridGenerator.__edgeLength * i
-            else:
-                x = GridGenerator.__edgeLength * (num_of_nodes_to_insert - i - 1)
-                y = GridGenerator.__edgeLength * grid_size
-            node.setAttribute('x', str(x))
-            node.setAttribute('y', str(y))
-
-            node.setAttribute('type', GridGenerator.__junctionType)
-            node.setAttribute('tlType', GridGenerator.__tlType)
-            node.setAttribute('tlLayout', GridGenerator.__tlLayout)
-            node.setAttribute('keepClear', str(GridGenerator.__keepClear).lower())
-
-            root.appendChild(node)
-
-        return doc
-
-    @staticmethod
-    def __add_outer_nodes(doc: Document):
-
-        root = doc.documentElement
-        nodes_in_file = [childNode for childNode in root.childNodes if childNode.nodeType == 1]
-
-        # number of nodes in the grid
-        num_of_nodes = len(nodes_in_file)
-        grid_size = int(math.sqrt(num_of_nodes))
-        num_of_nodes_to_insert = grid_size * 4
-
-        for i in range(num_of_nodes_to_insert):
-            node = doc.createElement('node')
-            node.setAttribute('id', 'o' + str(i + 1))
-            if i < num_of_nodes_to_insert // 4:
-                x = GridGenerator.__edgeLength * i
-                y = -GridGenerator.__edgeLength
-            elif i < 2 * (num_of_nodes_to_insert // 4):
-                x = GridGenerator.__edgeLength * grid_size
-                y = GridGenerator.__edgeLength * (i - num_of_nodes_to_insert // 4)
-            elif i < 3 * (num_of_nodes_to_insert // 4):
-                x = GridGenerator.__edgeLength * (grid_size - 1 - (i - 2 * num_of_nodes_to_insert // 4))
-                y = GridGenerator.__edgeLength * grid_size
-            else:
-                x = -GridGenerator.__edgeLength
-                y = GridGenerator.__edgeLength * (grid_size - 1 - (i - 3 * num_of_nodes_to_insert // 4))
-
-            node.setAttribute('x', str(x))
-            node.setAttribute('y', str(y))
-
-            node.setAttribute('type', JunctionType.PRIORITY.tag)
-
-            root.appendChild(node)
-
-        return doc
+    def __node_line(node_id: str, x, y):
+        return '\t<node id="' + node_id + '" x="' + str(x) + '" y="' + str(y) + '"'
 
     @staticmethod
-    def __generate_edges_file(size: int, withOuterNodes: bool = True):
-
-        doc = minidom.Document()
-
-        root = doc.createElement('edges')
-        root.setAttribute('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
-        root.setAttribute('xsi:noNamespaceSchemaLocation', 'http://sumo.dlr.de/xsd/edges_file.xsd')
-        doc.appendChild(root)
-
-        for i in range(size - 1):
-            doc = GridGenerator.__add_edges_to_grid(doc, i+2)
+    def grid_edges(size: int, withOuterNodes: bool = True):
+        """
+        The (from, to) node ids of every edge of the grid, in the order of the edges file.
+
+        The edges are listed ring by ring (the ring added when growing the grid from k - 1 to k), each edge being
+        followed by its inverse, then the edges to and from the outer nodes. The id of an edge is from + 'to' + to.
+        """
+        for grid_size in range(2, size + 1):
+            old_grid_size = grid_size - 1
+            num_of_nodes = grid_size ** 2
+            old_num_of_nodes = old_grid_size ** 2
+
+            for i in range(4 * old_grid_size):
+                if i < old_grid_size:
+                    start = old_num_of_nodes - i
+                    end = num_of_nodes - i
+                elif i < 2 * old_grid_size:
+                    start = old_num_of_nodes - i + 1
+                    end = num_of_nodes - i - 1
+                else:
+                    start = old_num_of_nodes + i - 2 * old_grid_size + 1
+                    end = start + 1
+                yield 'n' + str(start), 'n' + str(end)
+                yield 'n' + str(end), 'n' + str(start)
 
         if withOuterNodes:
-            doc = GridGenerator.__add_outer_edges(doc, size)
-
-        xml_str = doc.toprettyxml(indent="\t")
-        return xml_str
-
-    @staticmethod
-    def __add_edges_to_grid(doc: Document, size: int):
-
-        root = doc.documentElement
-
-        # number of nodes in the grid
-        grid_size = size
-        old_grid_size = grid_size - 1
-        num_of_nodes = grid_size ** 2
-        old_num_of_nodes = old_grid_size ** 2
-
-        num_of_edges_to_insert = 4 * old_grid_size
-
-        for i in range(num_of_edges_to_insert):
-
-            if i < num_of_edges_to_insert // 4:
-                start = old_num_of_nodes - i
-                end = num_of_nodes - i
-            elif i < num_of_edges_to_insert // 2:
-                start = old_num_of_nodes - i + 1
-                end = num_of_nodes - i - 1
-            else:
-                start = old_num_of_nodes + i - num_of_edges_to_insert // 2 + 1
-                end = start + 1
-
-            edge = doc.createElement('edge')
-            edge.setAttribute('id', 'n' + str(start) + 'ton' + str(end))
-            edge.setAttribute('from', 'n' + str(start))
-            edge.setAttribute('to', 'n' + str(end))
-
-            edge.setAttribute('numLanes', str(GridGenerator.__numberOfLanes))
-            edge.setAttribute('speed', str(GridGenerator.__edgeMaxSpeed))
-            edge.setAttribute('priority', str(GridGenerator.__edgePriority))
-            edge.setAttribute('type', GridGenerator.__edgeType)
-
-            edge_inverse = doc.createElement('edge')
-            edge_inverse.setAttribute('id', 'n' + str(end) + 'ton' + str(start))
-            edge_inverse.setAttribute('from', 'n' + str(end))
-            edge_inverse.setAttribute('to', 'n' + str(start))
-
-            edge_inverse.setAttribute('numLanes', str(GridGenerator.__numberOfLanes))
-            edge_inverse.setAttribute('speed', str(GridGenerator.__edgeMaxSpeed))
-            edge_inverse.setAttribute('priority', str(GridGenerator.__edgePriority))
-            edge_inverse.setAttribute('type', GridGenerator.__edgeType)
-
-            root.appendChild(edge)
-            root.appendChild(edge_inverse)
-
-
-            root.appendChild(edge_inverse)
-
-        return doc
-
-    @staticmethod
-    def __add_outer_edges(doc: Document, size: int):
-
-        root = doc.documentElement
-
-        grid_size = size
-        num_of_edges_to_insert = 4 * grid_size
-
-        for i in range(num_of_edges_to_insert):
-
-            if i < num_of_edges_to_insert // 4:
-                start = i ** 2 + 1
-                end = i + 1
-            elif i < num_of_edges_to_insert // 2:
-                start = ((grid_size - 1) ** 2) + i + 1 - num_of_edges_to_insert // 4
-                end = i + 1
-            elif i < 3 * num_of_edges_to_insert // 4:
-                start = ((grid_size - 1) ** 2) + i - num_of_edges_to_insert // 4
+            for i in range(4 * size):
+                if i < size:
+                    start = i ** 2 + 1
+                elif i < 2 * size:
+                    start = ((size - 1) ** 2) + i + 1 - size
+                elif i < 3 * size:
+                    start = ((size - 1) ** 2) + i - size
+                else:
+                    start = (size - (i - 3 * size)) ** 2
                 end = i + 1
-            else:
-                start = (grid_size - (i - 3 * num_of_edges_to_insert // 4)) ** 2
-                end = i + 1
-
-            edge = doc.createElement('edge')
-            edge.setAttribute('id', 'n' + str(start) + 'too' + str(end))
-            edge.setAttribute('from', 'n' + str(start))
-            edge.setAttribute('to', 'o' + str(end))
+                yield 'n' + str(start), 'o' + str(end)
+                yield 'o' + str(end), 'n' + str(start)
 
-            edge.setAttribute('numLanes', str(GridGenerator.__numberOfLanes))
-            edge.setAttribute('speed', str(GridGenerator.__edgeMaxSpeed))
-            edge.setAttribute('priority', str(GridGenerator.__edgePriority))
-            edge.setAttribute('type', GridGenerator.__edgeType)
+    def __write_edges_file(self, f, size: int, withOuterNodes: bool = True):
+        """ Streams the edges in the order of grid_edges """
+        f.write('<?xml version="1.0" ?>\n')
+        f.write('<edges xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/edges_file.xsd">\n')
 
-            edge_inverse = doc.createElement('edge')
-            edge_inverse.setAttribute('id', 'o' + str(end) + 'ton' + str(start))
-            edge_inverse.setAttribute('from', 'o' + str(end))
-            edge_inverse.setAttribute('to', 'n' + str(start))
+        edge_attributes = (' numLanes="' + str(self.__numberOfLanes) + '" speed="' + str(self.__edgeMaxSpeed) +
+                           '" priority="' + str(self.__edgePriority) + '" type="' + self.__edgeType + '"/>\n')
 
-            edge_inverse.setAttribute('numLanes', str(GridGenerator.__numberOfLanes))
-            edge_inverse.setAttribute('speed', str(GridGenerator.__edgeMaxSpeed))
-            edge_inverse.setAttribute('priority', str(GridGenerator.__edgePriority))
-            edge_inverse.setAttribute('type', GridGenerator.__edgeType)
+        for from_node, to_node in GridGenerator.grid_edges(size, withOuterNodes):
+            f.write(self.__edge_line(from_node, to_node) + edge_attributes)
 
-            root.appendChild(edge)
-            root.appendChild(edge_inverse)
+        f.write('</edges>\n')
 
-            root.appendChild(edge_inverse)
-
-        return doc
+    @staticmethod
+    def __edge_line(from_node: str, to_node: str):
+        return '\t<edge id="' + from_node + 'to' + to_node + '" from="' + from_node + '" to="' + to_node + '"'
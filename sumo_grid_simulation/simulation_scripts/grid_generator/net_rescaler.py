@@ -0,0 +1,129 @@
+import math
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+"""
+    Derives grid nets of any edge length and edge speed from a template net generated by netconvert.
+
+    For a fixed topology (gridSize, numberOfLanes, junction and edge settings) netconvert always produces the
+    same net, only the coordinates, lane lengths and speeds depend on edgeLength and edgeMaxSpeed:
+        - the junction centres scale with the edge length (the net offset is one edge length, so scaling the
+          plain coordinates scales the net coordinates too)
+        - the geometry belonging to a junction (junction shape, internal lanes and internal junctions) does not
+          depend on the edge length and is translated with the junction centre
+        - the ends of the lanes of normal edges move with their junctions, their lengths change accordingly
+        - normal lanes take the new speed, internal lanes are limited by the new speed and by their curvature
+          (the template must be generated with a speed higher than any curvature limit)
+
+    Traffic light programs depend on the speed (yellow times), so nets with traffic lights must be derived from a
+    template generated at the same edgeMaxSpeed.
+"""
+
+
+class NetRescaler:
+
+    @staticmethod
+    def rescale(template_net_file: Path, net_file: Path, scale: float, edgeMaxSpeed: float):
+        """
+        Writes in net_file the template net with its edges scaled by scale and their speed set to edgeMaxSpeed.
+
+        :param template_net_file: net generated by netconvert
+        :param net_file: output net, it is replaced atomically so it can be a hard link to the template
+        :param scale: new edge length / template edge length
+        :param edgeMaxSpeed: the new maximum speed of the edges
+        """
+        tree = ET.parse(template_net_file)
+        root = tree.getroot()
+
+        # displacement of each junction centre
+        offsets = {}
+        for junction in root.iter('junction'):
+            if junction.get('type') == 'internal':
+                continue
+            x, y = float(junction.get('x')), float(junction.get('y'))
+            offsets[junction.get('id')] = ((scale - 1) * x, (scale - 1) * y)
+
+        for junction in root.iter('junction'):
+            if junction.get('type') == 'internal':
+                # internal junctions are named :<junction>_<index>_<lane>
+                dx, dy = offsets[junction.get('id')[1:].rsplit('_', 2)[0]]
+            else:
+                dx, dy = offsets[junction.get('id')]
+            junction.set('x', NetRescaler.__format(float(junction.get('x')) + dx))
+            junction.set('y', NetRescaler.__format(float(junction.get('y')) + dy))
+            if junction.get('shape') is not None:
+                junction.set('shape', NetRescaler.__translate(junction.get('shape'), dx, dy))
+
+        for edge in root.iter('edge'):
+            if edge.get('function') == 'internal':
+                # internal edges are named :<junction>_<index>
+                dx, dy = offsets[edge.get('id')[1:].rsplit('_', 1)[0]]
+                for lane in edge.iter('lane'):
+                    lane.set('shape', NetRescaler.__translate(lane.get('shape'), dx, dy))
+                    lane.set('speed', NetRescaler.__format(min(float(lane.get('speed')), edgeMaxSpeed)))
+            else:
+                start, end = offsets[edge.get('from')], offsets[edge.get('to')]
+                for lane in edge.iter('lane'):
+                    points = NetRescaler.__parse_shape(lane.get('shape'))
+                    old_length = NetRescaler.__shape_length(points)
+                    points = [
+                        (x + start[0] + (end[0] - start[0]) * t, y + start[1] + (end[1] - start[1]) * t)
+                        for (x, y), t in zip(points, NetRescaler.__positions(len(points)))
+                    ]
+                    # netconvert lengths can differ slightly from the shape length, the difference is kept
+                    length = float(lane.get('length')) + NetRescaler.__shape_length(points) - old_length
+                    lane.set('shape', NetRescaler.__format_shape(points))
+                    lane.set('length', NetRescaler.__format(length))
+                    lane.set('speed', NetRescaler.__format(edgeMaxSpeed))
+
+        location = root.find('location')
+        if location is not None:
+            x, y = NetRescaler.__parse_shape(location.get('netOffset'))[0]
+            location.set('netOffset', NetRescaler.__format_shape([(x * scale, y * scale)]))
+            location.set('origBoundary', NetRescaler.__scale_boundary(location.get('origBoundary'), scale))
+            location.set('convBoundary', NetRescaler.__boundary(root))
+
+        tmp_file = Path(str(net_file) + '.tmp')
+        tree.write(tmp_file, encoding='UTF-8', xml_declaration=True)
+        os.replace(tmp_file, net_file)
+
+    @staticmethod
+    def __positions(n: int):
+        """ Relative position along the lane of each of its n shape points """
+        if n == 1:
+            return [0.]
+        return [i / (n - 1) for i in range(n)]
+
+    @staticmethod
+    def __parse_shape(shape: str):
+        return [tuple(float(v) for v in point.split(',')) for point in shape.split()]
+
+    @staticmethod
+    def __format_shape(points: list):
+        return ' '.join(NetRescaler.__format(x) + ',' + NetRescaler.__format(y) for x, y in points)
+
+    @staticmethod
+    def __translate(shape: str, dx: float, dy: float):
+        return NetRescaler.__format_shape([(x + dx, y + dy) for x, y in NetRescaler.__parse_shape(shape)])
+
+    @staticmethod
+    def __shape_length(points: list):
+        return sum(math.hypot(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(points, points[1:]))
+
+    @staticmethod
+    def __scale_boundary(boundary: str, scale: float):
+        return ','.join(NetRescaler.__format(float(v) * scale) for v in boundary.split(','))
+
+    @staticmethod
+    def __boundary(root):
+        """ The convBoundary of the net: the bounding box of the junction centres """
+        points = [(float(junction.get('x')), float(junction.get('y')))
+                  for junction in root.iter('junction') if junction.get('type') != 'internal']
+        xs, ys = [x for x, _ in points], [y for _, y in points]
+        return ','.join(NetRescaler.__format(v) for v in (min(xs), min(ys), max(xs), max(ys)))
+
+    @staticmethod
+    def __format(value: float):
+        # netconvert writes every coordinate, length and speed with 2 decimals
+        return f'{value:.2f}'
@@ -0,0 +1,258 @@
+import json
+import multiprocessing
+import optparse
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import traceback
+from contextlib import closing
+from pathlib import Path
+
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+
+"""
+    Resumable queue of simulations, persisted in a local SQLite file.
+
+    A sweep is a named set of simulate keyword arguments together with the Simulator that runs them. Its jobs go
+    through pending -> running -> done (or failed once all their attempts failed), and every state change is written
+    to disk, so that:
+        - any number of worker processes, started from any shell, claim the pending jobs one at a time
+        - the results of the finished jobs can be read while the sweep is still running
+        - after a crash the jobs of the dead workers are pending again, and the sweep resumes where it stopped
+
+    Example:
+        queue = JobQueue()
+        queue.submit('co2-1000-pts', Simulator(end_time=300), points)
+        queue.run('co2-1000-pts', processes=8)
+        done = queue.results('co2-1000-pts')
+
+    An interrupted sweep is resumed with:
+        python -m sumo_grid_simulation.simulation_scripts.job_queue --sweep co2-1000-pts --workers 8
+"""
+
+
+class JobStatus:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class JobQueue:
+
+    def __init__(self, path: Path = PathUtils.job_queue_file, timeout: float = 60):
+        """
+        :param path: the SQLite file, created if missing
+        :param timeout: seconds to wait for the lock when several processes write at the same time
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS sweeps (name TEXT PRIMARY KEY, simulator BLOB NOT NULL, created REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY, sweep TEXT NOT NULL, position INTEGER NOT NULL, kwargs TEXT NOT NULL, '
+                'status TEXT NOT NULL, worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, '
+                'started REAL, finished REAL, UNIQUE (sweep, position))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (sweep, status)')
+
+    def submit(self, sweep: str, simulator, points: list):
+        """
+        Adds a sweep to the queue. Submitting a sweep again is a no-op for the points already submitted, so the code
+        that creates a sweep can be run again after a crash.
+
+        :param sweep: name of the sweep
+        :param simulator: the Simulator running the jobs of the sweep, it must be picklable
+        :param points: list of dictionaries of simulate keyword arguments, their position in the list identifies them
+        """
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO sweeps (name, simulator, created) VALUES (?, ?, ?)',
+                (sweep, pickle.dumps(simulator), time.time())
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO jobs (sweep, position, kwargs, status) VALUES (?, ?, ?, ?)',
+                [(sweep, position, json.dumps(point, sort_keys=True), JobStatus.PENDING)
+                 for position, point in enumerate(points)]
+            )
+
+    def simulator(self, sweep: str):
+        with closing(self.__connect()) as connection, connection:
+            row = connection.execute('SELECT simulator FROM sweeps WHERE name = ?', (sweep,)).fetchone()
+        assert row is not None, 'Unknown sweep ' + sweep
+        return pickle.loads(row[0])
+
+    def claim(self, sweep: str, worker: str):
+        """ Marks the first pending job of the sweep as running, returns (job id, kwargs) or None if there is none """
+        connection = self.__connect()
+        try:
+            # the write lock is taken before reading, so two workers never claim the same job
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT id, kwargs FROM jobs WHERE sweep = ? AND status = ? ORDER BY position LIMIT 1',
+                (sweep, JobStatus.PENDING)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started = ? WHERE id = ?',
+                    (JobStatus.RUNNING, worker, time.time(), row[0])
+                )
+            connection.commit()
+        finally:
+            connection.close()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def complete(self, job: int, result: dict):
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = NULL, finished = ? WHERE id = ?',
+                (JobStatus.DONE, json.dumps(result), time.time(), job)
+            )
+
+    def fail(self, job: int, error: str, retries: int = 1):
+        """ Records the failure of a job, which is pending again until it has been attempted retries + 1 times """
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'UPDATE jobs SET status = CASE WHEN attempts > ? THEN ? ELSE ? END, error = ?, finished = ? WHERE id = ?',
+                (retries, JobStatus.FAILED, JobStatus.PENDING, error, time.time(), job)
+            )
+
+    def recover(self, sweep: str):
+        """
+        Puts back in pending the running jobs of the workers of this machine that are not alive anymore
+        (the jobs of the other machines are left alone, their workers cannot be checked from here)
+        """
+        host = socket.gethostname()
+        with closing(self.__connect()) as connection, connection:
+            rows = connection.execute(
+                'SELECT id, worker FROM jobs WHERE sweep = ? AND status = ?', (sweep, JobStatus.RUNNING)
+            ).fetchall()
+            stale = [job for job, worker in rows if worker.rsplit(':', 1)[0] == host
+                     and not JobQueue.__alive(int(worker.rsplit(':', 1)[1]))]
+            connection.executemany(
+                'UPDATE jobs SET status = ?, attempts = attempts - 1 WHERE id = ?',
+                [(JobStatus.PENDING, job) for job in stale]
+            )
+        return len(stale)
+
+    def retry_failed(self, sweep: str):
+        """ Puts back in pending the failed jobs of the sweep, with a fresh number of attempts """
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, attempts = 0 WHERE sweep = ? AND status = ?',
+                (JobStatus.PENDING, sweep, JobStatus.FAILED)
+            )
+
+    def progress(self, sweep: str):
+        """ The number of jobs of the sweep in each status """
+        counts = {JobStatus.PENDING: 0, JobStatus.RUNNING: 0, JobStatus.DONE: 0, JobStatus.FAILED: 0}
+        with closing(self.__connect()) as connection, connection:
+            for status, count in connection.execute(
+                    'SELECT status, COUNT(*) FROM jobs WHERE sweep = ? GROUP BY status', (sweep,)):
+                counts[status] = count
+        return counts
+
+    def results(self, sweep: str):
+        """ (kwargs, result) of the finished jobs of the sweep, in the order of the submitted points """
+        with closing(self.__connect()) as connection, connection:
+            rows = connection.execute(
+                'SELECT kwargs, result FROM jobs WHERE sweep = ? AND status = ? ORDER BY position',
+                (sweep, JobStatus.DONE)
+            ).fetchall()
+        return [(json.loads(kwargs), json.loads(result)) for kwargs, result in rows]
+
+    def errors(self, sweep: str):
+        """ (kwargs, error) of the failed jobs of the sweep """
+        with closing(self.__connect()) as connection, connection:
+            rows = connection.execute(
+                'SELECT kwargs, error FROM jobs WHERE sweep = ? AND status = ? ORDER BY position',
+                (sweep, JobStatus.FAILED)
+            ).fetchall()
+        return [(json.loads(kwargs), error) for kwargs, error in rows]
+
+    def work(self, sweep: str, retries: int = 1):
+        """ Runs the pending jobs of the sweep in this process until there are none left, returns the number run """
+        simulator = self.simulator(sweep)
+        worker = socket.gethostname() + ':' + str(os.getpid())
+
+        count = 0
+        while True:
+            job = self.claim(sweep, worker)
+            if job is None:
+                return count
+            job_id, kwargs = job
+            try:
+                result = simulator.simulate(**kwargs)
+            except Exception:
+                self.fail(job_id, traceback.format_exc(), retries)
+            else:
+                self.complete(job_id, result)
+            count += 1
+
+    def run(self, sweep: str, processes: int = None, retries: int = 1):
+        """
+        Runs the sweep with worker processes until all its jobs are done or failed.
+        Workers started elsewhere (other shells, other machines sharing the file) can help at the same time.
+
+        :param processes: number of worker processes, defaults to the number of cpus
+        :param retries: how many times a failing job is run again before it is marked as failed
+        :return: the progress of the sweep
+        """
+        self.recover(sweep)
+
+        workers = [
+            multiprocessing.Process(target=_work, args=(self.path, sweep, retries))
+            for _ in range(processes or os.cpu_count())
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return self.progress(sweep)
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    @staticmethod
+    def __alive(pid: int):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # the process exists but belongs to another user
+            return True
+        return True
+
+
+def _work(path: Path, sweep: str, retries: int):
+    """ Worker process entry point of JobQueue.run """
+    JobQueue(path).work(sweep, retries)
+
+
+if __name__ == '__main__':
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option('--sweep', help='name of the sweep to run or inspect')
+    opt_parser.add_option('--workers', type='int', default=0, help='number of worker processes to run, 0 only prints the progress')
+    opt_parser.add_option('--retries', type='int', default=1, help='how many times a failing job is run again')
+    opt_parser.add_option('--retry-failed', action='store_true', default=False, help='run the failed jobs again')
+    opt_parser.add_option('--queue', default=str(PathUtils.job_queue_file), help='the SQLite file of the queue')
+    options, args = opt_parser.parse_args()
+
+    if options.sweep is None:
+        opt_parser.error('--sweep is required')
+
+    queue = JobQueue(options.queue)
+    if options.retry_failed:
+        queue.retry_failed(options.sweep)
+    if options.workers > 0:
+        queue.run(options.sweep, processes=options.workers, retries=options.retries)
+    print(options.sweep, queue.progress(options.sweep))
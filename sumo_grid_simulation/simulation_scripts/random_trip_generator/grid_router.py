@@ -0,0 +1,107 @@
+import functools
+import math
+
+from sumo_grid_simulation.simulation_scripts.grid_generator.grid_generator import GridGenerator
+
+
+class GridRouter:
+    """
+    Shortest paths on the grids built by GridGenerator, in closed form.
+
+    All the edges of a grid have the same length and speed, so a shortest path is a path with the fewest edges:
+    from an outer node to its inner neighbour, then a Manhattan path between inner nodes (along the columns first,
+    then along the rows) and finally to the destination outer node. The paths are kept in a table filled on demand,
+    so routing cost does not grow with the number of trips once the used node pairs are known.
+
+    Use GridRouter.for_grid to share the router (and its table) of a grid size within a process.
+    """
+
+    def __init__(self, grid_size: int):
+        """
+        :param grid_size: gridSize of the net, as given to GridGenerator
+        """
+        assert grid_size > 1, 'gridSize should be greater than 1'
+        self.grid_size = grid_size
+
+        self.__paths = {}
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def for_grid(grid_size: int):
+        """ The router of a grid size, shared by all the callers of the process """
+        return GridRouter(grid_size)
+
+    def route(self, source: str, sink: str):
+        """
+        :param source: id of the edge the trip starts on
+        :param sink: id of the edge the trip ends on
+        :return: the edge ids of the route, space separated as in a sumo route element
+        """
+        if source == sink:
+            return source
+        origin = source.split('to', 1)[1]
+        target = sink.split('to', 1)[0]
+        path = self.path(origin, target)
+        return source + (' ' + path if path else '') + ' ' + sink
+
+    def path(self, origin: str, target: str):
+        """ The space separated edge ids of a shortest path between two nodes, empty if they are the same """
+        key = (origin, target)
+        if key not in self.__paths:
+            nodes = self.__nodes(origin, target)
+            self.__paths[key] = ' '.join(a + 'to' + b for a, b in zip(nodes, nodes[1:]))
+        return self.__paths[key]
+
+    def __nodes(self, origin: str, target: str):
+        """ The node ids of a shortest path """
+        if origin == target:
+            return [origin]
+
+        nodes = [origin]
+        start = self.position(origin)
+        end = self.position(target)
+        if origin.startswith('o'):
+            start = self.__inner_neighbour(start)
+            nodes.append(self.node_id(*start))
+        inner_end = self.__inner_neighbour(end) if target.startswith('o') else end
+
+        column, row = start
+        step = 1 if inner_end[0] > column else -1
+        for column in range(column + step, inner_end[0] + step, step):
+            nodes.append(self.node_id(column, row))
+        column = inner_end[0]
+        step = 1 if inner_end[1] > row else -1
+        for row in range(row + step, inner_end[1] + step, step):
+            nodes.append(self.node_id(column, row))
+
+        if target.startswith('o'):
+            nodes.append(target)
+        return nodes
+
+    def position(self, node: str):
+        """ (column, row) of a node, the outer nodes are in column or row -1 or grid_size """
+        number = int(node[1:])
+        size = self.grid_size
+        if node.startswith('o'):
+            i = number - 1
+            if i < size:
+                return i, -1
+            if i < 2 * size:
+                return size, i - size
+            if i < 3 * size:
+                return size - 1 - (i - 2 * size), size
+            return -1, size - 1 - (i - 3 * size)
+
+        ring = math.isqrt(number - 1)
+        offset = number - ring ** 2 - 1
+        if offset <= ring:
+            return ring, offset
+        return 2 * ring - offset, ring
+
+    def node_id(self, column: int, row: int):
+        return 'n' + str(GridGenerator.node_number(column, row))
+
+    def __inner_neighbour(self, position: tuple):
+        """ The position of the inner node an outer node is connected to """
+        column, row = position
+        return min(max(column, 0), self.grid_size - 1), min(max(row, 0), self.grid_size - 1)
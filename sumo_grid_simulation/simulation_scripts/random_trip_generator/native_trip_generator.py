@@ -0,0 +1,116 @@
+import numpy as np
+
+from sumo_grid_simulation.simulation_scripts.enums import VehicleClasses
+from sumo_grid_simulation.simulation_scripts.grid_generator.grid_generator import GridGenerator
+from sumo_grid_simulation.simulation_scripts.random_trip_generator.grid_router import GridRouter
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace
+
+
+class NativeTripGenerator:
+    """
+    In-process replacement of RandomTripGenerator for the grids built by GridGenerator.
+
+    It follows the sampling of randomTrips.py with --allow-fringe: departures every period seconds or, with
+    use_binomial, drawn every second from a binomial distribution with n=binomial and p=1/(period*binomial);
+    origins and destinations uniformly drawn among the edges, fringe edges (the edges coming from an outer node
+    for origins, going to an outer node for destinations) being fringe_factor times more likely.
+    The grid structure is known, so the net is not read and the routes are computed in closed form by GridRouter
+    instead of by duarouter.
+    The trips and routes are written in one pass. They do not hold the vehicle type, sumo loads it from the
+    additional file, so the same routes serve every vehicle type.
+
+    The results are reproducible for a given seed, and statistically equivalent to (not identical to)
+    the ones of randomTrips.py.
+    """
+
+    def __init__(self, workspace: Workspace = None):
+        """
+        :param workspace: the workspace the trips and routes are written to.
+                If None the shared files in PathUtils are used
+        """
+        self.workspace = workspace if workspace is not None else PathUtils
+
+    def generate_random_trips(
+        self,
+        vehicle_id: str,
+        vehicle_class: int,
+        grid_size: int,
+        begin_time: float = 0,
+        end_time: float = 3600,
+        period: float = 10,
+        binomial: int = 1,
+        fringe_factor: float = 10,
+        use_binomial: bool = True,
+        seed: int = None,
+        verbosity_level: int = 0
+    ):
+        """Creates random trips and their routes for a single type of vehicle.
+
+        Args:
+            grid_size (int): gridSize of the net, as given to GridGenerator.
+            The other arguments are the ones of RandomTripGenerator.generate_random_trips.
+
+        Returns:
+            int: the number of generated trips
+        """
+        if VehicleClasses.get_by_number(vehicle_class) is None:
+            raise TypeError(
+                'vehicle_class must be an instance of VehicleClasses Enum')
+
+        rng = np.random.default_rng(seed)
+
+        departs = NativeTripGenerator.sample_departures(rng, begin_time, end_time, period, binomial, use_binomial)
+
+        edges = list(GridGenerator.grid_edges(grid_size))
+        source_weights = np.array([fringe_factor if f.startswith('o') else 1. for f, _ in edges])
+        sink_weights = np.array([fringe_factor if t.startswith('o') else 1. for _, t in edges])
+        edge_ids = [f + 'to' + t for f, t in edges]
+        sources = [edge_ids[i] for i in rng.choice(len(edges), size=len(departs), p=source_weights / source_weights.sum())]
+        sinks = [edge_ids[i] for i in rng.choice(len(edges), size=len(departs), p=sink_weights / sink_weights.sum())]
+
+        router = GridRouter.for_grid(grid_size)
+        routes = [router.route(source, sink) for source, sink in zip(sources, sinks)]
+
+        self.__write_trips(vehicle_id, departs, sources, sinks)
+        self.__write_routes(vehicle_id, departs, routes)
+
+        if verbosity_level > 0:
+            print(f'Generated {len(departs)} trips in {self.workspace.trips_file} and {self.workspace.routes_file}')
+
+        return len(departs)
+
+    @staticmethod
+    def sample_departures(rng, begin_time: float, end_time: float, period: float, binomial: int = 1,
+                          use_binomial: bool = False):
+        """ The sorted departure times of the trips """
+        if not use_binomial:
+            return np.arange(begin_time, end_time, period)
+
+        # binomial draws every second, for an average arrival rate of 1 / period
+        probability = 1. / period / binomial
+        assert probability <= 1, 'period * binomial must be at least 1'
+        seconds = np.arange(begin_time, end_time, 1.)
+        counts = rng.binomial(binomial, probability, size=len(seconds))
+        return np.repeat(seconds, counts)
+
+    @staticmethod
+    def __header():
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+                '<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">\n')
+
+    def __write_trips(self, vehicle_id: str, departs, sources: list, sinks: list):
+        with open(self.workspace.trips_file, 'w') as f:
+            f.write(NativeTripGenerator.__header())
+            for i, (depart, source, sink) in enumerate(zip(departs, sources, sinks)):
+                f.write(f'    <trip id="{i}" type="{vehicle_id}" depart="{depart:.2f}" from="{source}" to="{sink}"/>\n')
+            f.write('</routes>\n')
+
+    def __write_routes(self, vehicle_id: str, departs, routes: list):
+        with open(self.workspace.routes_file, 'w') as f:
+            f.write(NativeTripGenerator.__header())
+            for i, (depart, route) in enumerate(zip(departs, routes)):
+                f.write(f'    <vehicle id="{i}" type="{vehicle_id}" depart="{depart:.2f}">\n'
+                        f'        <route edges="{route}"/>\n'
+                        f'    </vehicle>\n')
+            f.write('</routes>\n')
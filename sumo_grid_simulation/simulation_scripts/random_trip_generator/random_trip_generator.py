@@ -3,12 +3,19 @@ import subprocess
 
 
 from sumo_grid_simulation.simulation_scripts.enums import VehicleClasses
-from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace, checkSumoHome
 
 class RandomTripGenerator:
 
-    @staticmethod
+    def __init__(self, workspace: Workspace = None):
+        """
+        :param workspace: the workspace the net is read from and the trips and routes are written to.
+                If None the shared files in PathUtils are used
+        """
+        self.workspace = workspace if workspace is not None else PathUtils
+
     def generate_random_trips(
+        self,
         vehicle_id: str,
         vehicle_class: int,
         begin_time: float = 0,
@@ -44,17 +51,18 @@ class RandomTripGenerator:
         vehicle_class = VehicleClasses.get_by_number(vehicle_class)
 
 
+        checkSumoHome()
         python_command = ['python',
-                          os.environ['SUMO_HOME'] + '/tools/randomTrips.py',
-                          '--net-file', str(PathUtils.grid_net_file),
-                          '--output-trip-file', str(PathUtils.trips_file),
-                          '--route-file', str(PathUtils.routes_file),
+                          os.path.join(os.environ['SUMO_HOME'], 'tools', 'randomTrips.py'),
+                          '--net-file', str(self.workspace.grid_net_file),
+                          '--output-trip-file', str(self.workspace.trips_file),
+                          '--route-file', str(self.workspace.routes_file),
                           '--begin', str(float(begin_time)),
                           '--end', str(float(end_time)),
                           '--allow-fringe',
                           '--fringe-factor', str(float(fringe_factor)),
                           '--validate',
-                          '--additional-files', str(PathUtils.additional_file),
+                          '--additional-files', str(self.workspace.additional_file),
                           '--trip-attributes', 'type=\"' + str(vehicle_id) + '\"',
                           '--edge-permission', str(vehicle_class.tag),
                           '--period', str(float(period))
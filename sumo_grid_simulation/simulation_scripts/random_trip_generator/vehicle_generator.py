@@ -4,7 +4,7 @@ from xml.dom.minidom import Document, Element
 from pathlib import Path
 
 from sumo_grid_simulation.simulation_scripts.enums import VehicleClasses, EmmissionClasses
-from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils, Workspace
 
 
 class Vehicle:
@@ -62,12 +62,18 @@ class Vehicle:
 
 class VehicleGenerator:
 
-    @staticmethod
-    def generate_additional_file(vehicles: list = [], verbosity_level: int = 0):
+    def __init__(self, workspace: Workspace = None):
+        """
+        :param workspace: the workspace the additional file is written to.
+                If None the shared files in PathUtils are used
+        """
+        self.workspace = workspace if workspace is not None else PathUtils
+
+    def generate_additional_file(self, vehicles: list = [], verbosity_level: int = 0):
         if verbosity_level > 0:
             print("Creating additional file with " + str(len(vehicles)) + " vehicle(s).")
         additional_file = VehicleGenerator.__generate_additional_file(vehicles, verbosity_level)
-        f_add = open(PathUtils.additional_file, "w")
+        f_add = open(self.workspace.additional_file, "w")
         f_add.write(additional_file)
         f_add.close()
         if verbosity_level > 0:
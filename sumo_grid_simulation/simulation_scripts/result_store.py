@@ -0,0 +1,81 @@
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+from sumo_grid_simulation.simulation_scripts.utils import PathUtils
+
+"""
+    Persistent store of simulation results, in a local SQLite file.
+
+    Results are keyed on a canonical scenario descriptor (see Simulator.result_key): all the simulate
+    arguments, the simulator settings influencing the outputs and the sumo version. Any notebook or loop using a
+    Simulator with the same store reuses the results of the scenarios already simulated.
+"""
+
+
+class ResultStore:
+
+    def __init__(self, path: Path = PathUtils.result_store_file, timeout: float = 60):
+        """
+        :param path: the SQLite file, created if missing
+        :param timeout: seconds to wait for the lock when several processes write at the same time
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, scenario TEXT NOT NULL, outputs TEXT NOT NULL, created REAL NOT NULL)'
+            )
+
+    @staticmethod
+    def key(scenario: dict):
+        return hashlib.sha256(ResultStore.__canonical(scenario).encode()).hexdigest()
+
+    def get(self, scenario: dict):
+        """ The outputs stored for the scenario, None if it was never simulated """
+        return self.get_many([scenario])[0]
+
+    def get_many(self, scenarios: list):
+        """ The outputs stored for each scenario, None for the ones never simulated """
+        keys = [ResultStore.key(scenario) for scenario in scenarios]
+        found = {}
+        with closing(self.__connect()) as connection, connection:
+            # the number of parameters of a query is limited, keys are looked up in chunks
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = connection.execute(
+                    'SELECT key, outputs FROM results WHERE key IN (' + ','.join('?' * len(chunk)) + ')', chunk
+                )
+                found.update((key, json.loads(outputs)) for key, outputs in rows)
+        return [found.get(key) for key in keys]
+
+    def put(self, scenario: dict, outputs: dict):
+        with closing(self.__connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO results (key, scenario, outputs, created) VALUES (?, ?, ?, ?)',
+                (ResultStore.key(scenario), ResultStore.__canonical(scenario), json.dumps(outputs), time.time())
+            )
+
+    def scenarios(self):
+        """ (scenario, outputs) of every stored result, oldest first """
+        with closing(self.__connect()) as connection, connection:
+            rows = connection.execute('SELECT scenario, outputs FROM results ORDER BY created').fetchall()
+        return [(json.loads(scenario), json.loads(outputs)) for scenario, outputs in rows]
+
+    def __len__(self):
+        with closing(self.__connect()) as connection, connection:
+            return connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    # "with connection" only commits or rolls back, the connections are closed by closing
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    @staticmethod
+    def __canonical(scenario: dict):
+        return json.dumps(scenario, sort_keys=True)
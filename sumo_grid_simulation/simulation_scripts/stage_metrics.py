@@ -0,0 +1,68 @@
+import contextlib
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, only the wall and cpu time of the python process are measured there
+    resource = None
+
+"""
+    Wall time and cpu time of the stages of a simulation, with the memory high water mark reached after each one.
+
+    The cpu time includes the child processes (netconvert, randomTrips.py, duarouter and sumo when it is not run
+    in process), counted once they have exited. The memory is not measured per stage: rss_high_water_mark is the
+    peak RSS reached so far by the python process or by its largest child, read at the end of the stage. It is the
+    largest of all the stages run before, and tells which stage first raised the peak.
+"""
+
+
+class StageMetrics:
+
+    def __init__(self):
+        # stage name -> {'wall': s, 'cpu': s, 'rss_high_water_mark': MB, 'calls': n}
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        """
+        Context manager adding the resources used by its block to the given stage.
+        A dotted name, e.g. 'net.netconvert', is a part of the stage before the dot and is not counted in the total.
+        """
+        wall, cpu = time.perf_counter(), StageMetrics.__cpu_time()
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(stage, {'wall': 0., 'cpu': 0., 'rss_high_water_mark': None, 'calls': 0})
+            record['wall'] += time.perf_counter() - wall
+            record['cpu'] += StageMetrics.__cpu_time() - cpu
+            record['calls'] += 1
+            high_water_mark = StageMetrics.__rss_high_water_mark()
+            if high_water_mark is not None:
+                record['rss_high_water_mark'] = high_water_mark
+
+    def as_dict(self):
+        top_level = [record for stage, record in self.stages.items() if '.' not in stage]
+        return {
+            'stages': {stage: dict(record) for stage, record in self.stages.items()},
+            'total_wall': sum(record['wall'] for record in top_level),
+            'total_cpu': sum(record['cpu'] for record in top_level)
+        }
+
+    @staticmethod
+    def __cpu_time():
+        if resource is None:
+            return time.process_time()
+        own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+    @staticmethod
+    def __rss_high_water_mark():
+        """ Peak resident set size in MB of the process and of its waited children since the process started """
+        if resource is None:
+            return None
+        max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # bytes on macOS, kilobytes elsewhere
+        return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
@@ -0,0 +1,87 @@
+import numpy as np
+
+from sumo_grid_simulation.simulation_scripts.emission_model import EmissionModel
+from sumo_grid_simulation.simulation_scripts.utils import import_sumo_module
+
+
+class TrajectoryRecorder:
+    """
+    Captures the speed and the acceleration of every vehicle at every step of a running simulation, so that its
+    emissions are computed at the end with the vectorized EmissionModel instead of being written by sumo.
+
+    The values are read through traci subscriptions: a vehicle is subscribed the first time it is seen, and its
+    values of that step are read directly. A subscription replaces the previous one of the vehicle, so the observers
+    of a connection subscribe the union of their variables (see Simulator.subscription_variables). Only one call of the control loop per step (control_interval 0) gives
+    every sample. The acceleration is the one sumo computes the emissions with, see EmissionModel.read_trajectories
+    """
+
+    # the traci variables the vehicles are subscribed to, names of traci.constants
+    variables = ('VAR_SPEED', 'VAR_ACCELERATION')
+
+    def __init__(self):
+        self.__classes = []  # (emission class, vehicle class) of each class index
+        self.__vehicles = {}  # vehicle -> class index
+        # one array per step
+        self.__speeds = []
+        self.__accels = []
+        self.__class_indices = []
+
+    def observe(self, connection, variables: tuple = None):
+        """
+        Records the vehicles of the current step, to be called after each call of the control loop
+
+        :param variables: the variables to subscribe the new vehicles to, the variables of every observer of the
+                connection. Defaults to TrajectoryRecorder.variables
+        """
+        tc = import_sumo_module('traci.constants')
+        results = connection.vehicle.getAllSubscriptionResults()
+
+        speeds, accels, classes = [], [], []
+        for vehicle in connection.vehicle.getIDList():
+            if vehicle in self.__vehicles:
+                values = results[vehicle]
+                speed, accel = values[tc.VAR_SPEED], values[tc.VAR_ACCELERATION]
+            else:
+                connection.vehicle.subscribe(vehicle, [getattr(tc, name) for name in variables or self.variables])
+                key = (connection.vehicle.getEmissionClass(vehicle), connection.vehicle.getVehicleClass(vehicle))
+                if key not in self.__classes:
+                    self.__classes.append(key)
+                self.__vehicles[vehicle] = self.__classes.index(key)
+                speed, accel = connection.vehicle.getSpeed(vehicle), connection.vehicle.getAcceleration(vehicle)
+            speeds.append(speed)
+            accels.append(accel)
+            classes.append(self.__vehicles[vehicle])
+
+        self.__speeds.append(np.array(speeds, dtype=float))
+        self.__accels.append(np.array(accels, dtype=float))
+        self.__class_indices.append(np.array(classes, dtype=np.int32))
+
+    def trajectories(self):
+        """
+        The samples recorded: dictionary of arrays 'class' (sumo emission class), 'vehicle_class', 'speed' and 'accel',
+        as returned by EmissionModel.read_trajectories
+        """
+        classes = np.array(self.__classes + [(None, None)], dtype=object)
+        indices = np.concatenate(self.__class_indices) if self.__class_indices else np.empty(0, dtype=np.int32)
+        return {
+            'class': classes[indices, 0],
+            'vehicle_class': classes[indices, 1],
+            'speed': np.concatenate(self.__speeds) if self.__speeds else np.empty(0),
+            'accel': np.concatenate(self.__accels) if self.__accels else np.empty(0)
+        }
+
+    def report(self, model: EmissionModel, emission_classes: list = None):
+        """
+        The emissions of the samples recorded, with the keys of Simulator.parse_emissions_output
+
+        :param emission_classes: optional emission classes (sumo names) whose emissions are also computed as if every
+                vehicle was of that class, in the 'emissions_by_class' entry (class name -> totals)
+        """
+        trajectories = self.trajectories()
+        out = model.trajectory_totals(trajectories)
+        if emission_classes is not None:
+            out['emissions_by_class'] = {
+                emission_class: model.trajectory_totals(trajectories, emission_class)
+                for emission_class in emission_classes
+            }
+        return out
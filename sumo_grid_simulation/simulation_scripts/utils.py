@@ -1,16 +1,31 @@
 from pathlib import Path
+import importlib
+import shutil
 import sys
 import os
+import tempfile
 
 def get_project_root() -> Path:
     return Path(__file__).resolve().parent.parent.parent.absolute()
 
 def checkSumoHome():
-    if 'SUMO_HOME' in os.environ:
-        sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
-    else:
-        print("SUMO_HOME must be declared")
-        sys.exit(1)
+    """ Adds the sumo tools (traci, sumolib, randomTrips.py) to the path, raises EnvironmentError without SUMO_HOME """
+    if 'SUMO_HOME' not in os.environ:
+        raise EnvironmentError('SUMO_HOME must be declared')
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    if tools not in sys.path:
+        sys.path.append(tools)
+
+def import_sumo_module(name: str):
+    """
+    Imports traci, sumolib or one of their submodules on first use, so that importing the simulation modules does not
+    load them nor require SUMO_HOME. The pip packages are used when installed, else the ones of SUMO_HOME/tools
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        checkSumoHome()
+        return importlib.import_module(name)
 
 class PathUtils:
 
@@ -24,6 +39,21 @@ class PathUtils:
     simulation_output_files_folder = sumo_grid_simulation_folder / 'simulation_output_files'
     simulation_scripts_folder = sumo_grid_simulation_folder / 'simulation_scripts'
 
+    # Per-run scratch folders (see Workspace)
+    workspaces_folder = simulation_output_files_folder / 'workspaces'
+
+    # Cache of the generated nets, vehicle types and trips (see ArtifactCache)
+    artifact_cache_folder = simulation_output_files_folder / 'artifact_cache'
+
+    # Store of the simulation results (see ResultStore)
+    result_store_file = simulation_output_files_folder / 'results.sqlite'
+
+    # Queue of the simulations of long sweeps (see JobQueue)
+    job_queue_file = simulation_output_files_folder / 'job_queue.sqlite'
+
+    # Columnar store of the simulation runs and designs (see ColumnStore)
+    column_store_folder = simulation_output_files_folder / 'column_store'
+
     # Grid plain xml folder
     grid_plain_xml_folder = simulation_input_files_folder / 'grid_plain_xml'
 
@@ -51,12 +81,84 @@ class PathUtils:
     statistics_file = simulation_output_files_folder / 'statistics_output.xml'
     trip_info_file = simulation_output_files_folder / 'tripinfo.xml'
 
+    # Aggregated output files (see OutputMode)
+    mean_data_file = simulation_input_files_folder / 'mean_data.add.xml'
+    traffic_mean_data_file = simulation_output_files_folder / 'traffic_mean_data.xml'
+    emissions_mean_data_file = simulation_output_files_folder / 'emissions_mean_data.xml'
+    noise_mean_data_file = simulation_output_files_folder / 'noise_mean_data.xml'
+
+    # Parameters of the vectorized emission model (see EmissionModel)
+    emission_model_file = simulation_input_files_folder / 'hbefa3_emission_model.json'
+    # Emission outputs of sumo the emission model is checked against
+    emission_reference_folder = simulation_input_files_folder / 'emission_reference'
+
     # Sumo configuration files
     sumo_config_file = simulation_input_files_folder / 'grid.sumocfg'
     gui_view_file = simulation_input_files_folder / 'custom_sumo_gui_view.xml'
 
 
-
-
-
-
+class Workspace:
+    """
+    Scratch folder holding every file that a single simulation generates.
+
+    The attribute names mirror the ones of PathUtils, so a Workspace can be passed wherever the generators
+    previously read the shared class-level paths. Read-only inputs (edge types, gui settings) still point to
+    the shared simulation_input_files folder.
+
+    Each Simulator.simulate call uses its own Workspace, so several simulations can run at the same time
+    on one machine without overwriting each other's files.
+    """
+
+    # Read-only inputs shared by all the workspaces
+    edge_types_file = PathUtils.edge_types_file
+    gui_view_file = PathUtils.gui_view_file
+
+    def __init__(self, folder: Path = None, prefix: str = 'run_'):
+        """
+        :param folder: folder to use for the workspace, created if missing. If None a fresh uniquely named
+                folder is created inside PathUtils.workspaces_folder
+        :param prefix: prefix of the generated folder name, only used when folder is None
+        """
+        if folder is None:
+            os.makedirs(PathUtils.workspaces_folder, exist_ok=True)
+            folder = Path(tempfile.mkdtemp(prefix=prefix, dir=PathUtils.workspaces_folder))
+        else:
+            folder = Path(folder)
+            os.makedirs(folder, exist_ok=True)
+
+        self.folder = folder
+        self.name = folder.name
+
+        # Files for the grid
+        self.edges_file = folder / 'edges.edg.xml'
+        self.nodes_file = folder / 'nodes.nod.xml'
+        self.grid_net_file = folder / 'grid.net.xml'
+
+        # Files for the trips
+        self.routes_file = folder / 'veh_passenger.rou.xml'
+        self.trips_file = folder / 'veh_passenger.trips.xml'
+        self.additional_file = folder / 'veh.add.xml'
+
+        # Output files
+        self.emissions_file = folder / 'emissions_output.xml'
+        self.statistics_file = folder / 'statistics_output.xml'
+        self.trip_info_file = folder / 'tripinfo.xml'
+
+        # Aggregated output files
+        self.mean_data_file = folder / 'mean_data.add.xml'
+        self.traffic_mean_data_file = folder / 'traffic_mean_data.xml'
+        self.emissions_mean_data_file = folder / 'emissions_mean_data.xml'
+        self.noise_mean_data_file = folder / 'noise_mean_data.xml'
+
+    def cleanup(self):
+        """ Removes the workspace folder and everything in it """
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    def __repr__(self):
+        return 'Workspace(' + str(self.folder) + ')'